@@ -0,0 +1,211 @@
+import os
+import sys
+import time
+import threading
+import weakref
+from collections import OrderedDict
+
+# 参照されなくなったモデルを、すぐに解放せずにメモリへ残しておく最大数
+# (同じモデルを使うパイプラインを作り直した場合に、再ロードせずに済むようにする)
+MODEL_REGISTRY_MAX_IDLE_MODELS = int(os.getenv("RAG_MODEL_REGISTRY_MAX_IDLE_MODELS", "1"))
+
+
+def estimate_model_bytes(model) -> int:
+    """
+    モデルのパラメータ・バッファが使用するメモリ量 (バイト) を概算する。
+    PyTorchのモジュール (SentenceTransformer, AutoModel など) と、
+    それを .model 属性やタプルで保持するオブジェクト (CrossEncoder, (tokenizer, model) など) に対応する。
+    """
+    if isinstance(model, (tuple, list)):
+        return sum(estimate_model_bytes(m) for m in model)
+    if callable(getattr(model, "parameters", None)):
+        total = 0
+        for tensor in model.parameters():
+            total += tensor.numel() * tensor.element_size()
+        if callable(getattr(model, "buffers", None)):
+            for tensor in model.buffers():
+                total += tensor.numel() * tensor.element_size()
+        return total
+    inner = getattr(model, "model", None)
+    if inner is not None and inner is not model:
+        return estimate_model_bytes(inner)
+    return 0
+
+
+class _ModelEntry:
+    def __init__(self, key: tuple, model):
+        self.key = key
+        self.model = model
+        self.refcount = 0
+        self.bytes = estimate_model_bytes(model)
+        self.loaded_at = time.time()
+        self.released_at = None
+
+
+class ModelRegistry:
+    """
+    [手法解説: 参照カウント付きモデルレジストリ]
+    埋め込みモデル・CrossEncoder・NLIモデルを、(クラス, モデル名, デバイス, dtype) をキーとしてプロセス内で共有する。
+
+    仕組み:
+    - acquire() で、同じキーのモデルがロード済みであればそれを返し、なければ loader でロードする。参照数を1増やす。
+    - release() で参照数を1減らす。0になったモデルは「未使用」として最大 max_idle_models 件まで保持し、
+      超えた分は最も長く使われていないものから解放する。
+    - コンポーネントは register_owner() で自身とキーを結び付けておくと、ガベージコレクション時に自動で release される。
+
+    期待される効果:
+    - 同じモデル (例: intfloat/multilingual-e5-large) を使う複数のパイプラインで、モデルが1回だけロードされる。
+    - ワーカープロセスあたりのメモリ使用量が、モデルの重複分だけ減る。
+    """
+
+    def __init__(self, max_idle_models: int = MODEL_REGISTRY_MAX_IDLE_MODELS):
+        self.max_idle_models = max(0, max_idle_models)
+        self._entries: dict[tuple, _ModelEntry] = {}
+        self._idle = OrderedDict()  # 参照数が0のキー (古い順)
+        self._lock = threading.Lock()
+        self._loading_locks: dict[tuple, threading.Lock] = {}
+        self.loads = 0
+        self.reuses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(model_class: str, model_name: str, device: str, dtype=None, **load_kwargs) -> tuple:
+        """モデルのキーを作成する。ロード時の設定 (max_length など) が異なる場合は別のモデルとして扱う"""
+        return (model_class, model_name, device, str(dtype) if dtype is not None else "default", tuple(sorted(load_kwargs.items())))
+
+    def acquire(self, key: tuple, loader):
+        """
+        キーに対応するモデルを取得する (参照数を1増やす)。
+
+        Args:
+            key (tuple): make_key() で作成したキー。
+            loader: モデルが未ロードの場合に呼び出す、引数なしの関数。
+        """
+        with self._lock:
+            entry = self._take(key)
+            if entry is not None:
+                return entry.model
+            loading_lock = self._loading_locks.setdefault(key, threading.Lock())
+
+        # 同じモデルを複数のスレッドが同時にロードしないよう、キーごとにロックする
+        with loading_lock:
+            with self._lock:
+                entry = self._take(key)
+                if entry is not None:
+                    return entry.model
+            model = loader()
+            with self._lock:
+                entry = _ModelEntry(key, model)
+                entry.refcount = 1
+                self._entries[key] = entry
+                self.loads += 1
+                self._loading_locks.pop(key, None)
+            return model
+
+    def _take(self, key: tuple):
+        """ロック取得済みの状態で呼び出す。ロード済みであれば参照数を増やして返す"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        entry.refcount += 1
+        entry.released_at = None
+        self._idle.pop(key, None)
+        self.reuses += 1
+        return entry
+
+    def release(self, key: tuple):
+        """モデルの参照数を1減らす。0になった場合は未使用として扱い、上限を超えた分を解放する"""
+        evicted = 0
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.refcount == 0:
+                return
+            entry.refcount -= 1
+            if entry.refcount == 0:
+                entry.released_at = time.time()
+                self._idle[key] = entry
+                evicted = self._evict_idle(self.max_idle_models)
+        if evicted:
+            _free_device_memory()
+
+    def register_owner(self, owner, key: tuple):
+        """
+        owner (コンポーネント) がガベージコレクションされた時に、自動で release() されるようにする。
+        返り値の関数を呼び出すと、その時点で release() する (2回目以降は何もしない)。
+        """
+        return weakref.finalize(owner, self.release, key)
+
+    def evict_unused(self) -> int:
+        """未使用のモデルをすべて解放し、解放した数を返す"""
+        with self._lock:
+            evicted = self._evict_idle(0)
+        if evicted:
+            _free_device_memory()
+        return evicted
+
+    def _evict_idle(self, keep: int) -> int:
+        evicted = 0
+        while len(self._idle) > keep:
+            key, entry = self._idle.popitem(last=False)
+            del self._entries[key]
+            entry.model = None
+            evicted += 1
+            self.evictions += 1
+            print(f"未使用のモデルを解放しました: {key[0]} ({key[1]}, {key[2]})")
+        return evicted
+
+    def stats(self) -> dict:
+        """ロード済みモデルの参照数・メモリ使用量と、ロード・再利用・解放の件数を返す"""
+        with self._lock:
+            models = [
+                {
+                    "class": entry.key[0],
+                    "model_name": entry.key[1],
+                    "device": entry.key[2],
+                    "dtype": entry.key[3],
+                    "refcount": entry.refcount,
+                    "bytes": entry.bytes,
+                    "idle_seconds": time.time() - entry.released_at if entry.released_at else 0.0,
+                }
+                for entry in self._entries.values()
+            ]
+            return {
+                "models": models,
+                "total_bytes": sum(m["bytes"] for m in models),
+                "loads": self.loads,
+                "reuses": self.reuses,
+                "evictions": self.evictions,
+            }
+
+
+def _free_device_memory():
+    """解放したモデルがGPUメモリを使っていた場合に、PyTorchのキャッシュを返却する"""
+    torch = sys.modules.get("torch")
+    if torch is not None and torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+
+_default_registry = ModelRegistry()
+
+
+def get_model_registry() -> ModelRegistry:
+    """プロセス全体で共有するモデルレジストリを返す"""
+    return _default_registry
+
+
+def acquire_shared_model(owner, model_class: str, model_name: str, device: str, loader, dtype=None, **load_kwargs):
+    """
+    共有レジストリからモデルを取得し、owner がガベージコレクションされた時に自動で解放されるようにする。
+
+    Returns:
+        tuple: (モデル, 明示的に解放するための関数)。
+    """
+    registry = get_model_registry()
+    key = registry.make_key(model_class, model_name, device, dtype, **load_kwargs)
+    model = registry.acquire(key, loader)
+    return model, registry.register_owner(owner, key)
+
+
+def get_model_registry_stats() -> dict:
+    """共有レジストリの統計情報を返す"""
+    return get_model_registry().stats()
@@ -0,0 +1,172 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+# 環境変数でキャッシュの挙動を調整できるようにする
+# RAG_STAGE_CACHE_DIR を指定した場合のみ、メモリに加えてディスクにも保存する (プロセス再起動後も再利用できる)
+STAGE_CACHE_DIR = os.getenv("RAG_STAGE_CACHE_DIR") or None
+STAGE_CACHE_MAX_ENTRIES = int(os.getenv("RAG_STAGE_CACHE_MAX_ENTRIES", "2048"))
+STAGE_CACHE_DISK_SIZE_LIMIT_MB = int(os.getenv("RAG_STAGE_CACHE_DISK_SIZE_LIMIT_MB", "512"))
+# キャッシュの有効期限 (秒)。0以下の場合は期限なし
+STAGE_CACHE_TTL_SECONDS = int(os.getenv("RAG_STAGE_CACHE_TTL_SECONDS", "0"))
+
+
+class StageCache:
+    """
+    [手法解説: ステージ単位のメモ化]
+    RAGパイプラインの各ステージ (HyDE, クエリのベクトル化, リランキングのスコア計算) の出力を、
+    入力から計算したキーで保存するキャッシュ。
+
+    仕組み:
+    - メモリ上のLRU (OrderedDict) に最大 max_entries 件を保持し、古いものから削除する。
+    - disk_dir を指定した場合は diskcache にも保存し、メモリにない場合はディスクから読み戻す。
+    - ttl_seconds を指定した場合は、保存から一定時間が経過したものをミスとして扱う。
+
+    期待される効果:
+    - 同じ患者の再生成や、所見を少し修正しただけの再生成で、変化のないステージの計算を省略できる。
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_entries: int = STAGE_CACHE_MAX_ENTRIES,
+        disk_dir: str | None = None,
+        ttl_seconds: float = STAGE_CACHE_TTL_SECONDS,
+    ):
+        """
+        Args:
+            name (str): ステージ名 (統計情報とディスク上のサブディレクトリ名に使用)。
+            max_entries (int): メモリ上に保持する最大件数。
+            disk_dir (str | None): ディスクに永続化する場合の保存先ディレクトリ。Noneの場合はメモリのみ。
+            ttl_seconds (float): 有効期限 (秒)。0以下の場合は期限なし。
+        """
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds if ttl_seconds and ttl_seconds > 0 else None
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self._disk = None
+        if disk_dir:
+            import diskcache
+            self._disk = diskcache.Cache(
+                os.path.join(disk_dir, name),
+                size_limit=STAGE_CACHE_DISK_SIZE_LIMIT_MB * 1024 * 1024,
+                eviction_policy="least-recently-used",
+            )
+
+    @staticmethod
+    def make_key(*parts) -> str:
+        """入力 (モデル名・テキストなど) からキーを作成する"""
+        payload = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str):
+        """キャッシュから値を取得する。存在しない場合は None を返す"""
+        with self._lock:
+            if key in self._memory:
+                value, expires_at = self._memory[key]
+                if expires_at is None or time.monotonic() < expires_at:
+                    self._memory.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._memory[key]
+
+        value = None
+        if self._disk is not None:
+            try:
+                value = self._disk.get(key)
+            except Exception as e:
+                print(f"警告: ステージキャッシュ '{self.name}' の読み込みに失敗しました: {e}")
+
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.disk_hits += 1
+            self._put_memory(key, value)
+        return value
+
+    def set(self, key: str, value):
+        """値をキャッシュに保存する"""
+        if value is None:
+            return
+        with self._lock:
+            self._put_memory(key, value)
+        if self._disk is not None:
+            try:
+                self._disk.set(key, value, expire=self.ttl_seconds)
+            except Exception as e:
+                print(f"警告: ステージキャッシュ '{self.name}' への保存に失敗しました: {e}")
+
+    def get_or_compute(self, key: str, compute_fn):
+        """キャッシュにあればそれを返し、なければ compute_fn() の結果を保存して返す"""
+        value = self.get(key)
+        if value is None:
+            value = compute_fn()
+            self.set(key, value)
+        return value
+
+    def _put_memory(self, key: str, value):
+        # 呼び出し元で self._lock を取得していること
+        expires_at = time.monotonic() + self.ttl_seconds if self.ttl_seconds is not None else None
+        self._memory[key] = (value, expires_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def clear(self):
+        """キャッシュを全て削除する"""
+        with self._lock:
+            self._memory.clear()
+            self.hits = self.disk_hits = self.misses = 0
+        if self._disk is not None:
+            self._disk.clear()
+
+    def stats(self) -> dict:
+        """ヒット・ミス件数と現在の件数を返す"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self._memory),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "persistent": self._disk is not None,
+            }
+
+
+_stage_caches = {}
+_stage_caches_lock = threading.Lock()
+
+
+def get_stage_cache(name: str, max_entries: int | None = None, disk_dir: str | None = None) -> StageCache:
+    """
+    ステージ名ごとに共有されるキャッシュを返す。
+    同じモデルを使う複数のパイプライン間でも結果を再利用できるよう、プロセス内で共有する。
+    """
+    with _stage_caches_lock:
+        if name not in _stage_caches:
+            _stage_caches[name] = StageCache(
+                name,
+                max_entries=max_entries or STAGE_CACHE_MAX_ENTRIES,
+                disk_dir=disk_dir or STAGE_CACHE_DIR,
+            )
+        return _stage_caches[name]
+
+
+def get_stage_cache_stats() -> dict:
+    """全ステージのキャッシュの統計情報を返す"""
+    with _stage_caches_lock:
+        caches = list(_stage_caches.values())
+    return {cache.name: cache.stats() for cache in caches}
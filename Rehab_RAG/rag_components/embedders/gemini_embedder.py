@@ -5,6 +5,7 @@ from google.genai import types
 from dotenv import load_dotenv
 from tqdm import tqdm
 import backoff
+from ..caches.stage_cache import get_stage_cache
 
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 PROJECT_ROOT = os.path.abspath(os.path.join(SCRIPT_DIR, '..', '..'))
@@ -22,7 +23,7 @@ class GeminiEmbedder:
     - RAGのユースケースに合わせて `task_type` を指定することで、検索精度を最適化できる。
     """
 
-    def __init__(self, model_name: str = "gemini-embedding-001", batch_size: int = 32, requests_per_minute: int = 750):
+    def __init__(self, model_name: str = "gemini-embedding-001", batch_size: int = 32, requests_per_minute: int = 750, use_cache: bool = True):
         """
         コンストラクタ。Geminiクライアントを初期化し、レート制限設定を保存します。
         
@@ -31,6 +32,7 @@ class GeminiEmbedder:
             batch_size (int): 一度のAPIコールで処理するテキストの数。レート制限対策の要。
             requests_per_minute (int): 1分あたりのAPIコール回数の上限。無料枠の場合、TPMも考慮して余裕を持った値に設定する。
                                        Gemini Embeddingの無料枠RPMは100, TPMは30,000。
+            use_cache (bool): クエリのベクトルをキャッシュして再利用するかどうか (APIコールの節約になる)。
         """
         if not os.getenv("GEMINI_API_KEY"):
             raise ValueError("環境変数 `GEMINI_API_KEY` が設定されていません。")
@@ -40,6 +42,7 @@ class GeminiEmbedder:
         self.model_name = model_name
         self.batch_size = batch_size
         self.sleep_duration = 60.0 / requests_per_minute
+        self.query_cache = get_stage_cache("query_embedding") if use_cache else None
         print(f"Embeddingモデルの初期化完了。バッチサイズ: {self.batch_size}, APIコール間の待機時間: {self.sleep_duration:.2f}秒")
 
     @backoff.on_exception(
@@ -108,9 +111,41 @@ class GeminiEmbedder:
         単一のクエリテキストをベクトル化するメソッド。
         ユーザーからの質問を検索する際に使用します。
         """
-        result = self.client.models.embed_content(
-            model=self.model_name,
-            contents=[text],
-            config=types.EmbedContentConfig(task_type="RETRIEVAL_QUERY")
+        if self.query_cache is None:
+            return self._embed_queries_uncached([text])[0]
+
+        return self.query_cache.get_or_compute(
+            self._query_cache_key(text), lambda: self._embed_queries_uncached([text])[0]
         )
-        return list(result.embeddings[0].values)
\ No newline at end of file
+
+    def embed_queries(self, texts: list[str]) -> list[list[float]]:
+        """
+        複数のクエリテキスト (HyDEやMulti-Queryで拡張したもの) を一度にベクトル化するメソッド。
+        キャッシュ済みのクエリは再利用し、残りを1回のAPIコール (batch_size件ずつ) でベクトル化します。
+        """
+        if self.query_cache is None:
+            return self._embed_queries_uncached(texts)
+
+        cache_keys = [self._query_cache_key(text) for text in texts]
+        embeddings = [self.query_cache.get(key) for key in cache_keys]
+        missing_indices = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if missing_indices:
+            new_embeddings = self._embed_queries_uncached([texts[i] for i in missing_indices])
+            for i, embedding in zip(missing_indices, new_embeddings):
+                embeddings[i] = embedding
+                self.query_cache.set(cache_keys[i], embedding)
+        return embeddings
+
+    def _query_cache_key(self, text: str) -> str:
+        return self.query_cache.make_key(type(self).__name__, self.model_name, "RETRIEVAL_QUERY", text)
+
+    def _embed_queries_uncached(self, texts: list[str]) -> list[list[float]]:
+        embeddings = []
+        for i in range(0, len(texts), self.batch_size):
+            result = self.client.models.embed_content(
+                model=self.model_name,
+                contents=texts[i:i + self.batch_size],
+                config=types.EmbedContentConfig(task_type="RETRIEVAL_QUERY")
+            )
+            embeddings.extend(list(e.values) for e in result.embeddings)
+        return embeddings
\ No newline at end of file
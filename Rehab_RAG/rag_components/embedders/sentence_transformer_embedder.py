@@ -1,5 +1,7 @@
 from sentence_transformers import SentenceTransformer
 import torch
+from ..caches.stage_cache import get_stage_cache
+from ..caches.model_registry import acquire_shared_model
 
 class SentenceTransformerEmbedder:
     """
@@ -13,13 +15,14 @@ class SentenceTransformerEmbedder:
     - キーワード検索では見つけられない、意図が近い文書を発見する。
     """
 
-    def __init__(self, model_name: str, device: str = "auto"):
+    def __init__(self, model_name: str, device: str = "auto", use_cache: bool = True):
         """
         コンストラクタ。指定されたモデルをロードします。
         
         Args:
             model_name (str): Hugging Face上のモデル名 (例: "intfloat/multilingual-e5-large")
             device (str): "cuda", "cpu", "auto"のいずれか。autoの場合、GPUが利用可能ならGPUを使用します。
+            use_cache (bool): クエリのベクトルをキャッシュして再利用するかどうか。
         """
         if device == "auto":
             self.device = "cuda" if torch.cuda.is_available() else "cpu"
@@ -27,9 +30,19 @@ class SentenceTransformerEmbedder:
             self.device = device
         
         print(f"Embeddingモデル ({model_name}) を {self.device} にロード中...")
-        self.model = SentenceTransformer(model_name, device=self.device)
+        self.model_name = model_name
+        # 同じモデルを使う他のパイプラインとモデルを共有する (プロセス内で1回だけロードされる)
+        self.model, self._release_model = acquire_shared_model(
+            self, "SentenceTransformer", model_name, self.device,
+            lambda: SentenceTransformer(model_name, device=self.device),
+        )
+        self.query_cache = get_stage_cache("query_embedding") if use_cache else None
         print("Embeddingモデルのロード完了。")
 
+    def close(self):
+        """共有モデルへの参照を解放する (他に使用者がいなければ、レジストリが後で解放する)"""
+        self._release_model()
+
     def embed_documents(self, texts: list[str]) -> list[list[float]]:
         """
         複数のドキュメント（チャンク）を一度にベクトル化するメソッド。
@@ -43,5 +56,30 @@ class SentenceTransformerEmbedder:
         単一のクエリテキストをベクトル化するメソッド。
         ユーザーからの質問を検索する際に使用します。
         """
-        embedding = self.model.encode(text, convert_to_tensor=True)
-        return embedding.tolist()
\ No newline at end of file
+        if self.query_cache is None:
+            return self.model.encode(text, convert_to_tensor=True).tolist()
+
+        return self.query_cache.get_or_compute(
+            self._query_cache_key(text), lambda: self.model.encode(text, convert_to_tensor=True).tolist()
+        )
+
+    def embed_queries(self, texts: list[str]) -> list[list[float]]:
+        """
+        複数のクエリテキスト (HyDEやMulti-Queryで拡張したもの) を一度にベクトル化するメソッド。
+        キャッシュ済みのクエリは再利用し、残りをまとめてエンコードします。
+        """
+        if self.query_cache is None:
+            return self.model.encode(texts, convert_to_tensor=True).tolist()
+
+        cache_keys = [self._query_cache_key(text) for text in texts]
+        embeddings = [self.query_cache.get(key) for key in cache_keys]
+        missing_indices = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if missing_indices:
+            new_embeddings = self.model.encode([texts[i] for i in missing_indices], convert_to_tensor=True).tolist()
+            for i, embedding in zip(missing_indices, new_embeddings):
+                embeddings[i] = embedding
+                self.query_cache.set(cache_keys[i], embedding)
+        return embeddings
+
+    def _query_cache_key(self, text: str) -> str:
+        return self.query_cache.make_key(type(self).__name__, self.model_name, text)
\ No newline at end of file
@@ -1,5 +1,7 @@
 from transformers import AutoTokenizer, AutoModelForSequenceClassification
 import torch
+import numpy as np
+from ..caches.model_registry import acquire_shared_model
 
 class NLIFilter:
     """
@@ -20,13 +22,15 @@ class NLIFilter:
     - ベクトル検索だけでは除去しきれない、文脈的に無関係・不適切な情報を弾き、ノイズを減らす。
     - LLMに渡す情報の品質を高め、最終的な回答の信頼性を向上させる。
     """
-    def __init__(self, model_name: str, device: str = "auto", **kwargs):
+    def __init__(self, model_name: str, device: str = "auto", batch_size: int = 16, length_bucketing: bool = False, **kwargs):
         """
         コンストラクタ。指定されたNLIモデルをHugging Faceからロードします。
         
         Args:
             model_name (str): Hugging Face上のNLIモデル名。
             device (str): "cuda", "cpu", "auto"。
+            batch_size (int): 一度の推論でまとめて処理する文書の数。
+            length_bucketing (bool): Trueの場合、長さの近い文書同士でバッチを組み、パディングの無駄を減らす。
         """
         if device == "auto":
             self.device = "cuda" if torch.cuda.is_available() else "cpu"
@@ -34,9 +38,24 @@ class NLIFilter:
             self.device = device
             
         print(f"NLIモデル ({model_name}) を {self.device} にロード中...")
-        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
-        self.model = AutoModelForSequenceClassification.from_pretrained(model_name).to(self.device)
-        print("NLIモデルのロード完了。")
+        # 同じモデルを使う他のパイプラインと、トークナイザーとモデルを共有する
+        (self.tokenizer, self.model), self._release_model = acquire_shared_model(
+            self, "AutoModelForSequenceClassification", model_name, self.device,
+            lambda: self._load_model(model_name),
+        )
+        self.batch_size = max(1, int(batch_size))
+        self.length_bucketing = length_bucketing
+        print(f"NLIモデルのロード完了。バッチサイズ: {self.batch_size}")
+
+    def _load_model(self, model_name: str):
+        tokenizer = AutoTokenizer.from_pretrained(model_name)
+        model = AutoModelForSequenceClassification.from_pretrained(model_name).to(self.device)
+        model.eval()
+        return tokenizer, model
+
+    def close(self):
+        """共有モデルへの参照を解放する (他に使用者がいなければ、レジストリが後で解放する)"""
+        self._release_model()
 
     def filter(self, query: str, documents: list[str], metadatas: list[dict]) -> tuple[list[str], list[dict]]:
         """
@@ -52,18 +71,12 @@ class NLIFilter:
         """
         filtered_docs = []
         filtered_metadatas = []
-        
-        for doc, meta in zip(documents, metadatas):
-            premise = doc
-            hypothesis = query
+        if not documents:
+            return filtered_docs, filtered_metadatas
 
-            # モデルに入力するためにテキストをトークン化
-            input_data = self.tokenizer(premise, hypothesis, return_tensors="pt", truncation=True, max_length=512).to(self.device)
-            with torch.no_grad(): # 推論モードで勾配計算をオフにし、高速化
-                outputs = self.model(**input_data)
-                logits = outputs.logits
-                probabilities = torch.softmax(logits, dim=1).cpu().numpy()[0]
-            
+        all_probabilities = self._predict_probabilities(query, documents)
+
+        for doc, meta, probabilities in zip(documents, metadatas, all_probabilities):
             # モデルの出力から各ラベルの確率を取得
             # モデル設定によると、0: contradiction, 1: neutral, 2: entailment
             contradiction_score = probabilities[0] # model.config.label2id['contradiction'] is 0
@@ -76,4 +89,35 @@ class NLIFilter:
                 filtered_docs.append(doc)
                 filtered_metadatas.append(meta)
         
-        return filtered_docs, filtered_metadatas
\ No newline at end of file
+        return filtered_docs, filtered_metadatas
+
+    def _predict_probabilities(self, query: str, documents: list[str]) -> np.ndarray:
+        """
+        全文書について (前提=文書, 仮説=クエリ) のラベル確率をバッチ推論で計算する。
+        パディングはattention_maskで無視されるため、1件ずつ推論した場合と同じ確率になる。
+
+        Returns:
+            np.ndarray: 形状 (文書数, ラベル数) の確率。documents と同じ順序。
+        """
+        order = list(range(len(documents)))
+        if self.length_bucketing:
+            # 長さ順に並べてからバッチを組むことで、バッチ内のパディングを最小限にする
+            order.sort(key=lambda i: len(documents[i]))
+
+        all_probabilities = [None] * len(documents)
+        with torch.inference_mode(): # 勾配計算とバージョン管理をオフにし、高速化
+            for start in range(0, len(order), self.batch_size):
+                batch_indices = order[start:start + self.batch_size]
+                premises = [documents[i] for i in batch_indices]
+                hypotheses = [query] * len(batch_indices)
+
+                # バッチ内で最も長い入力に合わせてパディングする (dynamic padding)
+                input_data = self.tokenizer(
+                    premises, hypotheses, return_tensors="pt", padding=True, truncation=True, max_length=512
+                ).to(self.device)
+                logits = self.model(**input_data).logits
+                probabilities = torch.softmax(logits.float(), dim=1).cpu().numpy()
+                for i, probs in zip(batch_indices, probabilities):
+                    all_probabilities[i] = probs
+
+        return np.stack(all_probabilities)
\ No newline at end of file
@@ -13,14 +13,17 @@ class OllamaLLM:
     Ollamaを使用してテキスト生成を行うラッパークラス。
     構造化出力（JSON）にも対応。
     """
-    def __init__(self, model_name: str = "qwen3:8b", temperature: float = 0.1, top_p: float = 0.9):
+    def __init__(self, model_name: str = "qwen3:8b", temperature: float = 0.1, top_p: float = 0.9, keep_alive=None):
         """
         コンストラクタ。
 
         Args:
             model_name (str): 使用するOllamaモデル名 (例: "qwen3:8b")
+            keep_alive (str | int | None): 呼び出し後にモデルをメモリに保持する時間 (例: "30m")。
+                連続して呼び出す場合に、毎回モデルが再ロードされるのを防ぐ。None の場合はOllamaの既定値。
         """
         self.model_name = model_name
+        self.keep_alive = keep_alive
         print(f"Ollama LLMラッパー初期化完了 (モデル: {self.model_name})")
         self.options = {
             "temperature": 0.6, # 決定性を高めるために 0.0 にする
@@ -28,10 +31,14 @@ class OllamaLLM:
         }
         logger.info(f"Ollama LLM Wrapper initialized (Model: {self.model_name})") # ログ追加
 
-    def generate(self, prompt: str, response_schema: Optional[Type[BaseModel]] = None, **kwargs):
+    def generate(self, prompt: str, response_schema: Optional[Type[BaseModel]] = None, schema_dict: Optional[dict] = None, **kwargs):
         """
         与えられたプロンプトを元に、Ollamaから応答を生成します。
         スキーマが指定されていればJSONモードで実行します。
+
+        Args:
+            schema_dict (dict | None): response_schema のJSONスキーマ辞書。
+                呼び出し側で計算済みのものを渡すと、呼び出しごとにスキーマを生成し直さずに済む。
         """
 
         logger.info(f"--- Calling Ollama API (Model: {self.model_name}) ---") # ログ追加
@@ -39,8 +46,9 @@ class OllamaLLM:
         if response_schema:
             logger.info(f"Generating with JSON schema enforcement: {response_schema.__name__}")
             try:
-                # PydanticモデルからJSONスキーマ辞書を取得
-                schema_dict = response_schema.model_json_schema() 
+                # PydanticモデルからJSONスキーマ辞書を取得 (計算済みのものが渡されていればそれを使う)
+                if schema_dict is None:
+                    schema_dict = response_schema.model_json_schema()
                 format_param = schema_dict # スキーマ辞書を format に渡す
             except Exception as e:
                 logger.error(f"Pydanticモデル ({response_schema.__name__}) からJSONスキーマの取得に失敗: {e}")
@@ -53,7 +61,8 @@ class OllamaLLM:
                     {'role': 'user', 'content': prompt}
                     ],
                 format=format_param,
-                options=self.options
+                options=self.options,
+                keep_alive=self.keep_alive
             )
             generated_content = response.get('message', {}).get('content', '')
             if not generated_content:
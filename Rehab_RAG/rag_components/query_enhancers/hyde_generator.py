@@ -1,3 +1,5 @@
+from ..caches.stage_cache import get_stage_cache
+
 class HydeQueryEnhancer:
     """
     [手法解説: HyDE (Hypothetical Document Embeddings)]
@@ -13,14 +15,16 @@ class HydeQueryEnhancer:
     - 短いクエリよりも多くの検索キーワードや文脈が含まれるため、検索精度が向上する。
     - ユーザーが思いつかない専門用語などをLLMが補ってくれる。
     """
-    def __init__(self, llm):
+    def __init__(self, llm, use_cache: bool = True):
         """
         コンストラクタ。文章生成のためのLLMインスタンスを受け取ります。
         
         Args:
             llm: GeminiLLMなど、`generate`メソッドを持つLLMラッパークラスのインスタンス。
+            use_cache (bool): 同じクエリに対する生成結果を再利用するかどうか。
         """
         self.llm = llm
+        self.cache = get_stage_cache("hyde") if use_cache else None
 
     def enhance(self, query: str) -> str:
         """
@@ -39,11 +43,24 @@ class HydeQueryEnhancer:
 
 理想的な回答:"""
         
+        # 同じLLM・同じプロンプトでの生成結果があれば再利用する
+        cache_key = None
+        if self.cache is not None:
+            cache_key = self.cache.make_key(
+                type(self.llm).__name__, getattr(self.llm, "model_name", None), prompt
+            )
+            cached_answer = self.cache.get(cache_key)
+            if cached_answer is not None:
+                print("HyDEの生成結果をキャッシュから再利用します。")
+                return cached_answer
+
         hypothetical_answer = self.llm.generate(prompt, max_output_tokens=512)
         
         # LLMがエラーを返したり、空の文字列を生成した場合は、元のクエリをそのまま使う
         if "回答を生成できませんでした" in hypothetical_answer or not hypothetical_answer.strip():
             print("HyDEの生成に失敗したため、元のクエリを検索に使用します。")
             return query
-            
+
+        if cache_key is not None:
+            self.cache.set(cache_key, hypothetical_answer)
         return hypothetical_answer
\ No newline at end of file
@@ -1,6 +1,8 @@
 from sentence_transformers.cross_encoder import CrossEncoder
 import torch
 import numpy as np
+from ..caches.stage_cache import get_stage_cache
+from ..caches.model_registry import acquire_shared_model
 
 class CrossEncoderReranker:
     """
@@ -17,13 +19,31 @@ class CrossEncoderReranker:
     - LLMに渡すコンテキストの質を向上させ、最終的な回答の精度を高める。
     - 計算コストが高いため、リトリーバーで絞り込んだ後の少数の候補に対して適用するのが効果的。
     """
-    def __init__(self, model_name: str, device: str = "auto"):
+    def __init__(
+        self,
+        model_name: str,
+        device: str = "auto",
+        use_cache: bool = True,
+        max_candidates: int | None = None,
+        batch_size: int = 32,
+        max_length: int = 512,
+        prefilter: str = "lexical",
+        score_threshold: float | None = None,
+    ):
         """
         コンストラクタ。指定されたCross-Encoderモデルをロードします。
         
         Args:
             model_name (str): Hugging Face上のモデル名 (例: "bge-reranker-base")
             device (str): "cuda", "cpu", "auto"のいずれか。
+            use_cache (bool): (クエリ, 文書) ペアのスコアをキャッシュして再利用するかどうか。
+            max_candidates (int | None): Cross-Encoderでスコアを計算する候補の上限。
+                超えた分は軽量な一次スコアで足切りする。Noneの場合は全件を計算する。
+            batch_size (int): Cross-Encoderの推論バッチサイズ。
+            max_length (int): Cross-Encoderに入力する最大トークン長。
+            prefilter (str): 足切りに使う一次スコア。
+                "lexical" (クエリの文字bigramが文書に含まれる割合) または "order" (検索結果の順位をそのまま使う)。
+            score_threshold (float | None): このスコア未満の文書を除外する。Noneの場合は除外しない。
         """
         if device == "auto":
             self.device = "cuda" if torch.cuda.is_available() else "cpu"
@@ -31,10 +51,28 @@ class CrossEncoderReranker:
             self.device = device
             
         print(f"Rerankerモデル ({model_name}) を {self.device} にロード中...")
-        self.model = CrossEncoder(model_name, max_length=512, device=self.device)
-        print("Rerankerモデルのロード完了。")
+        self.model_name = model_name
+        self.max_length = max_length
+        self.batch_size = batch_size
+        self.max_candidates = max_candidates
+        if prefilter not in ("lexical", "order"):
+            raise ValueError(f"未対応のprefilterです: {prefilter} ('lexical' または 'order' を指定してください)")
+        self.prefilter = prefilter
+        self.score_threshold = score_threshold
+        # 同じモデルを使う他のパイプラインとモデルを共有する (max_length が異なる場合は別に読み込む)
+        self.model, self._release_model = acquire_shared_model(
+            self, "CrossEncoder", model_name, self.device,
+            lambda: CrossEncoder(model_name, max_length=self.max_length, device=self.device),
+            max_length=self.max_length,
+        )
+        self.score_cache = get_stage_cache("rerank_score") if use_cache else None
+        print(f"Rerankerモデルのロード完了。候補上限: {self.max_candidates or '制限なし'}, バッチサイズ: {self.batch_size}")
 
-    def rerank(self, query: str, documents: list[str], metadatas: list[dict]) -> tuple[list[str], list[dict]]:
+    def close(self):
+        """共有モデルへの参照を解放する (他に使用者がいなければ、レジストリが後で解放する)"""
+        self._release_model()
+
+    def rerank(self, query: str, documents: list[str], metadatas: list[dict], return_scores: bool = False):
         """
         Cross-Encoderモデルを使用して、文書をクエリとの関連性スコアで並べ替える。
         
@@ -42,23 +80,96 @@ class CrossEncoderReranker:
             query (str): ユーザーの元の質問文。
             documents (list[str]): 検索された文書チャンクのリスト。
             metadatas (list[dict]): 各文書チャンクに対応するメタデータのリスト。
+            return_scores (bool): Trueの場合、並べ替え後の各文書のスコアも返す。
 
         Returns:
             tuple[list[str], list[dict]]: スコアに基づいて並べ替えられた文書とメタデータのタプル。
+                return_scores=True の場合は (文書, メタデータ, スコア) のタプル。
         """
         if not documents:
-            return [], []
+            return ([], [], []) if return_scores else ([], [])
 
-        # (query, document) のペアを作成
-        sentence_pairs = [[query, doc] for doc in documents]
+        # 候補が多すぎる場合は、軽量な一次スコアで上位 max_candidates 件に絞ってからCross-Encoderにかける
+        candidate_indices = self._select_candidates(query, documents)
+        candidate_docs = [documents[i] for i in candidate_indices]
+
+        if len(candidate_docs) == 1 and not return_scores and self.score_threshold is None:
+            # 1件しかなければ並べ替える必要はないため、モデルを呼ばずに返す
+            scores = np.zeros(1)
+        else:
+            scores = self._score_pairs(query, candidate_docs)
 
-        # スコアを計算
-        scores = self.model.predict(sentence_pairs, show_progress_bar=False)
-        
         # スコアに基づいてソート
-        sorted_indices = np.argsort(scores)[::-1] # 降順にソート
+        sorted_positions = np.argsort(scores, kind="stable")[::-1] # 降順にソート
+        if self.score_threshold is not None:
+            sorted_positions = [p for p in sorted_positions if scores[p] >= self.score_threshold]
 
-        reranked_docs = [documents[i] for i in sorted_indices]
-        reranked_metadatas = [metadatas[i] for i in sorted_indices]
-        
-        return reranked_docs, reranked_metadatas
\ No newline at end of file
+        reranked_docs = [candidate_docs[p] for p in sorted_positions]
+        reranked_metadatas = [metadatas[candidate_indices[p]] for p in sorted_positions]
+
+        if return_scores:
+            reranked_scores = [float(scores[p]) for p in sorted_positions]
+            return reranked_docs, reranked_metadatas, reranked_scores
+        return reranked_docs, reranked_metadatas
+
+    def _select_candidates(self, query: str, documents: list[str]) -> list[int]:
+        """
+        Cross-Encoderにかける候補のインデックスを返す。
+        max_candidates を超える場合のみ、一次スコアの上位を元の順序を保って返す。
+        """
+        if not self.max_candidates or len(documents) <= self.max_candidates:
+            return list(range(len(documents)))
+
+        if self.prefilter == "order":
+            # 検索結果の順位 (先に見つかった文書ほど上位) をそのまま使う
+            selected = list(range(self.max_candidates))
+        else:
+            # クエリの文字bigramのうち、文書に含まれる割合 (クエリ側で正規化するため、長い文書が不利にならない)
+            query_bigrams = self._char_bigrams(query)
+            lexical_scores = [
+                len(self._char_bigrams(doc) & query_bigrams) / len(query_bigrams) if query_bigrams else 0.0
+                for doc in documents
+            ]
+            # 同点の場合は検索順位が高いものを優先する
+            selected = sorted(range(len(documents)), key=lambda i: (-lexical_scores[i], i))[:self.max_candidates]
+            selected.sort()
+
+        print(f"  - リランキング候補を {len(documents)}件 -> {len(selected)}件 に絞り込みました ({self.prefilter})")
+        return selected
+
+    @staticmethod
+    def _char_bigrams(text: str) -> set[str]:
+        """文字bigramの集合を返す (日本語でも分かち書きなしで使える軽量な類似度のため)"""
+        text = "".join(text.split())
+        return {text[i:i + 2] for i in range(len(text) - 1)}
+
+    def _score_pairs(self, query: str, documents: list[str]) -> np.ndarray:
+        """
+        (query, document) ペアの関連性スコアを計算する。
+        キャッシュ済みのペアはモデルに渡さず、未計算のペアのみをまとめて推論する。
+        """
+        if self.score_cache is None:
+            sentence_pairs = [[query, doc] for doc in documents]
+            return np.asarray(self.model.predict(sentence_pairs, batch_size=self.batch_size, show_progress_bar=False))
+
+        scores = np.zeros(len(documents), dtype=np.float32)
+        cache_keys = [
+            self.score_cache.make_key(self.model_name, self.max_length, query, doc)
+            for doc in documents
+        ]
+        missing_indices = []
+        for i, key in enumerate(cache_keys):
+            cached_score = self.score_cache.get(key)
+            if cached_score is None:
+                missing_indices.append(i)
+            else:
+                scores[i] = cached_score
+
+        if missing_indices:
+            sentence_pairs = [[query, documents[i]] for i in missing_indices]
+            new_scores = self.model.predict(sentence_pairs, batch_size=self.batch_size, show_progress_bar=False)
+            for i, score in zip(missing_indices, new_scores):
+                scores[i] = float(score)
+                self.score_cache.set(cache_keys[i], float(score))
+        print(f"  - リランキング: {len(documents) - len(missing_indices)}件のスコアをキャッシュから再利用")
+        return scores
\ No newline at end of file
@@ -0,0 +1,40 @@
+RESULT_KEYS = ('ids', 'documents', 'metadatas', 'distances')
+
+
+def select_query_results(results: dict, index: int) -> dict:
+    """
+    複数クエリ分の検索結果 (ChromaDB形式: 各キーがクエリごとのリストを持つ) から、
+    index 番目のクエリの結果だけを取り出し、単一クエリの形式で返す。
+    """
+    return {
+        key: [results[key][index]]
+        for key in RESULT_KEYS
+        if results.get(key) is not None
+    }
+
+
+def merge_query_results(results: dict) -> dict:
+    """
+    複数クエリ分の検索結果を1つにまとめる。
+    クエリの順、各クエリ内の順位の順に並べ、同じ文書 (テキスト) は最初に出現したものだけを残す。
+    """
+    keys = [key for key in RESULT_KEYS if results.get(key) is not None]
+    merged = {key: [] for key in keys}
+    seen = set()
+    for query_index, documents in enumerate(results.get('documents') or []):
+        for rank, doc_text in enumerate(documents):
+            if doc_text in seen:
+                continue
+            seen.add(doc_text)
+            for key in keys:
+                merged[key].append(results[key][query_index][rank])
+    return {key: [values] for key, values in merged.items()}
+
+
+def stack_query_results(per_query_results: list[dict]) -> dict:
+    """単一クエリ形式の検索結果のリストを、複数クエリ分の検索結果 (ChromaDB形式) にまとめる"""
+    keys = [
+        key for key in RESULT_KEYS
+        if per_query_results and all(result.get(key) is not None for result in per_query_results)
+    ]
+    return {key: [result[key][0] for result in per_query_results] for key in keys}
@@ -0,0 +1,178 @@
+import os
+import json
+import math
+from collections import Counter
+
+import numpy as np
+from scipy import sparse
+
+
+class BM25SparseIndex:
+    """
+    [手法解説: 疎行列によるBM25スコアリング]
+    BM25の各(単語, 文書)の重みを事前に計算し、「単語 x 文書」のCSR形式の疎行列として保持するインデックス。
+
+    仕組み:
+    1. 構築時に、IDFと文書長による正規化を含めた重み idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * dl / avgdl)) を計算しておく。
+    2. クエリ時は、クエリに含まれる単語の行だけを取り出し、出現回数を掛けて足し合わせる (疎行列とベクトルの積)。
+    3. 上位n件は全件ソートせず、np.argpartition で取り出す。
+
+    rank_bm25.BM25Okapi と同じ式 (負のIDFを epsilon * 平均IDF で置き換える処理を含む) でスコアを計算するため、
+    検索結果の順位は従来と変わらない。
+    行列は .npy 形式で保存し、読み込み時はメモリマップするため、コーパスが大きくなっても起動が速い。
+    """
+
+    MATRIX_FILES = ("data", "indices", "indptr")
+
+    def __init__(self, matrix: sparse.csr_matrix, vocab: dict, idf: np.ndarray, doc_norms: np.ndarray, params: dict):
+        """
+        Args:
+            matrix (sparse.csr_matrix): 形状 (語彙数, 文書数) のBM25重み行列。
+            vocab (dict): 単語 -> 行番号 の辞書。
+            idf (np.ndarray): 各単語のIDF (負の値は補正済み)。
+            doc_norms (np.ndarray): 各文書の長さ正規化項 k1 * (1 - b + b * dl / avgdl)。
+            params (dict): k1, b, epsilon, avgdl, n_docs などの構築時パラメータ。
+        """
+        self.matrix = matrix
+        self.vocab = vocab
+        self.idf = idf
+        self.doc_norms = doc_norms
+        self.params = params
+
+    @property
+    def n_docs(self) -> int:
+        return self.matrix.shape[1]
+
+    @classmethod
+    def build(cls, tokenized_corpus: list[list[str]], k1: float = 1.5, b: float = 0.75, epsilon: float = 0.25):
+        """分かち書き済みのコーパスからインデックスを構築する"""
+        doc_freqs = [Counter(tokens) for tokens in tokenized_corpus]
+        doc_len = np.array([len(tokens) for tokens in tokenized_corpus], dtype=np.float64)
+        return cls._from_doc_freqs(doc_freqs, doc_len, k1, b, epsilon)
+
+    @classmethod
+    def from_bm25okapi(cls, bm25):
+        """
+        旧形式 (pickle化した rank_bm25.BM25Okapi) からインデックスを作成する。
+        IDFは BM25Okapi が計算済みの値をそのまま使う。
+        """
+        doc_len = np.array(bm25.doc_len, dtype=np.float64)
+        return cls._from_doc_freqs(
+            bm25.doc_freqs, doc_len, bm25.k1, bm25.b, getattr(bm25, "epsilon", 0.25), idf_override=bm25.idf
+        )
+
+    @classmethod
+    def _from_doc_freqs(cls, doc_freqs, doc_len, k1, b, epsilon, idf_override=None):
+        n_docs = len(doc_freqs)
+        avgdl = float(doc_len.sum() / n_docs) if n_docs else 0.0
+
+        # 単語ごとの文書頻度 (BM25Okapiと同じく、最初に出現した順に語彙を並べる)
+        df = {}
+        for freqs in doc_freqs:
+            for word in freqs:
+                df[word] = df.get(word, 0) + 1
+        vocab = {word: i for i, word in enumerate(df)}
+
+        if idf_override is not None:
+            idf = np.array([idf_override.get(word, 0.0) for word in vocab], dtype=np.float64)
+        else:
+            idf = np.array(
+                [math.log(n_docs - freq + 0.5) - math.log(freq + 0.5) for freq in df.values()], dtype=np.float64
+            )
+            if len(idf):
+                # 半数以上の文書に出現する単語はIDFが負になるため、平均IDFのepsilon倍で置き換える
+                eps = epsilon * idf.mean()
+                idf[idf < 0] = eps
+
+        doc_norms = k1 * (1 - b + b * doc_len / avgdl) if avgdl else np.full(n_docs, k1)
+
+        # (単語, 文書, tf) の三つ組を集めて、単語 x 文書 の行列を作る
+        rows, cols, tfs = [], [], []
+        for doc_id, freqs in enumerate(doc_freqs):
+            for word, tf in freqs.items():
+                rows.append(vocab[word])
+                cols.append(doc_id)
+                tfs.append(tf)
+        rows = np.array(rows, dtype=np.int64)
+        cols = np.array(cols, dtype=np.int32)
+        tfs = np.array(tfs, dtype=np.float64)
+        weights = idf[rows] * (tfs * (k1 + 1) / (tfs + doc_norms[cols]))
+
+        matrix = sparse.csr_matrix((weights, (rows, cols)), shape=(len(vocab), n_docs))
+        matrix.sum_duplicates()
+        matrix.sort_indices()
+
+        params = {"k1": k1, "b": b, "epsilon": epsilon, "avgdl": avgdl, "n_docs": n_docs}
+        return cls(matrix, vocab, idf, doc_norms, params)
+
+    def get_scores(self, tokenized_query: list[str]) -> np.ndarray:
+        """全文書のBM25スコアを返す (BM25Okapi.get_scores と同じ値)"""
+        # クエリ内で同じ単語が複数回出現した場合は、その回数分スコアに加算される (BM25Okapiと同じ挙動)
+        query_counts = Counter(word for word in tokenized_query if word in self.vocab)
+        if not query_counts:
+            return np.zeros(self.n_docs)
+        term_ids = np.array([self.vocab[word] for word in query_counts], dtype=np.int64)
+        counts = np.array(list(query_counts.values()), dtype=np.float64)
+        return np.asarray(self.matrix[term_ids].T @ counts).ravel()
+
+    def top_n(self, tokenized_query: list[str], n_results: int) -> tuple[np.ndarray, np.ndarray]:
+        """
+        スコア上位n件の文書番号とスコアを返す。
+        同点の場合は文書番号の小さい方を優先する (従来のsortedによる安定ソートと同じ順序)。
+        """
+        scores = self.get_scores(tokenized_query)
+        n_results = min(n_results, len(scores))
+        if n_results <= 0:
+            return np.array([], dtype=np.int64), np.array([], dtype=np.float64)
+
+        if n_results < len(scores):
+            # 全件ソートせずに上位n件の境界値を求め、境界値以上の候補だけを並べ替える
+            partition = np.argpartition(-scores, n_results - 1)[:n_results]
+            kth_score = scores[partition].min()
+            candidates = np.flatnonzero(scores >= kth_score)
+        else:
+            candidates = np.arange(len(scores))
+
+        order = np.lexsort((candidates, -scores[candidates]))[:n_results]
+        top_indices = candidates[order]
+        return top_indices, scores[top_indices]
+
+    def save(self, directory: str):
+        """インデックスを .npy / .json ファイルとしてディレクトリに保存する"""
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, "data.npy"), self.matrix.data)
+        np.save(os.path.join(directory, "indices.npy"), self.matrix.indices)
+        np.save(os.path.join(directory, "indptr.npy"), self.matrix.indptr)
+        np.save(os.path.join(directory, "idf.npy"), self.idf)
+        np.save(os.path.join(directory, "doc_norms.npy"), self.doc_norms)
+        with open(os.path.join(directory, "vocab.json"), "w", encoding="utf-8") as f:
+            json.dump(self.vocab, f, ensure_ascii=False)
+        with open(os.path.join(directory, "params.json"), "w", encoding="utf-8") as f:
+            json.dump(self.params, f)
+
+    @classmethod
+    def load(cls, directory: str, mmap: bool = True):
+        """
+        保存されたインデックスを読み込む。
+        mmap=True の場合、行列はメモリマップで開き、クエリで参照された部分だけがディスクから読まれる。
+        """
+        mmap_mode = "r" if mmap else None
+        arrays = {
+            name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode=mmap_mode)
+            for name in cls.MATRIX_FILES + ("idf", "doc_norms")
+        }
+        with open(os.path.join(directory, "vocab.json"), "r", encoding="utf-8") as f:
+            vocab = json.load(f)
+        with open(os.path.join(directory, "params.json"), "r", encoding="utf-8") as f:
+            params = json.load(f)
+
+        matrix = sparse.csr_matrix(
+            (arrays["data"], arrays["indices"], arrays["indptr"]),
+            shape=(len(vocab), params["n_docs"]),
+            copy=False,
+        )
+        return cls(matrix, vocab, arrays["idf"], arrays["doc_norms"], params)
+
+    @staticmethod
+    def exists(directory: str) -> bool:
+        return os.path.exists(os.path.join(directory, "params.json"))
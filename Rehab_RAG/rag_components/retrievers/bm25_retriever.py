@@ -1,8 +1,15 @@
 import os
+import json
 import pickle
-from rank_bm25 import BM25Okapi
-from tqdm import tqdm
-import MeCab
+from .bm25_index import BM25SparseIndex
+from .batch_results import merge_query_results, stack_query_results
+from ..tokenizers.mecab_tokenizer import MeCabTokenizer
+
+# チャンクの分かち書き結果の保存先。
+# インデックスのディレクトリ内に置くと、書き込むたびにインデックスの指紋 (RAGExecutor.index_version) が変わり、
+# RAG結果キャッシュが効かなくなるため、インデックスとは別の場所に保存する。
+# キーにはTaggerの引数とテキストのハッシュを使うため、複数のコレクションで共有してよい。
+BM25_TOKEN_CACHE_DIR = os.getenv("RAG_BM25_TOKEN_CACHE_DIR", os.path.join("cache", "bm25_tokens"))
 
 class BM25Retriever:
     """
@@ -13,23 +20,41 @@ class BM25Retriever:
     役割:
     - (データベース構築時) 全てのチャンクを形態素解析し、転置インデックスを作成して保存する。
     - (クエリ実行時) 質問文を形態素解析し、BM25スコアが最も高いチャンクを検索する。
+
+    インデックスは BM25SparseIndex (疎行列 + .npy) 形式で `{collection_name}_bm25/` ディレクトリに保存する。
+    旧形式の `{collection_name}_bm25.pkl` しかない場合は、初回読み込み時に新形式へ変換して保存する。
     """
-    def __init__(self, path: str, collection_name: str):
+    def __init__(
+        self,
+        path: str,
+        collection_name: str,
+        tokenize_workers: int | None = None,
+        use_token_cache: bool = True,
+        token_cache_dir: str = BM25_TOKEN_CACHE_DIR,
+    ):
         """
         コンストラクタ。インデックスファイルのパスを設定します。
         
         Args:
             path (str): BM25インデックスを保存するディレクトリのパス。
             collection_name (str): インデックスファイル名のプレフィックス。
+            tokenize_workers (int | None): インデックス構築時の分かち書きのプロセス数。Noneの場合はCPUコア数。
+            use_token_cache (bool): チャンクの分かち書き結果を保存し、再構築時に再利用するかどうか。
+            token_cache_dir (str): 分かち書き結果の保存先。インデックスのディレクトリ (path) の外を指定すること。
         """
-        self.index_path = os.path.join(path, f"{collection_name}_bm25.pkl")
-        self.mecab = MeCab.Tagger("-Owakati")
+        self.index_dir = os.path.join(path, f"{collection_name}_bm25")
+        self.legacy_index_path = os.path.join(path, f"{collection_name}_bm25.pkl")
+        self.chunks_path = os.path.join(self.index_dir, "chunks.json")
+        self.tokenizer = MeCabTokenizer(
+            cache_dir=token_cache_dir if use_token_cache else None,
+            n_workers=tokenize_workers,
+        )
         self.bm25 = None
         self.chunks = []
 
     def _tokenize(self, text: str) -> list[str]:
         """テキストを分かち書きする内部メソッド"""
-        return self.mecab.parse(text).strip().split()
+        return self.tokenizer.tokenize(text)
 
     def add_documents(self, chunks: list[dict]):
         """
@@ -41,22 +66,36 @@ class BM25Retriever:
         print("BM25インデックスの構築を開始します...")
         self.chunks = chunks
         
-        tokenized_corpus = [self._tokenize(chunk['text']) for chunk in tqdm(chunks, desc="Tokenizing for BM25")]
-        self.bm25 = BM25Okapi(tokenized_corpus)
+        # 分かち書き済みのチャンクはキャッシュから再利用し、新しいチャンクのみを処理する
+        tokenized_corpus = self.tokenizer.tokenize_documents([chunk['text'] for chunk in chunks])
+        self.bm25 = BM25SparseIndex.build(tokenized_corpus)
         
         # インデックスとチャンクデータを保存
-        with open(self.index_path, 'wb') as f:
-            pickle.dump((self.bm25, self.chunks), f)
-        print(f"BM25インデックスを '{self.index_path}' に保存しました。")
+        self._save()
+        print(f"BM25インデックスを '{self.index_dir}' に保存しました。")
+
+    def _save(self):
+        self.bm25.save(self.index_dir)
+        with open(self.chunks_path, 'w', encoding='utf-8') as f:
+            json.dump(self.chunks, f, ensure_ascii=False, default=str)
 
     def load_index(self):
         """保存されたBM25インデックスを読み込む"""
-        if os.path.exists(self.index_path):
-            with open(self.index_path, 'rb') as f:
-                self.bm25, self.chunks = pickle.load(f)
+        if BM25SparseIndex.exists(self.index_dir) and os.path.exists(self.chunks_path):
+            self.bm25 = BM25SparseIndex.load(self.index_dir)
+            with open(self.chunks_path, 'r', encoding='utf-8') as f:
+                self.chunks = json.load(f)
             # print("BM25インデックスを読み込みました。")
+        elif os.path.exists(self.legacy_index_path):
+            # 旧形式 (BM25Okapiのpickle) から変換する。unpickleにはrank_bm25が必要
+            print(f"旧形式のBM25インデックス '{self.legacy_index_path}' を新形式に変換します...")
+            with open(self.legacy_index_path, 'rb') as f:
+                legacy_bm25, self.chunks = pickle.load(f)
+            self.bm25 = BM25SparseIndex.from_bm25okapi(legacy_bm25)
+            self._save()
+            print(f"BM25インデックスを '{self.index_dir}' に保存しました。")
         else:
-            raise FileNotFoundError(f"BM25インデックスファイルが見つかりません: {self.index_path}")
+            raise FileNotFoundError(f"BM25インデックスファイルが見つかりません: {self.index_dir}")
 
     def retrieve(self, query_text: str, n_results: int = 10) -> dict:
         """
@@ -75,8 +114,7 @@ class BM25Retriever:
         tokenized_query = self._tokenize(query_text)
         
         # BM25スコアを計算し、上位n_results件のインデックスを取得
-        doc_scores = self.bm25.get_scores(tokenized_query)
-        top_n_indices = sorted(range(len(doc_scores)), key=lambda i: doc_scores[i], reverse=True)[:n_results]
+        top_n_indices, top_n_scores = self.bm25.top_n(tokenized_query, n_results)
         
         # ChromaDBと同様の形式で結果を返す
         top_chunks = [self.chunks[i] for i in top_n_indices]
@@ -84,6 +122,14 @@ class BM25Retriever:
             'ids': [[chunk['id'] for chunk in top_chunks]],
             'documents': [[chunk['text'] for chunk in top_chunks]],
             'metadatas': [[chunk['metadata'] for chunk in top_chunks]],
-            'distances': [[doc_scores[i] for i in top_n_indices]] # BM25スコアを距離の代わりに格納
+            'distances': [[float(score) for score in top_n_scores]] # BM25スコアを距離の代わりに格納
         }
-        return results
\ No newline at end of file
+        return results
+
+    def query_many(self, query_texts: list[str], n_results: int = 10) -> dict:
+        """複数のクエリで検索し、クエリごとの結果を返す (ChromaDBRetriever.query_many と同じ形式)"""
+        return stack_query_results([self.retrieve(query_text, n_results=n_results) for query_text in query_texts])
+
+    def retrieve_many(self, query_texts: list[str], n_results: int = 10) -> dict:
+        """複数のクエリで検索し、重複を除いて1つの結果にまとめる"""
+        return merge_query_results(self.query_many(query_texts, n_results=n_results))
\ No newline at end of file
@@ -1,6 +1,8 @@
 import chromadb
 import os
+import threading
 from tqdm import tqdm
+from .batch_results import merge_query_results
 
 class ChromaDBRetriever:
     """
@@ -14,6 +16,11 @@ class ChromaDBRetriever:
     
     このコンポーネントは、RAGの「Retrieval(検索)」部分の心臓部です。
     """
+    # 同じパスのクライアントはChromaDB内部で共有されるため、パスごとに使用中のリトリーバー数を数えておき、
+    # 全パスのリトリーバーが close() された時にだけクライアントを停止する
+    _open_clients = {}
+    _open_clients_lock = threading.Lock()
+
     def __init__(self, path: str, collection_name: str, embedder):
         """
         コンストラクタ。ChromaDBに接続し、コレクション（テーブルのようなもの）を準備します。
@@ -27,7 +34,11 @@ class ChromaDBRetriever:
             os.makedirs(path)
         # `PersistentClient` を使うことで、データベースがファイルとしてディスクに保存され、
         # プログラム終了後もデータが保持されます。
-        self.client = chromadb.PersistentClient(path=path)
+        # (close() でのクライアントの停止と重ならないよう、作成と使用数の更新はロック内で行う)
+        self.path = os.path.abspath(path)
+        with ChromaDBRetriever._open_clients_lock:
+            self.client = chromadb.PersistentClient(path=path)
+            ChromaDBRetriever._open_clients[self.path] = ChromaDBRetriever._open_clients.get(self.path, 0) + 1
         self.embedder = embedder
 
         # コレクションを取得または新規作成します。
@@ -116,7 +127,54 @@ class ChromaDBRetriever:
             n_results=n_results
         )
         return results
+
+    def query_many(self, query_texts: list[str], n_results: int = 10) -> dict:
+        """
+        複数のクエリをまとめてベクトル化し、1回の問い合わせで検索します。
+
+        Returns:
+            dict: ChromaDBからの検索結果 (各キーがクエリごとのリストを持つ)。
+        """
+        if hasattr(self.embedder, "embed_queries"):
+            query_embeddings = self.embedder.embed_queries(query_texts)
+        else:
+            query_embeddings = [self.embedder.embed_query(query_text) for query_text in query_texts]
+        return self.collection.query(
+            query_embeddings=query_embeddings,
+            n_results=n_results
+        )
+
+    def retrieve_many(self, query_texts: list[str], n_results: int = 10) -> dict:
+        """
+        複数のクエリ (HyDEやMulti-Queryで拡張したもの) で検索し、重複を除いて1つの結果にまとめます。
+        """
+        return merge_query_results(self.query_many(query_texts, n_results=n_results))
     
     def count(self) -> int:
         """データベースに保存されているアイテムの総数を返す。"""
-        return self.collection.count()
\ No newline at end of file
+        return self.collection.count()
+
+    def close(self):
+        """
+        ChromaDBクライアントへの参照を解放する。
+        使用中のリトリーバーが他に1つもなければ、ChromaDB内部で共有されているクライアント (SQLite接続・HNSWインデックス) も停止する。
+
+        ChromaDBの公開API (clear_system_cache) はパスを指定できず、全パスのクライアントをまとめて停止するため、
+        他のリトリーバーが使用中の間は参照を外すだけにする。共有のクライアントはChromaDB内部に残り、
+        同じパスを再び開いた場合はそれが再利用される。
+        """
+        if self.client is None:
+            return
+        client, self.client, self.collection = self.client, None, None
+        with ChromaDBRetriever._open_clients_lock:
+            remaining = ChromaDBRetriever._open_clients.get(self.path, 1) - 1
+            if remaining > 0:
+                ChromaDBRetriever._open_clients[self.path] = remaining
+                return
+            ChromaDBRetriever._open_clients.pop(self.path, None)
+            if ChromaDBRetriever._open_clients:
+                return
+            try:
+                client.clear_system_cache()
+            except Exception as e:
+                print(f"   [警告] ChromaDBクライアントの停止に失敗しました: {e}")
\ No newline at end of file
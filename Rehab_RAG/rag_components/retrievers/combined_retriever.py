@@ -1,5 +1,6 @@
 from .graph_retriever import GraphRetriever
 from .hybrid_retriever import HybridRetriever
+from .parallel_legs import RetrievalLegRunner
 
 class CombinedRetriever:
     """
@@ -7,25 +8,50 @@ class CombinedRetriever:
     グラフ検索とハイブリッド検索を同時に実行し、それぞれの結果を統合するリトリーバー。
     これにより、関係性の問いに強いグラフの利点と、網羅性に優れたハイブリッド検索の
     利点を両立させることを目指します。
+    グラフ検索 (LLMによるキーワード抽出を含む) とハイブリッド検索は別スレッドで同時に実行します。
     """
-    def __init__(self, llm, path: str, collection_name: str, embedder, **kwargs):
+    def __init__(self, llm, path: str, collection_name: str, embedder, leg_timeout: float | None = 60.0, **kwargs):
         """
         コンストラクタ。GraphRetrieverとHybridRetrieverを初期化します。
+
+        Args:
+            leg_timeout (float | None): 各検索の待ち時間の上限 (秒)。超えた方の結果は使わずに続行する。
         """
         print("Combined Retrieverを初期化中...")
         self.graph_retriever = GraphRetriever(llm=llm)
         self.hybrid_retriever = HybridRetriever(path, collection_name, embedder)
+        self.leg_timeout = leg_timeout
+        self.leg_runner = RetrievalLegRunner(n_legs=2, thread_name_prefix="combined_retriever")
         print("Combined Retrieverの初期化完了。")
 
     def retrieve(self, query_text: str, n_results: int = 10) -> dict:
         """
         両方のリトリーバーで検索を実行し、結果をマージして返す。
         """
-        print("  - GraphRetrieverで検索中...")
-        graph_results = self.graph_retriever.retrieve(query_text, n_results=n_results)
-        
-        print("  - HybridRetrieverで検索中...")
-        hybrid_results = self.hybrid_retriever.retrieve(query_text, n_results=n_results)
+        return self._retrieve_legs(
+            lambda: self.graph_retriever.retrieve(query_text, n_results=n_results),
+            lambda: self.hybrid_retriever.retrieve(query_text, n_results=n_results),
+        )
+
+    def retrieve_many(self, query_texts: list[str], n_results: int = 10) -> dict:
+        """
+        複数のクエリで両方のリトリーバーの検索を実行し、重複を除いて1つの結果にまとめる。
+        """
+        return self._retrieve_legs(
+            lambda: self.graph_retriever.retrieve_many(query_texts, n_results=n_results),
+            lambda: self.hybrid_retriever.retrieve_many(query_texts, n_results=n_results),
+        )
+
+    def _retrieve_legs(self, graph_leg, hybrid_leg) -> dict:
+        """グラフ検索とハイブリッド検索を同時に実行し、結果をマージする"""
+        print("  - GraphRetrieverとHybridRetrieverで検索中...")
+        leg_results = self.leg_runner.run(
+            {"graph": graph_leg, "hybrid": hybrid_leg},
+            timeout=self.leg_timeout,
+        )
+        empty_results = {'documents': [[]], 'metadatas': [[]]}
+        graph_results = leg_results["graph"] or empty_results
+        hybrid_results = leg_results["hybrid"] or empty_results
 
         # 結果を統合し、重複を排除する
         all_docs = {}
@@ -52,6 +78,12 @@ class CombinedRetriever:
             'metadatas': [final_metadatas]
         }
 
+    def close(self):
+        """並列検索用のスレッドと、各リトリーバーの接続を解放する"""
+        self.leg_runner.close()
+        self.graph_retriever.close()
+        self.hybrid_retriever.close()
+
     def add_documents(self, chunks: list[dict]):
         """
         このRetrieverは検索専用のため、このメソッドは何もしません。
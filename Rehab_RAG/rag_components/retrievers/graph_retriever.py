@@ -3,6 +3,7 @@ from dotenv import load_dotenv
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_neo4j import Neo4jGraph
 import re
+from .batch_results import merge_query_results, stack_query_results
 
 class GraphRetriever:
     """
@@ -90,6 +91,18 @@ class GraphRetriever:
             "metadatas": [[{"source": "Knowledge Graph"}] * len(unique_context[:n_results])],
         }
 
+    def retrieve_many(self, query_texts: list[str], n_results: int = 10) -> dict:
+        """複数のクエリで検索し、重複を除いて1つの結果にまとめる (キーワード抽出はクエリごとに行う)"""
+        return merge_query_results(
+            stack_query_results([self.retrieve(query_text, n_results=n_results) for query_text in query_texts])
+        )
+
+    def close(self):
+        """Neo4jへの接続を閉じる"""
+        close_graph = getattr(self.graph, "close", None)
+        if close_graph is not None:
+            close_graph()
+
     def add_documents(self, chunks: list[dict]):
         """このRetrieverは検索専用のため、このメソッドは何もしません。"""
         pass
\ No newline at end of file
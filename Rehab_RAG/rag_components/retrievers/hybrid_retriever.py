@@ -1,5 +1,7 @@
 from .chromadb_retriever import ChromaDBRetriever
 from .bm25_retriever import BM25Retriever
+from .parallel_legs import RetrievalLegRunner
+from .batch_results import merge_query_results, select_query_results, stack_query_results
 
 class HybridRetriever:
     """
@@ -17,8 +19,11 @@ class HybridRetriever:
     期待される効果:
     - 専門用語や固有名詞での検索精度（キーワード検索の長所）と、
       曖昧な質問への対応力（ベクトル検索の長所）を両立できる。
+
+    ベクトル検索とキーワード検索は別スレッドで同時に実行する。
+    片方がタイムアウト・エラーになった場合は、もう片方の結果だけでRRFを行う。
     """
-    def __init__(self, path: str, collection_name: str, embedder, k: int = 60):
+    def __init__(self, path: str, collection_name: str, embedder, k: int = 60, leg_timeout: float | None = 30.0):
         """
         コンストラクタ。ベクトルリトリーバーとキーワードリトリーバーを初期化します。
         
@@ -27,19 +32,47 @@ class HybridRetriever:
             collection_name (str): コレクション名。
             embedder: Embedderインスタンス。
             k (int): RRFのランキング計算で使用する定数。
+            leg_timeout (float | None): 各検索の待ち時間の上限 (秒)。Noneの場合は無制限。
         """
         self.vector_retriever = ChromaDBRetriever(path, collection_name, embedder)
         self.keyword_retriever = BM25Retriever(path, collection_name)
         self.k = k
+        self.leg_timeout = leg_timeout
+        self.leg_runner = RetrievalLegRunner(n_legs=2, thread_name_prefix="hybrid_retriever")
 
     def retrieve(self, query_text: str, n_results: int = 10) -> dict:
         """
         ベクトル検索とキーワード検索を実行し、RRFで結果を統合して返す。
         """
-        # 1. 各リトリーバーで検索を実行
-        vector_results = self.vector_retriever.retrieve(query_text, n_results=n_results * 2)
-        keyword_results = self.keyword_retriever.retrieve(query_text, n_results=n_results * 2)
+        return select_query_results(self.query_many([query_text], n_results=n_results), 0)
+
+    def query_many(self, query_texts: list[str], n_results: int = 10) -> dict:
+        """
+        複数のクエリについて、ベクトル検索 (1回のベクトル化・問い合わせ) とキーワード検索を実行し、
+        クエリごとにRRFで統合した結果を返す。
+        """
+        # 1. 各リトリーバーで検索を同時に実行 (失敗した方は空の結果として扱う)
+        leg_results = self.leg_runner.run(
+            {
+                "vector": lambda: self.vector_retriever.query_many(query_texts, n_results=n_results * 2),
+                "keyword": lambda: self.keyword_retriever.query_many(query_texts, n_results=n_results * 2),
+            },
+            timeout=self.leg_timeout,
+        )
+        empty_results = {'ids': [[]], 'documents': [[]], 'metadatas': [[]]}
+        fused_results = []
+        for i in range(len(query_texts)):
+            vector_results = select_query_results(leg_results["vector"], i) if leg_results["vector"] else empty_results
+            keyword_results = select_query_results(leg_results["keyword"], i) if leg_results["keyword"] else empty_results
+            fused_results.append(self._fuse(vector_results, keyword_results, n_results))
+        return stack_query_results(fused_results)
+
+    def retrieve_many(self, query_texts: list[str], n_results: int = 10) -> dict:
+        """複数のクエリで検索し、重複を除いて1つの結果にまとめる"""
+        return merge_query_results(self.query_many(query_texts, n_results=n_results))
 
+    def _fuse(self, vector_results: dict, keyword_results: dict, n_results: int) -> dict:
+        """1つのクエリに対するベクトル検索とキーワード検索の結果をRRFで統合する"""
         # 2. RRFスコアを計算
         rrf_scores = {}
         
@@ -88,6 +121,11 @@ class HybridRetriever:
             'metadatas': [final_metadatas]
         }
 
+    def close(self):
+        """並列検索用のスレッドと、ベクトル検索のクライアントを解放する"""
+        self.leg_runner.close()
+        self.vector_retriever.close()
+
     def add_documents(self, chunks: list[dict]):
         """
         両方のリトリーバーにドキュメントを追加します。
@@ -0,0 +1,107 @@
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+# 1つのリトリーバーで同時に処理する検索の数 (スレッドプールの大きさは レッグ数 x この値)
+RETRIEVAL_LEG_CONCURRENCY = int(os.getenv("RAG_RETRIEVAL_LEG_CONCURRENCY", "2"))
+
+
+def run_retrieval_legs(executor: ThreadPoolExecutor, legs: dict, timeout: float | None = None, timed_out: list | None = None) -> dict:
+    """
+    複数の検索 (レッグ) をスレッドプールで同時に実行し、名前ごとの結果を返す。
+
+    - timeout 秒以内に終わらなかったレッグ、例外が発生したレッグの結果は None になる (残りのレッグの結果だけで検索を続ける)。
+      実行中のスレッドは中断できないため、時間切れのレッグも終了するまでスレッドを占有し続ける。
+    - 全てのレッグが失敗した場合は、最初に発生した例外を送出する (全て時間切れの場合は TimeoutError)。
+
+    Args:
+        executor (ThreadPoolExecutor): レッグを実行するスレッドプール。
+        legs (dict): レッグ名 -> 引数なしで呼び出せる検索関数。
+        timeout (float | None): 全レッグ共通の待ち時間の上限 (秒)。Noneの場合は無制限。
+        timed_out (list | None): 指定した場合、時間切れになったレッグ名を追加する。
+
+    Returns:
+        dict: レッグ名 -> 検索結果 (失敗した場合は None)。
+    """
+    start_time = time.perf_counter()
+    futures = {name: executor.submit(fn) for name, fn in legs.items()}
+    wait(futures.values(), timeout=timeout)
+
+    results = {}
+    first_error = None
+    for name, future in futures.items():
+        if not future.done():
+            # 開始前のレッグだけが取り消せる。実行中のレッグは止められず、終わるまでスレッドを占有する
+            if future.cancel():
+                print(f"警告: 検索 '{name}' が {timeout}秒以内に開始できなかったため、取り消して続行します。")
+            else:
+                print(
+                    f"警告: 検索 '{name}' が {timeout}秒以内に終わらなかったため、結果を使わずに続行します "
+                    "(実行中の検索は中断できないため、終了するまでバックグラウンドで動き続けます)。"
+                )
+            if timed_out is not None:
+                timed_out.append(name)
+            results[name] = None
+            continue
+        try:
+            results[name] = future.result()
+        except Exception as e:
+            print(f"警告: 検索 '{name}' でエラーが発生したため、結果を使わずに続行します: {e}")
+            results[name] = None
+            first_error = first_error or e
+
+    if all(result is None for result in results.values()):
+        if first_error is not None:
+            raise first_error
+        raise TimeoutError(f"全ての検索が {timeout}秒以内に終わりませんでした。")
+
+    elapsed = time.perf_counter() - start_time
+    print(f"  - 検索 ({', '.join(legs)}) を並行実行しました ({elapsed:.2f}秒)")
+    return results
+
+
+class RetrievalLegRunner:
+    """
+    リトリーバーごとに専用のスレッドプールを持ち、run_retrieval_legs でレッグを同時に実行する。
+
+    - スレッドプールの大きさは レッグ数 x concurrency とし、同時に処理する検索の数だけのスレッドを用意する。
+    - 時間切れのレッグは中断できずスレッドを占有し続けるため、時間切れが発生した場合はスレッドプールを作り直す。
+      古いスレッドプールは、実行中のレッグが終わった時点で解放される。
+    """
+
+    def __init__(self, n_legs: int, thread_name_prefix: str, concurrency: int = RETRIEVAL_LEG_CONCURRENCY):
+        self.max_workers = max(1, n_legs) * max(1, concurrency)
+        self.thread_name_prefix = thread_name_prefix
+        self._lock = threading.Lock()
+        self._executor = self._create_executor()
+        self.recreated = 0
+
+    def _create_executor(self) -> ThreadPoolExecutor:
+        return ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=self.thread_name_prefix)
+
+    def run(self, legs: dict, timeout: float | None = None) -> dict:
+        """レッグを同時に実行し、名前ごとの結果を返す (run_retrieval_legs と同じ)"""
+        with self._lock:
+            executor = self._executor
+        timed_out = []
+        try:
+            return run_retrieval_legs(executor, legs, timeout=timeout, timed_out=timed_out)
+        finally:
+            if timed_out:
+                self._recreate(executor)
+
+    def _recreate(self, old_executor: ThreadPoolExecutor):
+        with self._lock:
+            # 同時に時間切れになった他の検索が、すでに作り直している場合は何もしない
+            if self._executor is not old_executor:
+                return
+            self._executor = self._create_executor()
+            self.recreated += 1
+        print(f"警告: 時間切れの検索がスレッドを占有しているため、'{self.thread_name_prefix}' のスレッドプールを作り直しました。")
+        old_executor.shutdown(wait=False)
+
+    def close(self):
+        """スレッドプールを解放する (開始前のレッグは取り消す)"""
+        with self._lock:
+            self._executor.shutdown(wait=False, cancel_futures=True)
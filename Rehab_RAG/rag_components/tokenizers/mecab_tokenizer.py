@@ -0,0 +1,121 @@
+import os
+import hashlib
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import MeCab
+from tqdm import tqdm
+
+from ..caches.stage_cache import get_stage_cache
+
+# この件数以上のチャンクを新たに分かち書きする場合のみ、マルチプロセスで処理する
+# (少数の場合はプロセス起動のコストの方が大きい)
+PARALLEL_TOKENIZE_MIN_TEXTS = 2000
+
+_worker_tagger = None
+
+
+def _init_worker(tagger_args: str):
+    """ワーカープロセスごとにMeCabのTaggerを1つだけ作成する (Taggerはpickleできないため)"""
+    global _worker_tagger
+    _worker_tagger = MeCab.Tagger(tagger_args)
+
+
+def _tokenize_in_worker(texts: list[str]) -> list[list[str]]:
+    return [_worker_tagger.parse(text).strip().split() for text in texts]
+
+
+class MeCabTokenizer:
+    """
+    [手法解説: 分かち書きのキャッシュとバッチ処理]
+    BM25インデックスの構築・検索で使うMeCabの分かち書きを、3つの仕組みで高速化するコンポーネント。
+
+    仕組み:
+    1. チャンクの分かち書き結果を、テキストのハッシュをキーにディスクへ保存する。
+       ガイドラインを1つ追加して再構築する場合も、新しいチャンクだけを分かち書きすればよい。
+    2. 未処理のチャンクが多い場合は、複数プロセスで並列に分かち書きする。
+    3. 検索クエリの分かち書き結果はメモリ上のLRUに保持し、同じクエリの再検索で再利用する。
+    """
+
+    def __init__(
+        self,
+        tagger_args: str = "-Owakati",
+        cache_dir: str | None = None,
+        n_workers: int | None = None,
+        query_cache_size: int = 1024,
+    ):
+        """
+        Args:
+            tagger_args (str): MeCab.Tagger に渡す引数。
+            cache_dir (str | None): チャンクの分かち書き結果を保存するディレクトリ。Noneの場合は保存しない。
+            n_workers (int | None): バッチ分かち書きのプロセス数。Noneの場合はCPUコア数。1の場合は並列化しない。
+            query_cache_size (int): クエリの分かち書き結果を保持する件数。
+        """
+        self.tagger_args = tagger_args
+        self.tagger = MeCab.Tagger(tagger_args)
+        self._tagger_lock = threading.Lock()  # MeCab.Taggerはスレッドセーフではないため
+        self.n_workers = n_workers or os.cpu_count() or 1
+        self.query_cache = get_stage_cache("bm25_query_tokens", max_entries=query_cache_size)
+
+        self.token_cache = None
+        if cache_dir:
+            import diskcache
+            self.token_cache = diskcache.Cache(cache_dir)
+
+    def _parse(self, text: str) -> list[str]:
+        with self._tagger_lock:
+            return self.tagger.parse(text).strip().split()
+
+    def _text_key(self, text: str) -> str:
+        # 辞書や出力形式が変わった場合に古い結果を使わないよう、Taggerの引数もキーに含める
+        return hashlib.sha256(f"{self.tagger_args}\0{text}".encode("utf-8")).hexdigest()
+
+    def tokenize(self, text: str) -> list[str]:
+        """クエリテキストを分かち書きする (結果はLRUにキャッシュされる)"""
+        key = self._text_key(text)
+        tokens = self.query_cache.get(key)
+        if tokens is None:
+            tokens = self._parse(text)
+            self.query_cache.set(key, tokens)
+        return list(tokens)
+
+    def tokenize_documents(self, texts: list[str]) -> list[list[str]]:
+        """
+        複数のチャンクを分かち書きする。
+        キャッシュにあるものは再利用し、残りはまとめて (件数が多ければ並列で) 分かち書きする。
+        """
+        keys = [self._text_key(text) for text in texts]
+        results = [None] * len(texts)
+
+        if self.token_cache is not None:
+            for i, key in enumerate(keys):
+                results[i] = self.token_cache.get(key)
+
+        missing_indices = [i for i, tokens in enumerate(results) if tokens is None]
+        print(f"分かち書き: {len(texts) - len(missing_indices)}件をキャッシュから再利用, {len(missing_indices)}件を新たに処理します。")
+        if not missing_indices:
+            return results
+
+        missing_texts = [texts[i] for i in missing_indices]
+        if self.n_workers > 1 and len(missing_texts) >= PARALLEL_TOKENIZE_MIN_TEXTS:
+            new_tokens = self._tokenize_parallel(missing_texts)
+        else:
+            new_tokens = [self._parse(text) for text in tqdm(missing_texts, desc="Tokenizing for BM25")]
+
+        for i, tokens in zip(missing_indices, new_tokens):
+            results[i] = tokens
+            if self.token_cache is not None:
+                self.token_cache.set(keys[i], tokens)
+        return results
+
+    def _tokenize_parallel(self, texts: list[str]) -> list[list[str]]:
+        """ワーカープロセスに一定件数ずつ渡して分かち書きする"""
+        batch_size = max(100, len(texts) // (self.n_workers * 4))
+        batches = [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+        results = []
+        with ProcessPoolExecutor(
+            max_workers=self.n_workers, initializer=_init_worker, initargs=(self.tagger_args,)
+        ) as executor:
+            for batch_tokens in tqdm(executor.map(_tokenize_in_worker, batches), total=len(batches), desc="Tokenizing for BM25"):
+                results.extend(batch_tokens)
+        return results
@@ -1,9 +1,11 @@
 import os
+import io
 import json
 from collections import defaultdict
-from datetime import date
+from datetime import date, datetime
 import threading
 import time
+from contextlib import ExitStack
 from functools import wraps
 from flask import (
     Flask,
@@ -14,6 +16,7 @@ from flask import (
     redirect,
     url_for,
     send_from_directory,
+    send_file,
     jsonify,
     session,
     make_response,
@@ -36,7 +39,14 @@ import gemini_client
 from gemini_client import _prepare_patient_facts
 import excel_writer
 from patient_info_parser import PatientInfoParser
+from schemas import PATIENT_INFO_EXTRACTION_GROUPS
 from rag_executor import RAGExecutor
+from rag_preloader import RAGPreloader, RAG_PRELOAD_PIPELINES
+from rag_executor_pool import RAGExecutorPool, get_allowed_pipelines
+from job_queue import JobManager, JobStore, make_coalesce_key, parse_event_id
+from excel_export_cache import EXCEL_EXPORT_MODE, ExcelExportCache, OutputDirJanitor
+from excel_batch_export import BatchExportManager
+from prompt_assembly import get_prompt_token_stats
 
 # show_summary.py からITEM_KEY_TO_JAPANESEを移植
 ITEM_KEY_TO_JAPANESE = {
@@ -79,35 +89,70 @@ login_manager.init_app(app)
 # どのページにリダイレクト（転送）するかを指定します。'login'は下の@app.route('/login')を持つ関数名を指します。
 login_manager.login_view = "login"
 
-# pipeline_nameをキー、RAGExecutorインスタンスを値とする辞書（キャッシュ）
-rag_executors = {}
-# 複数ユーザーからの同時アクセスで問題が起きないようにするためのロック機構
-rag_executor_lock = threading.Lock()
+# pipeline_nameごとにRAGExecutorを保持するプール
+# 保持数の上限 (LRU)・アイドル時間で解放し、許可リストにないパイプラインは読み込まない
+rag_executor_pool = RAGExecutorPool(
+    lambda pipeline_name: RAGExecutor(pipeline_name=pipeline_name),
+    allowed_pipelines=get_allowed_pipelines(),
+    pinned=RAG_PRELOAD_PIPELINES,
+    on_load=lambda pipeline_name, load_seconds: rag_preloader.record_loaded(pipeline_name, load_seconds),
+)
 
 def get_rag_executor(pipeline_name: str) -> RAGExecutor:
     """
-    RAGExecutorのインスタンスをキャッシュから取得または新規作成する関数。
+    RAGExecutorのインスタンスをプールから取得または新規作成する関数。
+    生成処理の途中で解放されないよう、実行時は rag_executor_pool.lease() を使用すること。
     """
-    # キャッシュに存在すれば、それを返す（高速）
-    if pipeline_name in rag_executors:
-        print(f"'{pipeline_name}' のExecutorをキャッシュから再利用します。")
-        return rag_executors[pipeline_name]
-
-    # キャッシュになければ、ロックをかけて新規作成
-    with rag_executor_lock:
-        # ダブルチェックロッキング
-        if pipeline_name in rag_executors:
-            return rag_executors[pipeline_name]
-
-        print(f"'{pipeline_name}' のExecutorを新規に初期化します...")
-        try:
-            executor = RAGExecutor(pipeline_name=pipeline_name)
-            rag_executors[pipeline_name] = executor # キャッシュに保存
-            print(f"'{pipeline_name}' の初期化が完了し、キャッシュに保存しました。")
-            return executor
-        except Exception as e:
-            print(f"FATAL: RAG Executor ('{pipeline_name}') の初期化に失敗しました: {e}")
-            raise e
+    try:
+        return rag_executor_pool.get(pipeline_name)
+    except Exception as e:
+        print(f"FATAL: RAG Executor ('{pipeline_name}') の初期化に失敗しました: {e}")
+        raise e
+
+
+# 最初の利用者がモデルの読み込みを待たなくて済むよう、起動時にバックグラウンドでRAGパイプラインを読み込む
+# (対象は環境変数 RAG_PRELOAD_PIPELINES で指定する)
+rag_preloader = RAGPreloader(get_rag_executor)
+rag_preloader.start()
+
+# 計画案の生成はリクエストのスレッドではなくワーカーで実行し、イベントをSQLiteに保存する
+# (ブラウザが再接続しても、Last-Event-ID の続きから受け取れる)
+generation_jobs = JobManager(JobStore())
+
+
+# 作成した計画書 (xlsx) を plan_id ごとに短時間保持するキャッシュ
+excel_export_cache = ExcelExportCache()
+# OUTPUT_DIR に溜まった古い計画書ファイルを定期的に削除する
+output_dir_janitor = OutputDirJanitor(excel_writer.OUTPUT_DIR)
+output_dir_janitor.start()
+# 計画書の一括出力は、excel_batch_export.py を別プロセスとして起動して実行する (Webのプロセスは fork しない)
+batch_exports = BatchExportManager()
+
+XLSX_MIMETYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+
+def job_event_stream(job_id: str, after_seq: int = 0) -> Response:
+    """生成ジョブのイベントを送るSSEのレスポンスを作成する"""
+    return Response(
+        generation_jobs.stream(job_id, after_seq),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def resume_generation_job(kind: str):
+    """
+    EventSource の再接続 (Last-Event-ID ヘッダー付き) であれば、実行中・実行済みのジョブの続きを送るレスポンスを返す。
+    再接続でない場合や、ジョブが見つからない・他のユーザーのジョブである場合は None を返す。
+    """
+    job_id, after_seq = parse_event_id(request.headers.get("Last-Event-ID"))
+    if job_id is None:
+        return None
+    job = generation_jobs.get_job(job_id)
+    if job is None or job["kind"] != kind or not generation_jobs.can_access(job_id, current_user.id):
+        return None
+    print(f"生成ジョブ {job_id} に再接続しました (イベント {after_seq} 以降を送信)")
+    return job_event_stream(job_id, after_seq)
 
 
 # 患者情報解析パーサーを初期化
@@ -405,6 +450,9 @@ def generate_plan():
 @login_required
 def generate_general_stream():
     """Ollama単体モデルによる計画案をストリーミングで生成するAPI"""
+    resumed = resume_generation_job("general")
+    if resumed is not None:
+        return resumed
     try:
         patient_id = int(request.args.get("patient_id"))
         therapist_notes = request.args.get("therapist_notes", "")
@@ -420,10 +468,15 @@ def generate_general_stream():
 
         patient_data["therapist_notes"] = therapist_notes
 
-        # 修正: gemini_client の Ollama用関数を呼び出す
-        stream_generator = gemini_client.generate_ollama_plan_stream(patient_data)
-
-        return Response(stream_generator, mimetype="text/event-stream")
+        # 修正: gemini_client の Ollama用関数を呼び出す (ワーカーで実行し、イベントを送る)
+        # 同じ患者情報・所見の生成が実行中の場合 (ダブルクリック・複数タブなど) は、その結果を共有する
+        job_id = generation_jobs.submit(
+            "general",
+            current_user.id,
+            lambda: gemini_client.generate_ollama_plan_stream(patient_data),
+            coalesce_key=make_coalesce_key("general", _prepare_patient_facts(patient_data)),
+        )
+        return job_event_stream(job_id)
 
     except ValueError:
         error_message = "無効な患者IDが指定されました。"
@@ -443,10 +496,21 @@ def generate_rag_stream(pipeline_name):
     指定されたRAGパイプラインによる計画案をストリーミングで生成するAPI (修正版)
     """
     
+    if not rag_executor_pool.is_allowed(pipeline_name):
+        error_message = f"パイプライン '{pipeline_name}' は利用できません。"
+        error_event = f"event: error\ndata: {json.dumps({'error': error_message})}\n\n"
+        return Response(error_event, mimetype="text/event-stream", status=404)
+
+    resumed = resume_generation_job(f"rag:{pipeline_name}")
+    if resumed is not None:
+        return resumed
+
     # 1. リクエスト情報をジェネレータの外で取得する
     try:
         patient_id = int(request.args.get("patient_id"))
         therapist_notes = request.args.get("therapist_notes", "")
+        # no_cache=1 の場合はキャッシュ済みの結果を使わずにパイプラインを再実行する
+        use_cache = request.args.get("no_cache", "0").lower() not in ("1", "true")
         if not current_user or not current_user.is_authenticated:
             raise AttributeError("ユーザーセッションが無効です。再度ログインしてください。")
         staff_id = current_user.id
@@ -460,36 +524,36 @@ def generate_rag_stream(pipeline_name):
         error_event = f"event: error\ndata: {json.dumps({'error': error_message})}\n\n"
         return Response(error_event, mimetype="text/event-stream", status=401)
 
-    # 2. ジェネレータ関数は引数で値を受け取るようにする
-    def generate_events(p_id, t_notes, s_id, pipeline_name):
-        try:
-            # 3. 引数で受け取った値を使用する
-            assigned_patients = database.get_assigned_patients(s_id)
-            # assigned_patients = database.get_assigned_patients(current_user.id)
-            if p_id not in [p["patient_id"] for p in assigned_patients]:
-                 error_message = "権限がありません。"
-                 error_event = f"event: error\ndata: {json.dumps({'error': error_message})}\n\n"
-                 yield error_event
-                 return
-
-            patient_data = database.get_patient_data_for_plan(p_id)
-            if not patient_data:
-                error_message = "患者データが見つかりません。"
-                error_event = f"event: error\ndata: {json.dumps({'error': error_message})}\n\n"
-                yield error_event
-                return
+    # 2. 権限の確認と患者情報の整形は、同じ内容の生成をまとめるためのキーに使うため、リクエストのスレッドで行う
+    try:
+        assigned_patients = database.get_assigned_patients(staff_id)
+        if patient_id not in [p["patient_id"] for p in assigned_patients]:
+            error_message = "権限がありません。"
+            error_event = f"event: error\ndata: {json.dumps({'error': error_message})}\n\n"
+            return Response(error_event, mimetype="text/event-stream", status=403)
 
-            patient_data["therapist_notes"] = t_notes
-            
-            # RAG Executor の取得と実行
-            rag_executor = get_rag_executor(pipeline_name)
-            if not rag_executor:
-                raise Exception(f"パイプライン '{pipeline_name}' の Executorを取得できませんでした。")
-            
-            # 患者情報を整形 (Ollama版でも _prepare_patient_facts を使う想定)
-            patient_facts = _prepare_patient_facts(patient_data) 
-            
-            rag_result = rag_executor.execute(patient_facts)
+        patient_data = database.get_patient_data_for_plan(patient_id)
+        if not patient_data:
+            error_message = "患者データが見つかりません。"
+            error_event = f"event: error\ndata: {json.dumps({'error': error_message})}\n\n"
+            return Response(error_event, mimetype="text/event-stream", status=404)
+
+        patient_data["therapist_notes"] = therapist_notes
+
+        # 患者情報を整形 (Ollama版でも _prepare_patient_facts を使う想定)
+        patient_facts = _prepare_patient_facts(patient_data)
+    except Exception as e:
+        app.logger.error(f"RAGモデル({pipeline_name})の患者情報の取得中にエラーが発生しました: {e}", exc_info=True)
+        error_message = f"サーバーエラーが発生しました: {e}"
+        error_event = f"event: error\ndata: {json.dumps({'error': error_message})}\n\n"
+        return Response(error_event, mimetype="text/event-stream", status=500)
+
+    # 3. ジェネレータ関数は引数で値を受け取るようにする
+    def generate_events(patient_facts, pipeline_name, use_cache):
+        try:
+            # RAG Executor の取得と実行 (実行中はプールから解放されない)
+            with rag_executor_pool.lease(pipeline_name) as rag_executor:
+                rag_result = rag_executor.execute(patient_facts, use_cache=use_cache)
             
             # RAGの結果をyield
             specialized_plan_dict = rag_result.get("answer", {})
@@ -533,9 +597,43 @@ def generate_rag_stream(pipeline_name):
             error_event = f"event: error\ndata: {json.dumps({'error': error_message})}\n\n"
             yield error_event
 
-    # 4. ジェネレータを呼び出す際に、取得した値を渡す
-    # return Response(generate_events(patient_id, therapist_notes, pipeline_name), mimetype='text/event-stream')
-    return Response(generate_events(patient_id, therapist_notes, staff_id, pipeline_name), mimetype='text/event-stream')
+    # 4. ジェネレータを呼び出す際に、取得した値を渡す (ワーカーで実行し、イベントを送る)
+    # 同じパイプライン・患者情報の生成が実行中の場合は、新しく実行せずにその結果を共有する (single-flight)
+    kind = f"rag:{pipeline_name}"
+    job_id = generation_jobs.submit(
+        kind,
+        staff_id,
+        lambda: generate_events(patient_facts, pipeline_name, use_cache),
+        coalesce_key=make_coalesce_key(kind, {"patient_facts": patient_facts, "use_cache": use_cache}),
+    )
+    return job_event_stream(job_id)
+
+
+@app.route("/api/jobs/<job_id>")
+@login_required
+def get_generation_job(job_id):
+    """生成ジョブの状態を返すAPI"""
+    job = generation_jobs.get_job(job_id)
+    if job is None or not generation_jobs.can_access(job_id, current_user.id):
+        return jsonify({"error": "ジョブが見つかりません。"}), 404
+    return jsonify(job)
+
+
+@app.route("/api/jobs/<job_id>/events")
+@login_required
+def stream_generation_job(job_id):
+    """
+    生成ジョブのイベントを、指定した連番の続きからストリーミングで送るAPI。
+    連番は Last-Event-ID ヘッダー (「ジョブID:連番」) またはクエリパラメータ last_event_id で指定する。
+    """
+    if not generation_jobs.can_access(job_id, current_user.id):
+        error_event = f"event: error\ndata: {json.dumps({'error': 'ジョブが見つかりません。'})}\n\n"
+        return Response(error_event, mimetype="text/event-stream", status=404)
+
+    header_job_id, after_seq = parse_event_id(request.headers.get("Last-Event-ID"))
+    if header_job_id != job_id:
+        after_seq = request.args.get("last_event_id", 0, type=int)
+    return job_event_stream(job_id, after_seq)
 
 @app.route("/save_plan", methods=["POST"])
 @login_required
@@ -587,8 +685,14 @@ def save_plan():
             flash("保存した計画データの再取得に失敗しました。", "danger")
             return redirect(url_for("index"))
 
-        output_filepath = excel_writer.create_plan_sheet(plan_data_for_excel)
-        output_filename = os.path.basename(output_filepath)
+        if EXCEL_EXPORT_MODE == "file":
+            output_filepath = excel_writer.create_plan_sheet(plan_data_for_excel)
+            download_url = url_for("download_file", filename=os.path.basename(output_filepath))
+        else:
+            # ファイルに保存せずメモリ上で作成し、ダウンロード時にそのまま返す
+            output_filename, output_bytes = excel_writer.create_plan_sheet_bytes(plan_data_for_excel)
+            excel_export_cache.put(new_plan_id, output_filename, output_bytes)
+            download_url = url_for("download_plan_excel", plan_id=new_plan_id)
 
         database.delete_all_likes_for_patient(patient_id)
 
@@ -596,7 +700,7 @@ def save_plan():
 
         return render_template(
             "download_and_redirect.html",
-            download_url=url_for("download_file", filename=output_filename),
+            download_url=download_url,
             redirect_url=url_for("index"),
         )
     except Exception as e:
@@ -739,18 +843,26 @@ def regenerate_item():
         patient_data["therapist_notes"] = therapist_notes
 
         # --- RAG関連をコメントアウト ---
-        rag_executor = None
         if model_type == 'specialized':
             pipeline_name = "structured_semantic_chunk-hyde_prf-chromadb-gemini_embedding-reranker-nli_filter"
-            rag_executor = get_rag_executor(pipeline_name)
-            if not rag_executor:
-                raise Exception(f"パイプライン '{pipeline_name}' の Executorを取得できませんでした。")
+            # ストリームを送り終えるまで、Executorがプールから解放されないようにする
+            lease = ExitStack()
+            rag_executor = lease.enter_context(rag_executor_pool.lease(pipeline_name))
+            response = Response(
+                gemini_client.regenerate_plan_item_stream(
+                    patient_data=patient_data, item_key=item_key, current_text=current_text,
+                    instruction=instruction, rag_executor=rag_executor
+                ),
+                mimetype="text/event-stream",
+            )
+            response.call_on_close(lease.close)
+            return response
 
         # 再生成関数を呼び出す (Gemini用だがOllama実装に置き換える想定)
         # 現状はGeminiのままなので注意
         stream_generator = gemini_client.regenerate_plan_item_stream(
             patient_data=patient_data, item_key=item_key, current_text=current_text,
-            instruction=instruction, rag_executor=rag_executor
+            instruction=instruction, rag_executor=None
         )
 
         return Response(stream_generator, mimetype="text/event-stream")
@@ -826,6 +938,55 @@ def download_file(filename):
         return redirect(url_for("index"))
 
 
+@app.route("/download_plan/<int:plan_id>")
+@login_required
+def download_plan_excel(plan_id):
+    """計画書のExcelファイルを、一時ファイルを作らずにメモリ上から直接ダウンロードさせる"""
+    try:
+        cached = excel_export_cache.get(plan_id)
+        plan_data = database.get_plan_by_id(plan_id)
+        if not plan_data:
+            flash("指定された計画書が見つかりません。", "danger")
+            return redirect(url_for("index"))
+
+        # 権限チェック (キャッシュにある場合も確認する)
+        assigned_patients = database.get_assigned_patients(current_user.id)
+        is_admin = current_user.role == "admin"
+        if not is_admin and plan_data["patient_id"] not in [
+            p["patient_id"] for p in assigned_patients
+        ]:
+            flash("この計画書をダウンロードする権限がありません。", "danger")
+            return redirect(url_for("index"))
+
+        if cached is None:
+            # 保持期間を過ぎた場合などは、保存済みの計画データから作り直す
+            cached = excel_writer.create_plan_sheet_bytes(plan_data)
+            excel_export_cache.put(plan_id, *cached)
+        output_filename, output_bytes = cached
+
+        return send_file(
+            io.BytesIO(output_bytes),
+            mimetype=XLSX_MIMETYPE,
+            as_attachment=True,
+            download_name=output_filename,
+        )
+    except Exception as e:
+        app.logger.error(f"計画書 {plan_id} のExcel作成中にエラーが発生しました: {e}", exc_info=True)
+        flash(f"計画書のExcel作成中にエラーが発生しました: {e}", "danger")
+        return redirect(url_for("index"))
+
+
+@app.route("/healthz/ready")
+def healthz_ready():
+    """
+    起動時に読み込むRAGパイプラインの準備ができているかだけを返す (ロードバランサーなどからの確認用のため、ログイン不要)。
+    全パイプラインの読み込みが完了していれば200、それ以外は503を返す。
+    詳しい状態は管理者専用の /admin/metrics で確認する。
+    """
+    ready = rag_preloader.status()["ready"]
+    return jsonify({"ready": ready}), 200 if ready else 503
+
+
 @app.route("/api/parse-patient-info", methods=["POST"])
 @login_required
 def api_parse_patient_info():
@@ -848,6 +1009,58 @@ def api_parse_patient_info():
         ), 500
 
 
+@app.route("/api/parse-patient-info/stream", methods=["POST"])
+@login_required
+def api_parse_patient_info_stream():
+    """
+    カルテテキストを解析し、グループごとの抽出結果が出るたびにSSEで送信するAPI。
+    送信するイベント:
+      - group_result: 抽出できたグループの項目 ({"group", "label", "fields", "completed", "total"})
+      - group_failed: 抽出に失敗したグループ ({"group", "label", "completed", "total"})
+      - finished: 全グループの処理完了 ({"failed_groups", "total"})
+      - error: 処理全体のエラー
+    """
+    if not patient_info_parser:
+        error_event = f"event: error\ndata: {json.dumps({'error': 'サーバー側でパーサーが初期化されていません。'})}\n\n"
+        return Response(error_event, mimetype="text/event-stream", status=500)
+
+    data = request.get_json(silent=True)
+    if not data or "text" not in data or not data["text"].strip():
+        error_event = f"event: error\ndata: {json.dumps({'error': '解析対象のテキストがありません。'})}\n\n"
+        return Response(error_event, mimetype="text/event-stream", status=400)
+
+    text_to_parse = data["text"]
+
+    def generate_events(text):
+        total = len(PATIENT_INFO_EXTRACTION_GROUPS)
+        completed = 0
+        failed_groups = []
+        try:
+            for group_schema, group_result in patient_info_parser.iter_group_results(text):
+                completed += 1
+                payload = {
+                    "group": group_schema.__name__,
+                    "label": (group_schema.__doc__ or group_schema.__name__).strip().splitlines()[0],
+                    "completed": completed,
+                    "total": total,
+                }
+                if group_result:
+                    payload["fields"] = group_result
+                    yield f"event: group_result\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+                else:
+                    failed_groups.append(group_schema.__name__)
+                    yield f"event: group_failed\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+            finished_data = {"failed_groups": failed_groups, "total": total}
+            yield f"event: finished\ndata: {json.dumps(finished_data)}\n\n"
+        except Exception as e:
+            app.logger.error(f"Error during streaming patient info parsing: {e}")
+            error_data = {"error": "解析中にサーバーでエラーが発生しました。", "details": str(e)}
+            yield f"event: error\ndata: {json.dumps(error_data, ensure_ascii=False)}\n\n"
+
+    return Response(generate_events(text_to_parse), mimetype="text/event-stream")
+
+
 # 管理者専用ルート↓
 # ーーーーーーーーーーーーーーーーーーーーーーーーーーーーーーーーーーー
 
@@ -930,6 +1143,93 @@ def delete_staff(staff_id):
     return redirect(url_for("manage_assignments"))
 
 
+# 管理者権限　必須
+@app.route("/admin/export_plans", methods=["POST"])
+@login_required
+@admin_required
+def export_plans():
+    """
+    複数の計画書をExcelに一括出力してZIPファイルにまとめる処理を別プロセスで開始し、進捗のページに移動する。
+    フォームの plan_ids (カンマ区切り)、または from / to (作成日, YYYY-MM-DD) で対象を指定する。
+    """
+    try:
+        plan_ids_param = request.form.get("plan_ids", "").strip()
+        plan_ids = [int(x) for x in plan_ids_param.split(",") if x.strip()] if plan_ids_param else None
+        start_date = date.fromisoformat(request.form["from"]) if request.form.get("from") else None
+        end_date = date.fromisoformat(request.form["to"]) if request.form.get("to") else None
+    except ValueError:
+        flash("計画書IDまたは日付の形式が正しくありません。", "danger")
+        return redirect(url_for("manage_assignments"))
+    if not plan_ids and start_date is None and end_date is None:
+        flash("出力する計画書のIDまたは期間を指定してください。", "warning")
+        return redirect(url_for("manage_assignments"))
+
+    try:
+        export_id = batch_exports.start(current_user.id, plan_ids=plan_ids, start_date=start_date, end_date=end_date)
+    except RuntimeError as e:
+        flash(str(e), "warning")
+        return redirect(url_for("manage_assignments"))
+    return redirect(url_for("export_plans_progress", export_id=export_id))
+
+
+@app.route("/admin/export_plans/<export_id>")
+@login_required
+@admin_required
+def export_plans_progress(export_id):
+    """一括出力の進捗を表示し、完了したらZIPファイルをダウンロードさせるページ"""
+    if batch_exports.status(export_id) is None:
+        flash("一括出力が見つかりません。", "warning")
+        return redirect(url_for("manage_assignments"))
+    return render_template(
+        "export_progress.html",
+        status_url=url_for("export_plans_status", export_id=export_id),
+        download_url=url_for("export_plans_download", export_id=export_id),
+        redirect_url=url_for("manage_assignments"),
+    )
+
+
+@app.route("/admin/export_plans/<export_id>/status")
+@login_required
+@admin_required
+def export_plans_status(export_id):
+    """一括出力の状態と進捗 (完了数・全件数・失敗数) を返す"""
+    status = batch_exports.status(export_id)
+    if status is None:
+        return jsonify({"error": "一括出力が見つかりません。"}), 404
+    return jsonify(status)
+
+
+@app.route("/admin/export_plans/<export_id>/download")
+@login_required
+@admin_required
+def export_plans_download(export_id):
+    """完了した一括出力のZIPファイルを返す"""
+    output_path = batch_exports.output_path(export_id)
+    if output_path is None:
+        return jsonify({"error": "一括出力が完了していません。"}), 404
+    status = batch_exports.status(export_id)
+    created_at = datetime.fromtimestamp(status["created_at"]).strftime("%Y%m%d_%H%M%S")
+    response = send_file(output_path, mimetype="application/zip", as_attachment=True, download_name=f"RehabPlans_{created_at}.zip")
+    response.headers["X-Plan-Count"] = str(status["total"])
+    return response
+
+
+@app.route("/admin/metrics")
+@login_required
+@admin_required
+def admin_metrics():
+    """RAGパイプラインの読み込み状況と、実行プール・キャッシュ・生成ジョブ・接続プールなどの利用状況を返す"""
+    status = rag_preloader.status()
+    status["executor_pool"] = rag_executor_pool.stats()
+    status["rag_caches"] = rag_executor_pool.cache_stats()
+    status["prompt_tokens"] = get_prompt_token_stats()
+    status["generation_jobs"] = generation_jobs.stats()
+    status["excel_export_cache"] = excel_export_cache.stats()
+    status["batch_exports"] = batch_exports.stats()
+    status["db_pool"] = database.get_db_pool_stats()
+    return jsonify(status)
+
+
 if __name__ == "__main__":
     # app.run(host="0.0.0.0", port=5000, debug=False) # 最初にRAGインスタンスを作る場合に邪魔
 
@@ -0,0 +1,65 @@
+"""
+計画書の一括出力 (excel_batch_export) のベンチマーク。
+ワーカープロセス数ごとに、同じ件数の計画書をZIPに出力する時間を比較する。
+
+実行方法 (リポジトリのルートで):
+    python benchmarks/bench_batch_export.py --plans 40 --workers 1 2 4
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import sys
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+os.chdir(ROOT_DIR)
+
+from excel_batch_export import stream_plans_zip  # noqa: E402
+
+
+def make_plans(n: int) -> list[dict]:
+    """データベースを使わずに計測するための、計画書データのダミー"""
+    return [
+        {
+            "plan_id": i,
+            "name": f"ベンチマーク{i}",
+            "age": 60 + i % 30,
+            "gender": "男" if i % 2 else "女",
+            "goal_p_residence_slct": "home_detached",
+            "goals_1_month_txt": "屋内歩行の自立" * 5,
+            "policy_content_txt": "筋力増強訓練・歩行訓練を中心に実施する。" * 5,
+        }
+        for i in range(1, n + 1)
+    ]
+
+
+def bench(plans: list[dict], workers: int) -> tuple[float, int]:
+    start_time = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        size = sum(len(chunk) for chunk in stream_plans_zip(plans, max_workers=workers))
+    return time.perf_counter() - start_time, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description="計画書の一括出力のベンチマーク")
+    parser.add_argument("--plans", type=int, default=40, help="出力する計画書の件数")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4], help="比較するワーカープロセスの数")
+    args = parser.parse_args()
+
+    plans = make_plans(args.plans)
+    print(f"計画書 {len(plans)} 件をZIPに出力 (CPU数: {os.cpu_count()})")
+    baseline = None
+    for workers in args.workers:
+        seconds, size = bench(plans, workers)
+        baseline = baseline or seconds
+        print(
+            f"  workers={workers:2d}: {seconds:6.2f} 秒 ({len(plans) / seconds:5.1f} 件/秒, "
+            f"{size / 1024:.0f} KB, 1プロセス比 {baseline / seconds:.1f} 倍)"
+        )
+
+
+if __name__ == "__main__":
+    main()
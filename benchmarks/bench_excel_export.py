@@ -0,0 +1,128 @@
+"""
+Excel出力 (excel_writer.create_plan_sheet) のマイクロベンチマーク。
+
+- セル参照の解決: 結合範囲を毎回走査する従来の方法と、TemplateCellIndex を使う方法を、1回の出力分のセル参照で比較する。
+- 1回の出力全体: テンプレートを毎回 load_workbook() する場合と、キャッシュから複製する場合を比較する。
+
+実行方法 (リポジトリのルートで):
+    python benchmarks/bench_excel_export.py --repeat 20
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+os.chdir(ROOT_DIR)
+
+from openpyxl import load_workbook  # noqa: E402
+from openpyxl.cell import MergedCell  # noqa: E402
+
+import excel_template_cache  # noqa: E402
+import excel_writer  # noqa: E402
+
+# create_plan_sheet の特殊処理ブロック (ラジオボタン・チェックボックス) で参照するセル
+SPECIAL_CELLS = [("様式23_1", c) for c in ("V3", "X3", "S16", "S16", "M62", "O62", "J63", "P63", "V63", "AC63", "AJ63")] + [
+    ("様式23_2", c) for c in ("E3", "H3", "K3", "O3", "R3", "E5", "I5", "M5", "P5", "S5")
+]
+THERAPY_NAMES = ["header_therapy_pt_chk", "header_therapy_ot_chk", "header_therapy_st_chk"]
+
+
+def _scan_cell_by_address(wb, sheet_name, cell_address):
+    """索引を使わない従来の方法 (結合範囲を線形に走査する)"""
+    ws = wb[sheet_name]
+    cell = ws[cell_address]
+    if isinstance(cell, MergedCell):
+        for merged_range in ws.merged_cells.ranges:
+            if cell.coordinate in merged_range:
+                return ws.cell(merged_range.min_row, merged_range.min_col)
+    return cell
+
+
+def _scan_cell_by_name(wb, name):
+    sheetname, address = list(wb.defined_names[name].destinations)[0]
+    return wb[sheetname][address.replace("$", "").split(":")[0]]
+
+
+def _lookups():
+    return list(excel_writer.COLUMN_TO_CELL_COORDINATE_MAP.values()) + SPECIAL_CELLS
+
+
+def bench_cell_lookup(wb, repeat: int):
+    lookups = _lookups()
+
+    def scan():
+        for sheet_name, address in lookups:
+            _scan_cell_by_address(wb, sheet_name, address)
+        for name in THERAPY_NAMES:
+            _scan_cell_by_name(wb, name)
+
+    def indexed():
+        for sheet_name, address in lookups:
+            excel_writer._get_cell_by_address(wb, sheet_name, address)
+        for name in THERAPY_NAMES:
+            excel_writer.get_cell_by_name(wb, name)
+
+    # 索引の作成は初回のみ (テンプレートのキャッシュ利用時は読み込み時に作成済み)
+    start_time = time.perf_counter()
+    excel_template_cache.get_cell_index(wb)
+    build_seconds = time.perf_counter() - start_time
+    return _time(scan, repeat), _time(indexed, repeat), build_seconds, len(lookups) + len(THERAPY_NAMES)
+
+
+def bench_export(repeat: int, use_cache: bool):
+    excel_template_cache.EXCEL_TEMPLATE_CACHE_ENABLED = use_cache
+    plan_data = {"name": "ベンチマーク", "age": 80, "gender": "男", "goal_p_residence_slct": "home_detached"}
+    with tempfile.TemporaryDirectory() as tmp:
+        excel_writer.OUTPUT_DIR = tmp
+
+        def export():
+            with contextlib.redirect_stdout(io.StringIO()):
+                excel_writer.create_plan_sheet(plan_data)
+
+        if use_cache:
+            export()  # 初回の読み込みは計測に含めない
+        return _time(export, repeat)
+
+
+def _time(func, repeat: int) -> list[float]:
+    results = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        func()
+        results.append(time.perf_counter() - start_time)
+    return results
+
+
+def _ms(values: list[float]) -> str:
+    return f"中央値 {statistics.median(values) * 1000:8.2f} ms / 平均 {statistics.mean(values) * 1000:8.2f} ms"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Excel出力のマイクロベンチマーク")
+    parser.add_argument("--repeat", type=int, default=20, help="各計測の繰り返し回数")
+    args = parser.parse_args()
+
+    wb = load_workbook(excel_writer.TEMPLATE_PATH)
+    scan, indexed, build_seconds, count = bench_cell_lookup(wb, args.repeat)
+    print(f"セル参照の解決 (1回の出力あたり {count} 件)")
+    print(f"  結合範囲を走査: {_ms(scan)}")
+    print(f"  索引を使用    : {_ms(indexed)}  (索引の作成: {build_seconds * 1000:.2f} ms, 初回のみ)")
+    print(f"  高速化        : {statistics.median(scan) / statistics.median(indexed):.1f} 倍")
+
+    without_cache = bench_export(args.repeat, use_cache=False)
+    with_cache = bench_export(args.repeat, use_cache=True)
+    print("1回の出力全体 (create_plan_sheet)")
+    print(f"  毎回 load_workbook : {_ms(without_cache)}")
+    print(f"  テンプレートキャッシュ: {_ms(with_cache)}")
+    print(f"  高速化              : {statistics.median(without_cache) / statistics.median(with_cache):.1f} 倍")
+
+
+if __name__ == "__main__":
+    main()
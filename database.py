@@ -1,11 +1,10 @@
 import os
 import json
-from datetime import date, datetime
+from datetime import date, datetime, timedelta
 from collections import defaultdict
 from dotenv import load_dotenv
 
 from sqlalchemy import (
-    create_engine,
     Column,
     Integer,
     String,
@@ -18,9 +17,12 @@ from sqlalchemy import (
     Table,
     func,
 )
-from sqlalchemy.orm import sessionmaker, relationship, declarative_base
+from sqlalchemy.orm import sessionmaker, relationship, declarative_base, joinedload
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from db_pool import build_database_url, create_db_engine, get_pool_stats
 
 load_dotenv()
 
@@ -30,13 +32,12 @@ DB_HOST = os.getenv("DB_HOST")
 DB_NAME = os.getenv("DB_NAME")
 
 # データベース接続URLを作成
-# "mysql+pymysql" の部分で、SQLAlchemyが内部的にPyMySQLを使うことを指定
-DATABASE_URL = (
-    f"mysql+pymysql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}/{DB_NAME}?charset=utf8mb4"
-)
+# (SQLiteは DB_USE_SQLITE=true または DATABASE_URL で明示した場合のみ使う)
+DATABASE_URL = build_database_url()
 
 # SQLAlchemyのエンジンを作成
-engine = create_engine(DATABASE_URL, echo=False)
+# 接続プールの大きさ・接続の再作成 (pool_recycle)・生存確認 (pool_pre_ping) は環境変数で設定する (db_pool.py)
+engine = create_db_engine(DATABASE_URL)
 
 # セッションを作成するためのクラス（ファクトリ）を定義
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
@@ -970,15 +971,24 @@ def save_suggestion_like(
     db = SessionLocal()
     try:
         # いいねを追加または更新 (UPSERT)
-        stmt = mysql_insert(SuggestionLike).values(
+        values = dict(
             patient_id=patient_id,
             item_key=item_key,
             liked_model=liked_model,
             staff_id=staff_id,
         )
-        on_duplicate_stmt = stmt.on_duplicate_key_update(
-            staff_id=stmt.inserted.staff_id, updated_at=func.now()
-        )
+        if engine.dialect.name == "sqlite":
+            # ローカルでのテスト用 (SQLite) は ON CONFLICT で同じ処理を行う
+            stmt = sqlite_insert(SuggestionLike).values(**values)
+            on_duplicate_stmt = stmt.on_conflict_do_update(
+                index_elements=["patient_id", "item_key", "liked_model"],
+                set_=dict(staff_id=stmt.excluded.staff_id, updated_at=func.now()),
+            )
+        else:
+            stmt = mysql_insert(SuggestionLike).values(**values)
+            on_duplicate_stmt = stmt.on_duplicate_key_update(
+                staff_id=stmt.inserted.staff_id, updated_at=func.now()
+            )
         db.execute(on_duplicate_stmt)
         db.commit()
     except Exception as e:
@@ -1056,6 +1066,37 @@ def get_all_regeneration_history():
         db.close()
 
 
+def _plan_to_dict(plan):
+    """RehabilitationPlan を、患者情報・いいね情報を含む辞書に変換する"""
+    # 計画データを辞書に変換
+    plan_data = {c.name: getattr(plan, c.name) for c in plan.__table__.columns}
+
+    # 関連する患者情報も取得してマージ
+    patient = plan.patient
+    patient_data = {
+        "patient_id": patient.patient_id,
+        "name": patient.name,
+        "age": patient.age,
+        "gender": patient.gender,
+        "date_of_birth": patient.date_of_birth,
+    }
+
+    # patient_data を先に置き、plan_data で上書きする形で結合
+    # (patient_id などが両方に含まれるため)
+    final_data = {**patient_data, **plan_data}
+
+    # 【追加】JSON形式で保存されたいいね情報を辞書に復元して追加
+    if plan.liked_items_json:
+        try:
+            final_data["liked_items"] = json.loads(plan.liked_items_json)
+        except json.JSONDecodeError:
+            final_data["liked_items"] = {}  # パース失敗時は空の辞書
+    else:
+        final_data["liked_items"] = {}  # いいね情報がない場合は空の辞書をセット
+
+    return final_data
+
+
 def get_plan_by_id(plan_id: int):
     """【新規追加】plan_idを使って単一の計画書データを取得する"""
     db = SessionLocal()
@@ -1068,33 +1109,29 @@ def get_plan_by_id(plan_id: int):
         if not plan:
             return None
 
-        # 計画データを辞書に変換
-        plan_data = {c.name: getattr(plan, c.name) for c in plan.__table__.columns}
-
-        # 関連する患者情報も取得してマージ
-        patient = plan.patient
-        patient_data = {
-            "patient_id": patient.patient_id,
-            "name": patient.name,
-            "age": patient.age,
-            "gender": patient.gender,
-            "date_of_birth": patient.date_of_birth,
-        }
-
-        # patient_data を先に置き、plan_data で上書きする形で結合
-        # (patient_id などが両方に含まれるため)
-        final_data = {**patient_data, **plan_data}
+        return _plan_to_dict(plan)
+    finally:
+        db.close()
 
-        # 【追加】JSON形式で保存されたいいね情報を辞書に復元して追加
-        if plan.liked_items_json:
-            try:
-                final_data["liked_items"] = json.loads(plan.liked_items_json)
-            except json.JSONDecodeError:
-                final_data["liked_items"] = {}  # パース失敗時は空の辞書
-        else:
-            final_data["liked_items"] = {}  # いいね情報がない場合は空の辞書をセット
 
-        return final_data
+def get_plans_for_export(plan_ids=None, start_date: date = None, end_date: date = None):
+    """
+    【新規】Excelの一括出力用に、複数の計画書データを1回のクエリで取得する。
+    plan_ids を指定した場合はその計画書を、start_date / end_date を指定した場合は作成日がその期間内 (両端を含む) の計画書を返す。
+    """
+    db = SessionLocal()
+    try:
+        query = db.query(RehabilitationPlan).options(joinedload(RehabilitationPlan.patient))
+        if plan_ids is not None:
+            query = query.filter(RehabilitationPlan.plan_id.in_(list(plan_ids)))
+        if start_date is not None:
+            query = query.filter(RehabilitationPlan.created_at >= datetime.combine(start_date, datetime.min.time()))
+        if end_date is not None:
+            query = query.filter(
+                RehabilitationPlan.created_at < datetime.combine(end_date + timedelta(days=1), datetime.min.time())
+            )
+        plans = query.order_by(RehabilitationPlan.created_at, RehabilitationPlan.plan_id).all()
+        return [_plan_to_dict(plan) for plan in plans]
     finally:
         db.close()
 
@@ -1338,3 +1375,14 @@ def get_liked_item_details_by_plan_id(plan_id: int):
         ]
     finally:
         db.close()
+
+
+def get_db_pool_stats() -> dict:
+    """【新規】接続プールの状態 (貸し出し中の数・飽和度・待ち時間・接続の作成/破棄の件数) を返す"""
+    return get_pool_stats(engine)
+
+
+# ローカルでのテスト用にSQLiteを明示的に指定した場合は、テーブルをモデル定義から作成する
+# (MySQLの場合は schema.sql で作成する)
+if engine.dialect.name == "sqlite":
+    Base.metadata.create_all(engine)
@@ -0,0 +1,219 @@
+import os
+import time
+import threading
+from collections import deque
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool, StaticPool
+
+# 接続プールの設定 (環境変数で調整する)
+# 常に保持する接続数
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+# 一時的に pool_size を超えて作成できる接続数 (SSEの生成中などに接続が不足した場合)
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+# 接続が空くのを待つ最大時間 (秒)。超えた場合は TimeoutError になる
+DB_POOL_TIMEOUT_SECONDS = float(os.getenv("DB_POOL_TIMEOUT_SECONDS", "30"))
+# この秒数より古い接続は作り直す (MySQLの wait_timeout による "MySQL server has gone away" を防ぐ)
+DB_POOL_RECYCLE_SECONDS = int(os.getenv("DB_POOL_RECYCLE_SECONDS", "1800"))
+# 貸し出し前に接続が生きているかを確認する (切断済みの接続は自動で作り直す)
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+# MySQLへの接続・読み書きのタイムアウト (秒)
+DB_CONNECT_TIMEOUT_SECONDS = int(os.getenv("DB_CONNECT_TIMEOUT_SECONDS", "10"))
+DB_READ_TIMEOUT_SECONDS = int(os.getenv("DB_READ_TIMEOUT_SECONDS", "60"))
+DB_WRITE_TIMEOUT_SECONDS = int(os.getenv("DB_WRITE_TIMEOUT_SECONDS", "60"))
+# ローカルでのテスト用にSQLiteファイルを使うかどうか (明示的に指定した場合のみ。本番では使わない)
+DB_USE_SQLITE = os.getenv("DB_USE_SQLITE", "false").lower() == "true"
+# DB_USE_SQLITE=true の場合に使うSQLiteファイル
+DB_SQLITE_PATH = os.getenv("DB_SQLITE_PATH", os.path.join("cache", "local_rehab.sqlite3"))
+
+
+def build_database_url() -> str:
+    """
+    接続先のURLを返す。
+    DATABASE_URL が設定されていればそれを、DB_USE_SQLITE=true ならSQLiteファイルを、それ以外は DB_HOST のMySQLを使う。
+    MySQLの接続設定がない場合は、意図しない接続先で起動しないようにエラーにする。
+    """
+    url = os.getenv("DATABASE_URL")
+    if url:
+        return url
+    if DB_USE_SQLITE:
+        print(f"[警告] DB_USE_SQLITE=true のため、ローカルのSQLiteファイル ({DB_SQLITE_PATH}) を使用します。")
+        os.makedirs(os.path.dirname(os.path.abspath(DB_SQLITE_PATH)), exist_ok=True)
+        return f"sqlite:///{DB_SQLITE_PATH}"
+    db_host = os.getenv("DB_HOST")
+    if not db_host:
+        raise RuntimeError(
+            "データベースの接続先が設定されていません。.env に DB_HOST・DB_USER・DB_PASSWORD・DB_NAME を設定してください。"
+            " (ローカルでのテストにSQLiteを使う場合は DB_USE_SQLITE=true または DATABASE_URL=sqlite:///... を指定してください)"
+        )
+    # "mysql+pymysql" の部分で、SQLAlchemyが内部的にPyMySQLを使うことを指定
+    return (
+        f"mysql+pymysql://{os.getenv('DB_USER')}:{os.getenv('DB_PASSWORD')}@{db_host}/{os.getenv('DB_NAME')}?charset=utf8mb4"
+    )
+
+
+class PoolMetrics:
+    """
+    接続プールの利用状況を記録する。
+    - 貸し出し (checkout) の待ち時間: 直近 window 件の平均・p95・最大
+    - 接続の作成・破棄・無効化の件数 (churn)
+    - プールが枯渇して TimeoutError になった件数
+    """
+
+    def __init__(self, window: int = 1000):
+        self._lock = threading.Lock()
+        self._waits = deque(maxlen=window)
+        self.checkouts = 0
+        self.checkins = 0
+        self.connects = 0
+        self.closes = 0
+        self.invalidations = 0
+        self.timeouts = 0
+        self.max_checked_out = 0
+        self.max_wait_seconds = 0.0
+
+    def record_wait(self, seconds: float, checked_out: int):
+        with self._lock:
+            self._waits.append(seconds)
+            self.max_wait_seconds = max(self.max_wait_seconds, seconds)
+            self.max_checked_out = max(self.max_checked_out, checked_out)
+
+    def increment(self, name: str):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            waits = sorted(self._waits)
+            return {
+                "checkouts": self.checkouts,
+                "checkins": self.checkins,
+                "connects": self.connects,
+                "closes": self.closes,
+                "invalidations": self.invalidations,
+                "timeouts": self.timeouts,
+                "max_checked_out": self.max_checked_out,
+                "checkout_wait_ms": {
+                    "avg": sum(waits) / len(waits) * 1000 if waits else 0.0,
+                    "p95": waits[min(len(waits) - 1, int(len(waits) * 0.95))] * 1000 if waits else 0.0,
+                    "max": self.max_wait_seconds * 1000,
+                },
+            }
+
+
+class InstrumentedQueuePool(QueuePool):
+    """接続が空くまでの待ち時間と、プールの枯渇 (TimeoutError) を記録する QueuePool"""
+
+    metrics: PoolMetrics = None
+
+    def _do_get(self):
+        start_time = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            if self.metrics is not None:
+                self.metrics.increment("timeouts")
+            raise
+        if self.metrics is not None:
+            self.metrics.record_wait(time.perf_counter() - start_time, self.checkedout())
+        return connection
+
+    def recreate(self):
+        # dispose() 時などに作り直されたプールでも、同じ記録を使い続ける
+        pool = super().recreate()
+        pool.metrics = self.metrics
+        return pool
+
+
+def _attach_metrics(engine, metrics: PoolMetrics):
+    @event.listens_for(engine, "connect")
+    def _on_connect(dbapi_connection, connection_record):
+        metrics.increment("connects")
+
+    @event.listens_for(engine, "close")
+    def _on_close(dbapi_connection, connection_record):
+        metrics.increment("closes")
+
+    @event.listens_for(engine, "invalidate")
+    def _on_invalidate(dbapi_connection, connection_record, exception):
+        metrics.increment("invalidations")
+
+    @event.listens_for(engine, "checkout")
+    def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+        metrics.increment("checkouts")
+
+    @event.listens_for(engine, "checkin")
+    def _on_checkin(dbapi_connection, connection_record):
+        metrics.increment("checkins")
+
+
+def create_db_engine(
+    url: str,
+    pool_size: int = DB_POOL_SIZE,
+    max_overflow: int = DB_MAX_OVERFLOW,
+    pool_timeout: float = DB_POOL_TIMEOUT_SECONDS,
+    pool_recycle: int = DB_POOL_RECYCLE_SECONDS,
+    pool_pre_ping: bool = DB_POOL_PRE_PING,
+    echo: bool = False,
+):
+    """
+    接続プールの設定と計測を組み込んだエンジンを作成する。
+    計測結果は get_pool_stats(engine) で取得できる。
+    """
+    metrics = PoolMetrics()
+    if url.startswith("sqlite"):
+        # SQLiteはスレッドをまたいで接続を使うため check_same_thread を無効にする
+        connect_args = {"check_same_thread": False}
+        if url in ("sqlite://", "sqlite:///:memory:"):
+            # メモリ上のDBは接続ごとに別のDBになるため、1つの接続を共有する
+            engine = create_engine(url, echo=echo, connect_args=connect_args, poolclass=StaticPool)
+            _attach_metrics(engine, metrics)
+            engine.pool_metrics = metrics
+            return engine
+    else:
+        connect_args = {
+            "connect_timeout": DB_CONNECT_TIMEOUT_SECONDS,
+            "read_timeout": DB_READ_TIMEOUT_SECONDS,
+            "write_timeout": DB_WRITE_TIMEOUT_SECONDS,
+        }
+
+    engine = create_engine(
+        url,
+        echo=echo,
+        poolclass=InstrumentedQueuePool,
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+        pool_timeout=pool_timeout,
+        pool_recycle=pool_recycle,
+        pool_pre_ping=pool_pre_ping,
+        connect_args=connect_args,
+    )
+    engine.pool.metrics = metrics
+    _attach_metrics(engine, metrics)
+    engine.pool_metrics = metrics
+    return engine
+
+
+def get_pool_stats(engine) -> dict:
+    """接続プールの現在の状態 (貸し出し中の数・飽和度など) と、これまでの計測結果を返す"""
+    pool = engine.pool
+    stats = {"dialect": engine.dialect.name, "pool_class": type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        capacity = pool.size() + max(0, pool._max_overflow)
+        checked_out = pool.checkedout()
+        stats.update(
+            {
+                "pool_size": pool.size(),
+                "max_overflow": pool._max_overflow,
+                "checked_out": checked_out,
+                "checked_in": pool.checkedin(),
+                "overflow": pool.overflow(),
+                # 1.0 に近いほど枯渇しかけている (貸し出し中 / 作成できる接続の上限)
+                "saturation": checked_out / capacity if capacity > 0 else 0.0,
+            }
+        )
+    metrics = getattr(engine, "pool_metrics", None)
+    if metrics is not None:
+        stats.update(metrics.snapshot())
+    return stats
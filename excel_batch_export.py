@@ -0,0 +1,409 @@
+"""
+複数の計画書をExcelに出力し、1つのZIPファイルにまとめる (月末の一括出力など)。
+
+openpyxl での書き込みはCPU処理が中心でGILの影響を受けるため、ProcessPoolExecutor で複数のプロセスに分けて作成する。
+各ワーカープロセスはテンプレートを1回だけ読み込み、以降はキャッシュした複製を使う (excel_template_cache)。
+
+Webアプリ (app.py) からは、このファイルのコマンドを別プロセスとして起動する (BatchExportManager)。
+Webのプロセスを fork すると、ロックやDBの接続などが子プロセスに引き継がれてしまうため、プロセスプールは作らない。
+進捗は --progress-file に書き出し、Webアプリはそれを読んで返す。
+
+コマンドラインからの実行例:
+    python excel_batch_export.py --from 2026-09-01 --to 2026-09-30 --output plans_202609.zip
+    python excel_batch_export.py --plan-ids 12,13,20 --workers 4 --output plans.zip
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import uuid
+import shutil
+import zipfile
+import argparse
+import threading
+import subprocess
+from datetime import date
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import excel_writer
+
+# 一括出力で使うワーカープロセスの数
+EXCEL_BATCH_EXPORT_WORKERS = int(os.getenv("EXCEL_BATCH_EXPORT_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+# Webアプリから出力したZIPファイルと進捗の保存先
+EXCEL_BATCH_EXPORT_DIR = os.getenv("EXCEL_BATCH_EXPORT_DIR", os.path.join("cache", "batch_exports"))
+# Webアプリから同時に実行できる一括出力の数
+EXCEL_BATCH_EXPORT_MAX_RUNNING = int(os.getenv("EXCEL_BATCH_EXPORT_MAX_RUNNING", "1"))
+# 出力したZIPファイルを保持する時間 (秒)。これを過ぎたものは次の出力の開始時に削除する
+EXCEL_BATCH_EXPORT_RETENTION_SECONDS = int(os.getenv("EXCEL_BATCH_EXPORT_RETENTION_SECONDS", str(24 * 60 * 60)))
+
+# 一括出力の状態
+EXPORT_RUNNING = "running"
+EXPORT_SUCCEEDED = "succeeded"
+EXPORT_FAILED = "failed"
+
+
+def render_plan(plan_data: dict):
+    """ワーカープロセスで1件の計画書を作成し、(plan_id, ファイル名, バイト列) を返す"""
+    filename, data = excel_writer.create_plan_sheet_bytes(plan_data)
+    return plan_data.get("plan_id"), filename, data
+
+
+def _init_worker():
+    # ワーカープロセスでは、1件ごとのセル書き込みログが大量に出力されないようにする
+    sys.stdout = open(os.devnull, "w", encoding="utf-8")
+
+
+def iter_plan_results(plans: list[dict], max_workers: int = EXCEL_BATCH_EXPORT_WORKERS, mp_context=None):
+    """
+    計画書を作成し、完了したものから (plan_id, ファイル名, バイト列, エラー) を yield する。
+    max_workers が1以下、または計画書が1件の場合は、プロセスを使わずに順番に作成する。
+    """
+    if max_workers <= 1 or len(plans) <= 1:
+        for plan_data in plans:
+            try:
+                yield (*render_plan(plan_data), None)
+            except Exception as e:
+                yield plan_data.get("plan_id"), None, None, e
+        return
+
+    with ProcessPoolExecutor(max_workers=min(max_workers, len(plans)), mp_context=mp_context, initializer=_init_worker) as executor:
+        futures = {executor.submit(render_plan, plan_data): plan_data.get("plan_id") for plan_data in plans}
+        for future in as_completed(futures):
+            try:
+                yield (*future.result(), None)
+            except Exception as e:
+                yield futures[future], None, None, e
+
+
+class _ChunkWriter:
+    """
+    ZipFile の書き込み先。書き込まれたデータを溜めておき、take() で取り出す。
+    tell()/seek() を持たないため、ZipFile はストリーミング用の形式 (データ記述子付き) で書き込む。
+    """
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def stream_plans_zip(plans: list[dict], max_workers: int = EXCEL_BATCH_EXPORT_WORKERS, mp_context=None, progress=None):
+    """
+    計画書を作成しながら、ZIPファイルのバイト列を少しずつ yield する (HTTPレスポンスへそのまま流せる)。
+
+    Args:
+        plans (list[dict]): database.get_plans_for_export() で取得した計画書データ。
+        max_workers (int): ワーカープロセスの数。
+        mp_context: ProcessPoolExecutor に渡すプロセスの開始方法。
+        progress: 1件完了するごとに (完了数, 全件数, plan_id, エラー) で呼び出される関数。
+    """
+    writer = _ChunkWriter()
+    errors = []
+    with zipfile.ZipFile(writer, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        for done, (plan_id, filename, data, error) in enumerate(iter_plan_results(plans, max_workers, mp_context), start=1):
+            if error is None:
+                # 同じ患者・同じ時刻のファイル名が重複しないよう、plan_id を先頭に付ける
+                zf.writestr(f"{plan_id}_{filename}", data)
+            else:
+                errors.append(f"plan_id={plan_id}: {error}")
+            if progress is not None:
+                progress(done, len(plans), plan_id, error)
+            chunk = writer.take()
+            if chunk:
+                yield chunk
+        if errors:
+            zf.writestr("errors.txt", "\n".join(errors) + "\n")
+    yield writer.take()
+
+
+def export_plans_zip(plans: list[dict], output_path: str, max_workers: int = EXCEL_BATCH_EXPORT_WORKERS, mp_context=None, progress=None) -> str:
+    """計画書をZIPファイルに出力し、そのパスを返す"""
+    with open(output_path, "wb") as f:
+        for chunk in stream_plans_zip(plans, max_workers, mp_context, progress):
+            f.write(chunk)
+    return output_path
+
+
+def print_progress(done: int, total: int, plan_id, error):
+    status = "完了" if error is None else f"失敗 ({error})"
+    print(f"[{done}/{total}] plan_id={plan_id} {status}", flush=True)
+
+
+def _write_json(path: str, data: dict):
+    # 読み込み側が書きかけのファイルを読まないよう、一時ファイルから置き換える
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def _read_json(path: str) -> dict:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_progress(path: str, **progress):
+    """進捗をJSONファイルに書き出す"""
+    _write_json(path, {**progress, "updated_at": time.time()})
+
+
+def read_progress(path: str) -> dict:
+    """write_progress() で書き出した進捗を読み込む。まだ書き出されていない場合は空の辞書を返す"""
+    return _read_json(path)
+
+
+def _is_pid_alive(pid) -> bool:
+    """別のWebプロセスが起動した一括出力のプロセスが、まだ実行中かどうかを返す"""
+    if not pid:
+        return False
+    if os.name != "posix":
+        # Windowsでは os.kill(pid, 0) がプロセスを終了させてしまうため、実行中とみなす
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    except OSError:
+        return False
+    return True
+
+
+class ProgressFileReporter:
+    """stream_plans_zip() の progress に渡し、1件完了するごとに進捗をファイルに書き出す"""
+
+    def __init__(self, path: str, total: int):
+        self.path = path
+        self.total = total
+        self.failed = 0
+        write_progress(path, status=EXPORT_RUNNING, done=0, total=total, failed=0)
+
+    def __call__(self, done: int, total: int, plan_id, error):
+        print_progress(done, total, plan_id, error)
+        if error is not None:
+            self.failed += 1
+        write_progress(self.path, status=EXPORT_RUNNING, done=done, total=total, failed=self.failed)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="計画書をExcelに一括出力し、ZIPファイルにまとめる")
+    parser.add_argument("--plan-ids", help="出力する計画書のID (カンマ区切り)")
+    parser.add_argument("--from", dest="start_date", type=date.fromisoformat, help="作成日の開始 (YYYY-MM-DD)")
+    parser.add_argument("--to", dest="end_date", type=date.fromisoformat, help="作成日の終了 (YYYY-MM-DD、この日を含む)")
+    parser.add_argument("--workers", type=int, default=EXCEL_BATCH_EXPORT_WORKERS, help="ワーカープロセスの数")
+    parser.add_argument("--output", default="rehab_plans.zip", help="出力するZIPファイルのパス")
+    parser.add_argument("--progress-file", help="進捗を書き出すJSONファイルのパス (Webアプリから起動する場合に使用)")
+    args = parser.parse_args(argv)
+
+    if not args.plan_ids and not args.start_date and not args.end_date:
+        parser.error("--plan-ids または --from / --to を指定してください。")
+
+    try:
+        import database
+
+        plan_ids = [int(x) for x in args.plan_ids.split(",") if x.strip()] if args.plan_ids else None
+        plans = database.get_plans_for_export(plan_ids=plan_ids, start_date=args.start_date, end_date=args.end_date)
+        if not plans:
+            print("対象の計画書が見つかりませんでした。")
+            if args.progress_file:
+                write_progress(args.progress_file, status=EXPORT_FAILED, done=0, total=0, failed=0, error="対象の計画書が見つかりませんでした。")
+            return 1
+
+        # ワーカープロセスにDBの接続が引き継がれないよう、取得後に接続プールを閉じておく
+        database.engine.dispose()
+
+        print(f"{len(plans)}件の計画書を {args.workers} プロセスで出力します...")
+        start_time = time.perf_counter()
+        progress = ProgressFileReporter(args.progress_file, len(plans)) if args.progress_file else print_progress
+        export_plans_zip(plans, args.output, max_workers=args.workers, progress=progress)
+        print(f"{args.output} に出力しました ({time.perf_counter() - start_time:.1f}秒)。")
+    except Exception as e:
+        if args.progress_file:
+            previous = read_progress(args.progress_file)
+            write_progress(args.progress_file, **{**previous, "status": EXPORT_FAILED, "error": str(e)})
+        raise
+
+    if args.progress_file:
+        write_progress(args.progress_file, status=EXPORT_SUCCEEDED, done=len(plans), total=len(plans), failed=progress.failed)
+    return 0
+
+
+class BatchExportManager:
+    """
+    Webアプリからの一括出力を、このファイルのコマンドを別プロセスとして起動して実行する。
+
+    - Webのプロセスを fork しないため、ロックやDBの接続が引き継がれることはない。
+      子プロセスは app.py を読み込まないため、RAGパイプラインの事前読み込みなども実行されない。
+    - 出力ごとのディレクトリに、開始時の情報 (export.json: 開始したユーザー・時刻・pid)、
+      子プロセスが書き出す進捗 (progress.json) と ZIPファイルを置く。
+      status() などはメモリ上の情報ではなくこれらのファイルを読むため、
+      Webアプリを複数のプロセスで動かしていても、どのプロセスからでも状態の確認・ダウンロードができる。
+    - 同時に実行できる数は max_running まで。保持期間を過ぎた出力は、次の出力の開始時に削除する。
+    """
+
+    def __init__(
+        self,
+        output_dir: str = EXCEL_BATCH_EXPORT_DIR,
+        max_workers: int = EXCEL_BATCH_EXPORT_WORKERS,
+        max_running: int = EXCEL_BATCH_EXPORT_MAX_RUNNING,
+        retention_seconds: float = EXCEL_BATCH_EXPORT_RETENTION_SECONDS,
+    ):
+        # 子プロセスに渡すパスは、作業ディレクトリに依存しないよう絶対パスにする
+        self.output_dir = os.path.abspath(output_dir)
+        self.max_workers = max_workers
+        self.max_running = max(1, max_running)
+        self.retention_seconds = retention_seconds
+        # このプロセスが起動した子プロセス (終了後に回収し、終了コードを確認するために保持する)
+        self._processes: dict[str, subprocess.Popen] = {}
+        # start() で上限の確認から起動までをまとめて行うため、同じスレッドから再度取得できるロックにする
+        self._lock = threading.RLock()
+        self.started = 0
+
+    def _export_dir(self, export_id: str) -> str:
+        return os.path.join(self.output_dir, export_id)
+
+    def _export_ids(self) -> list[str]:
+        try:
+            return [name for name in os.listdir(self.output_dir) if re.fullmatch(r"[0-9a-f]{32}", name)]
+        except FileNotFoundError:
+            return []
+
+    def _is_running(self, export_id: str, meta: dict) -> bool:
+        with self._lock:
+            process = self._processes.get(export_id)
+        if process is not None:
+            return process.poll() is None
+        return _is_pid_alive(meta.get("pid"))
+
+    def start(self, owner_id, plan_ids=None, start_date: date = None, end_date: date = None) -> str:
+        """
+        一括出力を開始し、その出力IDを返す。
+        実行中の出力が max_running 件ある場合は RuntimeError を送出する。
+        """
+        self.delete_expired()
+        export_id = uuid.uuid4().hex
+        export_dir = self._export_dir(export_id)
+        command = [
+            sys.executable,
+            os.path.abspath(__file__),
+            "--workers", str(self.max_workers),
+            "--output", os.path.join(export_dir, "plans.zip"),
+            "--progress-file", os.path.join(export_dir, "progress.json"),
+        ]
+        if plan_ids:
+            command += ["--plan-ids", ",".join(str(plan_id) for plan_id in plan_ids)]
+        if start_date is not None:
+            command += ["--from", start_date.isoformat()]
+        if end_date is not None:
+            command += ["--to", end_date.isoformat()]
+
+        with self._lock:
+            # 他のWebプロセスが開始したものも含めて数える
+            # (複数のプロセスから同時に開始した場合は、上限をわずかに超えることがある)
+            running = self.stats()["running"]
+            if running >= self.max_running:
+                raise RuntimeError(f"実行中の一括出力が{running}件あります。完了してから再度実行してください。")
+            os.makedirs(export_dir, exist_ok=True)
+            with open(os.path.join(export_dir, "export.log"), "wb") as log_file:
+                # 作業ディレクトリは呼び出し元 (.env や cache/ の位置) のままにする
+                process = subprocess.Popen(command, stdout=log_file, stderr=subprocess.STDOUT, env={**os.environ, "PYTHONUNBUFFERED": "1"})
+            _write_json(
+                os.path.join(export_dir, "export.json"),
+                {"owner_id": owner_id, "created_at": time.time(), "pid": process.pid},
+            )
+            self._processes[export_id] = process
+            self.started += 1
+        print(f"計画書の一括出力 {export_id} を開始しました (pid={process.pid})")
+        return export_id
+
+    def status(self, export_id: str) -> dict | None:
+        """一括出力の状態と進捗を返す。存在しない場合は None を返す"""
+        if not re.fullmatch(r"[0-9a-f]{32}", export_id):
+            return None
+        export_dir = self._export_dir(export_id)
+        meta = _read_json(os.path.join(export_dir, "export.json"))
+        if not meta:
+            return None
+        progress = read_progress(os.path.join(export_dir, "progress.json"))
+        # 子プロセスは終了時に succeeded / failed を書き出す。
+        # 書き出さないまま終了した場合 (強制終了など) は、失敗として扱う
+        if progress.get("status") in (EXPORT_SUCCEEDED, EXPORT_FAILED):
+            status = progress["status"]
+        elif self._is_running(export_id, meta):
+            status = EXPORT_RUNNING
+        else:
+            status = EXPORT_FAILED
+        result = {
+            "export_id": export_id,
+            "owner_id": meta.get("owner_id"),
+            "status": status,
+            "done": progress.get("done", 0),
+            "total": progress.get("total"),
+            "failed": progress.get("failed", 0),
+            "created_at": meta.get("created_at"),
+        }
+        if status == EXPORT_FAILED:
+            result["error"] = progress.get("error") or "一括出力のプロセスが完了前に終了しました。"
+        return result
+
+    def output_path(self, export_id: str) -> str | None:
+        """完了した一括出力のZIPファイルのパスを返す。完了していない場合は None を返す"""
+        status = self.status(export_id)
+        if status is None or status["status"] != EXPORT_SUCCEEDED:
+            return None
+        return os.path.join(self._export_dir(export_id), "plans.zip")
+
+    def delete_expired(self) -> int:
+        """保持期間を過ぎた、終了済みの一括出力のファイルを削除する (他のWebプロセスが開始したものも含む)"""
+        threshold = time.time() - self.retention_seconds
+        expired = []
+        for export_id in self._export_ids():
+            status = self.status(export_id)
+            if status is None:
+                # 開始の途中で止まったなど、開始時の情報がないものはディレクトリの更新時刻で判断する
+                try:
+                    created_at = os.path.getmtime(self._export_dir(export_id))
+                except OSError:
+                    continue
+            elif status["status"] == EXPORT_RUNNING:
+                continue
+            else:
+                created_at = status["created_at"] or 0
+            if created_at < threshold:
+                expired.append(export_id)
+        with self._lock:
+            for export_id in expired:
+                self._processes.pop(export_id, None)
+        for export_id in expired:
+            shutil.rmtree(self._export_dir(export_id), ignore_errors=True)
+        return len(expired)
+
+    def stats(self) -> dict:
+        statuses = [self.status(export_id) for export_id in self._export_ids()]
+        statuses = [status for status in statuses if status is not None]
+        return {
+            "started": self.started,
+            "running": sum(1 for status in statuses if status["status"] == EXPORT_RUNNING),
+            "kept": len(statuses),
+            "max_running": self.max_running,
+        }
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,133 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+
+# Excel出力の方式。"stream" はメモリ上で作成してそのまま返し、"file" は従来通り OUTPUT_DIR に保存してから返す
+EXCEL_EXPORT_MODE = os.getenv("EXCEL_EXPORT_MODE", "stream").lower()
+# 作成した計画書を、plan_id ごとにメモリへ保持する時間 (秒)。0以下の場合は保持しない
+EXCEL_EXPORT_CACHE_TTL_SECONDS = int(os.getenv("EXCEL_EXPORT_CACHE_TTL_SECONDS", "600"))
+# 保持する計画書の合計サイズの上限 (MB)。超過した場合は最も長く使われていないものから削除する
+EXCEL_EXPORT_CACHE_MAX_MB = int(os.getenv("EXCEL_EXPORT_CACHE_MAX_MB", "32"))
+# OUTPUT_DIR に残っているファイルを削除するまでの時間 (秒)。0以下の場合は削除しない
+EXCEL_OUTPUT_RETENTION_SECONDS = int(os.getenv("EXCEL_OUTPUT_RETENTION_SECONDS", str(24 * 60 * 60)))
+# OUTPUT_DIR を確認する間隔 (秒)
+EXCEL_OUTPUT_JANITOR_INTERVAL_SECONDS = int(os.getenv("EXCEL_OUTPUT_JANITOR_INTERVAL_SECONDS", "3600"))
+
+
+class ExcelExportCache:
+    """
+    作成した計画書 (xlsxのバイト列) を plan_id ごとに短時間だけ保持するキャッシュ。
+    保存直後のダウンロードや、同じ計画書の再ダウンロードで、ワークブックを作り直さずに済むようにする。
+    有効期限 (ttl_seconds) と合計サイズの上限 (max_bytes) を超えたものは削除する。
+    """
+
+    def __init__(self, ttl_seconds: float = EXCEL_EXPORT_CACHE_TTL_SECONDS, max_bytes: int = EXCEL_EXPORT_CACHE_MAX_MB * 1024 * 1024):
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict = OrderedDict()  # plan_id -> (ファイル名, バイト列, 作成時刻)
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl_seconds > 0 and self.max_bytes > 0
+
+    def get(self, plan_id):
+        """保持している場合は (ファイル名, バイト列) を返し、ない場合は None を返す"""
+        with self._lock:
+            entry = self._entries.get(plan_id)
+            if entry is not None and time.monotonic() - entry[2] > self.ttl_seconds:
+                self._remove(plan_id)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(plan_id)
+            self.hits += 1
+            return entry[0], entry[1]
+
+    def put(self, plan_id, filename: str, data: bytes):
+        # 上限を超える大きさのものは保持しない
+        if not self.enabled or len(data) > self.max_bytes:
+            return
+        with self._lock:
+            if plan_id in self._entries:
+                self._remove(plan_id)
+            self._entries[plan_id] = (filename, data, time.monotonic())
+            self._total_bytes += len(data)
+            while self._total_bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, plan_id):
+        """ロック取得済みの状態で呼び出す"""
+        _, data, _ = self._entries.pop(plan_id)
+        self._total_bytes -= len(data)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "total_bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+class OutputDirJanitor:
+    """
+    OUTPUT_DIR に保存された計画書のうち、retention_seconds を過ぎたものを定期的に削除する。
+    ("file" モードや、以前のバージョンで保存されたファイルが溜まり続けないようにする)
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        retention_seconds: float = EXCEL_OUTPUT_RETENTION_SECONDS,
+        interval_seconds: float = EXCEL_OUTPUT_JANITOR_INTERVAL_SECONDS,
+    ):
+        self.directory = directory
+        self.retention_seconds = retention_seconds
+        self.interval_seconds = interval_seconds
+        self._thread = None
+        self.deleted = 0
+
+    def sweep(self) -> int:
+        """期限を過ぎた .xlsx ファイルを削除し、その数を返す"""
+        if self.retention_seconds <= 0 or not os.path.isdir(self.directory):
+            return 0
+        threshold = time.time() - self.retention_seconds
+        deleted = 0
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if not name.endswith(".xlsx") or not os.path.isfile(path):
+                continue
+            try:
+                if os.path.getmtime(path) < threshold:
+                    os.remove(path)
+                    deleted += 1
+            except OSError as e:
+                print(f"   [警告] 古い計画書ファイル '{path}' の削除に失敗しました: {e}")
+        if deleted:
+            self.deleted += deleted
+            print(f"{self.directory} から古い計画書ファイルを {deleted} 件削除しました。")
+        return deleted
+
+    def start(self):
+        """バックグラウンドで定期的に sweep() を実行する"""
+        if self.retention_seconds <= 0 or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._loop, name="excel-output-janitor", daemon=True)
+        self._thread.start()
+
+    def _loop(self):
+        while True:
+            self.sweep()
+            time.sleep(max(1, self.interval_seconds))
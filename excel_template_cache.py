@@ -0,0 +1,162 @@
+import os
+import time
+import pickle
+import threading
+import weakref
+
+from openpyxl import load_workbook
+from openpyxl.utils import get_column_letter
+
+# false にすると、従来通り保存のたびにテンプレートを読み込む
+EXCEL_TEMPLATE_CACHE_ENABLED = os.getenv("EXCEL_TEMPLATE_CACHE_ENABLED", "true").lower() == "true"
+
+
+class TemplateCellIndex:
+    """
+    テンプレートのセル参照を高速に解決するための索引。テンプレートごとに1回だけ作成する。
+
+    - merged_anchors: (シート名, 座標) -> 結合範囲の左上セルの座標。結合範囲内の全てのセルを登録する。
+    - defined_names: 名前付き範囲の名前 -> (シート名, 左上セルの座標)。
+
+    セルオブジェクトではなく座標を保持するため、同じテンプレートから作った複製のワークブックでも共有できる。
+    """
+
+    def __init__(self, merged_anchors: dict, defined_names: dict):
+        self.merged_anchors = merged_anchors
+        self.defined_names = defined_names
+
+    @classmethod
+    def build(cls, wb) -> "TemplateCellIndex":
+        merged_anchors = {}
+        for ws in wb.worksheets:
+            for merged_range in ws.merged_cells.ranges:
+                anchor = merged_range.start_cell.coordinate
+                for row in range(merged_range.min_row, merged_range.max_row + 1):
+                    for col in range(merged_range.min_col, merged_range.max_col + 1):
+                        merged_anchors[(ws.title, f"{get_column_letter(col)}{row}")] = anchor
+
+        defined_names = {}
+        for name, defined_name in wb.defined_names.items():
+            try:
+                # destinations は (sheetname, address) のタプルのジェネレータ
+                dests = list(defined_name.destinations)
+            except Exception:
+                # 外部参照や数式など、セルを指さない名前は登録しない
+                continue
+            if dests:
+                sheetname, address = dests[0]
+                # '$' を取り除き、範囲指定の場合 (例: A1:A5) は左上のセルにする
+                defined_names[name] = (sheetname, address.replace("$", "").split(":")[0])
+        return cls(merged_anchors, defined_names)
+
+
+# ワークブック -> 索引 (ワークブックが破棄されると自動で取り除かれる)
+_cell_indexes = weakref.WeakKeyDictionary()
+_cell_indexes_lock = threading.Lock()
+
+
+def get_cell_index(wb) -> TemplateCellIndex:
+    """
+    ワークブックの索引を返す。
+    キャッシュから取得したワークブックはテンプレートの索引を共有し、それ以外は初回に作成する。
+    """
+    with _cell_indexes_lock:
+        index = _cell_indexes.get(wb)
+        if index is None:
+            index = _cell_indexes[wb] = TemplateCellIndex.build(wb)
+        return index
+
+
+class ExcelTemplateCache:
+    """
+    Excelテンプレート (template.xlsx) を1回だけ読み込み、リクエストごとに複製を渡すキャッシュ。
+
+    load_workbook() はスタイル・結合セル・名前付き範囲を含めてXMLを解析するため、1回あたり1秒近くかかる。
+    読み込んだワークブックを pickle で直列化したスナップショットとして保持し、
+    リクエストごとに pickle.loads() で復元することで、元のテンプレートを変更せずに高速に複製を作る。
+    テンプレートファイルの更新時刻・サイズが変わった場合は、次の取得時に読み込み直す。
+    結合セル・名前付き範囲の索引 (TemplateCellIndex) も読み込み時に作成し、複製の間で共有する。
+    """
+
+    def __init__(self, template_path: str):
+        self.template_path = template_path
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._index = None
+        self._signature = None
+        self.loads = 0
+        self.hits = 0
+        self.last_load_seconds = None
+
+    def _file_signature(self):
+        stat = os.stat(self.template_path)
+        return stat.st_mtime_ns, stat.st_size
+
+    def _load(self, signature):
+        """ロック取得済みの状態で呼び出す。テンプレートを読み込み、スナップショットを作り直す"""
+        start_time = time.perf_counter()
+        wb = load_workbook(self.template_path)
+        self._snapshot = pickle.dumps(wb, protocol=pickle.HIGHEST_PROTOCOL)
+        self._index = TemplateCellIndex.build(wb)
+        self._signature = signature
+        self.loads += 1
+        self.last_load_seconds = time.perf_counter() - start_time
+        print(f"Excelテンプレート '{self.template_path}' を読み込みました ({self.last_load_seconds:.2f}秒)。")
+
+    def get_workbook(self):
+        """
+        テンプレートの複製 (書き込み用のワークブック) を返す。
+        テンプレートが存在しない場合は FileNotFoundError を送出する。
+        """
+        # ファイルが存在しない場合は os.stat が FileNotFoundError を送出する
+        signature = self._file_signature()
+        with self._lock:
+            if self._snapshot is None or self._signature != signature:
+                self._load(signature)
+            else:
+                self.hits += 1
+            snapshot, index = self._snapshot, self._index
+        # 復元は各リクエストのワークブックを作るだけなので、ロックの外で行う
+        wb = pickle.loads(snapshot)
+        with _cell_indexes_lock:
+            _cell_indexes[wb] = index
+        return wb
+
+    def clear(self):
+        with self._lock:
+            self._snapshot = None
+            self._index = None
+            self._signature = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "template_path": self.template_path,
+                "loaded": self._snapshot is not None,
+                "snapshot_bytes": len(self._snapshot) if self._snapshot is not None else 0,
+                "merged_cells_indexed": len(self._index.merged_anchors) if self._index is not None else 0,
+                "defined_names_indexed": len(self._index.defined_names) if self._index is not None else 0,
+                "loads": self.loads,
+                "hits": self.hits,
+                "last_load_seconds": self.last_load_seconds,
+            }
+
+
+_template_caches: dict[str, ExcelTemplateCache] = {}
+_template_caches_lock = threading.Lock()
+
+
+def get_template_cache(template_path: str) -> ExcelTemplateCache:
+    """テンプレートのパスごとに共有するキャッシュを返す"""
+    with _template_caches_lock:
+        cache = _template_caches.get(template_path)
+        if cache is None:
+            cache = _template_caches[template_path] = ExcelTemplateCache(template_path)
+        return cache
+
+
+def load_template_workbook(template_path: str):
+    """テンプレートを書き込み用に読み込む。キャッシュが無効の場合は毎回 load_workbook() する"""
+    if not EXCEL_TEMPLATE_CACHE_ENABLED:
+        return load_workbook(template_path)
+    return get_template_cache(template_path).get_workbook()
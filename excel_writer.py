@@ -1,9 +1,9 @@
 import os
+import io
 from datetime import datetime, date
-from openpyxl import load_workbook
 from openpyxl.styles import Font
-from openpyxl.cell import MergedCell
 from openpyxl.styles import Alignment
+from excel_template_cache import get_cell_index, load_template_workbook
 
 # 定数設定
 TEMPLATE_PATH = "template.xlsx"
@@ -446,12 +446,11 @@ def _get_cell_by_address(wb, sheet_name, cell_address):
     """シート名とセル座標からセルオブジェクトを取得する（結合セル対応）"""
     try:
         ws = wb[sheet_name]
-        cell = ws[cell_address]
-        if isinstance(cell, MergedCell):
-            for merged_range in ws.merged_cell_ranges:
-                if cell.coordinate in merged_range:
-                    return merged_range.min_cell
-        return cell
+        # 結合範囲内のセルは、索引から左上のセルを引く (結合範囲を毎回走査しない)
+        anchor = get_cell_index(wb).merged_anchors.get((sheet_name, cell_address.replace("$", "").upper()))
+        if anchor is not None:
+            return ws[anchor]
+        return ws[cell_address]
     except Exception as e:
         print(
             f"   [エラー] シート '{sheet_name}' またはセル '{cell_address}' の取得に失敗: {e}"
@@ -462,18 +461,9 @@ def _get_cell_by_address(wb, sheet_name, cell_address):
 def get_cell_by_name(wb, name):
     """名前付き範囲からセルオブジェクトを取得する"""
     try:
-        defined_name = wb.defined_names[name]
-        # destinations は (sheetname, address) のタプルのジェネレータ
-        dests = list(defined_name.destinations)
-        if dests:
-            sheetname, address = dests[0]
-            # アドレスから '$' を取り除く
-            cleaned_address = address.replace("$", "")
-            # 範囲指定の場合 (例: A1:A5)、左上のセルを返す
-            if ":" in cleaned_address:
-                cleaned_address = cleaned_address.split(":")[0]
-            return wb[sheetname][cleaned_address]
-        return None
+        # 名前 -> (シート名, 左上セルの座標) の索引を使う
+        sheetname, address = get_cell_index(wb).defined_names[name]
+        return wb[sheetname][address]
     except KeyError:
         print(f"   [警告] 名前付き範囲 '{name}' がExcelファイル内に見つかりません。")
         return None
@@ -509,13 +499,11 @@ def write_date_to_sheet(wb, date_value, base_key):
         print(f"   [エラー] 日付 '{base_key}' の書き込み中にエラー: {e}")
 
 
-def create_plan_sheet(plan_data):
-    """【最終版・座標指定方式】Excelに計画書を書き込む"""
-    if not os.path.exists(OUTPUT_DIR):
-        os.makedirs(OUTPUT_DIR)
-
+def render_plan_workbook(plan_data):
+    """【最終版・座標指定方式】テンプレートの複製に計画書の内容を書き込み、ワークブックを返す"""
+    # テンプレートは1回だけ解析し、キャッシュした複製に書き込む (テンプレートが更新された場合は読み込み直す)
     try:
-        wb = load_workbook(TEMPLATE_PATH)
+        wb = load_template_workbook(TEMPLATE_PATH)
     except FileNotFoundError:
         raise
 
@@ -727,15 +715,42 @@ def create_plan_sheet(plan_data):
     except Exception as e:
         print(f"   [エラー] 復職の特殊処理中にエラー: {e}")
 
-    # 3. ファイルの保存
+    return wb
+
+
+def make_output_filename(plan_data):
+    """計画書のファイル名 (RehabPlan_患者名_日時.xlsx) を作成する"""
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     safe_patient_name = "".join(
         c for c in plan_data.get("name", "NoName") if c.isalnum()
     )
-    output_filename = f"RehabPlan_{safe_patient_name}_{timestamp}.xlsx"
-    output_filepath = os.path.join(OUTPUT_DIR, output_filename)
+    return f"RehabPlan_{safe_patient_name}_{timestamp}.xlsx"
+
+
+def create_plan_sheet(plan_data):
+    """Excelに計画書を書き込み、OUTPUT_DIR に保存したファイルのパスを返す"""
+    if not os.path.exists(OUTPUT_DIR):
+        os.makedirs(OUTPUT_DIR)
+
+    wb = render_plan_workbook(plan_data)
+
+    # 3. ファイルの保存
+    output_filepath = os.path.join(OUTPUT_DIR, make_output_filename(plan_data))
 
     wb.save(output_filepath)
     print(f"\n計画書を {output_filepath} に保存しました。")
 
     return output_filepath
+
+
+def create_plan_sheet_bytes(plan_data):
+    """
+    Excelに計画書を書き込み、ファイルに保存せずに (ファイル名, xlsxのバイト列) を返す。
+    HTTPレスポンスとして直接返す場合に使い、OUTPUT_DIR にファイルを残さない。
+    """
+    wb = render_plan_workbook(plan_data)
+    buffer = io.BytesIO()
+    wb.save(buffer)
+    output_filename = make_output_filename(plan_data)
+    print(f"\n計画書 {output_filename} をメモリ上に作成しました ({buffer.tell()} bytes)。")
+    return output_filename, buffer.getvalue()
@@ -1,4 +1,5 @@
 import os
+import re
 import json
 import time
 import textwrap
@@ -21,6 +22,15 @@ from schemas import (
     CurrentAssessment,
     ComprehensiveTreatmentPlan,
     GENERATION_GROUPS,
+    GENERATION_GROUP_DEPENDENCIES,
+)
+from prompt_assembly import (
+    dumps_compact,
+    estimate_prompt_tokens,
+    get_schema_json,
+    prompt_token_stats,
+    prefill_baselines,
+    select_relevant_prior,
 )
 
 # 初期設定
@@ -350,37 +360,297 @@ USER_INPUT_FIELDS = ["main_comorbidities_txt"]
 # --- Ollama用関数 (新規追加) ---
 OLLAMA_MODEL_NAME = 'qwen3:8b'
 
-def _build_ollama_group_prompt(group_schema: type[BaseModel], patient_facts_str: str, generated_plan_so_far: dict) -> str:
-    """Ollama用のグループ生成プロンプトを構築する"""
-    return textwrap.dedent(f"""
-        # 役割
-        あなたは、患者様とそのご家族にリハビリテーション計画を説明する、経験豊富で説明上手なリハビリテーション科の専門医です。
-        専門用語を避け、誰にでも理解できる平易な言葉で、誠実かつ丁寧に説明する文章を使用して、患者の個別性を最大限に尊重し、一貫性のあるリハビリテーション総合実施計画書を作成してください。
-
+# 呼び出し後にOllamaがモデルをメモリに保持する時間
+# (グループ間・患者間でモデルとプロンプトキャッシュ (KVキャッシュ) がアンロードされないようにする)
+OLLAMA_KEEP_ALIVE = "30m"
+
+# 全グループで共通のシステムプロンプト。
+# Ollamaはメッセージ列の先頭が前回と一致する部分のKVキャッシュを再利用するため、
+# グループごとに変わる内容 (これまでの生成結果・スキーマ) は必ず最後のメッセージに置く。
+OLLAMA_SYSTEM_PROMPT = textwrap.dedent("""
+    # 役割
+    あなたは、患者様とそのご家族にリハビリテーション計画を説明する、経験豊富で説明上手なリハビリテーション科の専門医です。
+    専門用語を避け、誰にでも理解できる平易な言葉で、誠実かつ丁寧に説明する文章を使用して、患者の個別性を最大限に尊重し、一貫性のあるリハビリテーション総合実施計画書を作成してください。
+
+    # 作成指示
+    「患者データ」と「これまでの生成結果」を統合的に解釈し、**指定されたJSONスキーマで定義されている項目のみ**を日本語で生成してください。
+    - **最重要**: 生成する文章は、患者様やそのご家族が直接読んでも理解できるよう、**専門用語を避け、できるだけ平易な言葉で記述してください**。
+    - ただし、**病名や疾患名はそのまま使用してください**。
+    - 患者データから判断して該当しない、または情報が不足している場合は、必ず「特記なし」とだけ記述してください。
+    - スキーマの`description`をよく読み、具体的で分かりやすい内容を記述してください。
+    - 各項目は、他の項目との関連性や一貫性を保つように記述してください。
+""").strip()
+
+
+def _build_ollama_shared_messages(patient_facts_str: str) -> list[dict]:
+    """全グループで共通のメッセージ (システムプロンプト + 患者データ) を構築する"""
+    patient_message = textwrap.dedent("""
         # 患者データ (事実情報)
         ```json
         {patient_facts_str}
         ```
+    """).strip().format(patient_facts_str=patient_facts_str)
+    return [
+        {'role': 'system', 'content': OLLAMA_SYSTEM_PROMPT},
+        {'role': 'user', 'content': patient_message},
+    ]
+
 
+def _build_ollama_group_suffix(group_schema: type[BaseModel], generated_plan_so_far: dict) -> str:
+    """グループごとに変わる部分 (これまでの生成結果・スキーマ) のメッセージを構築する"""
+    return textwrap.dedent("""
         # これまでの生成結果 (参考にしてください)
         ```json
-        {json.dumps(generated_plan_so_far, indent=2, ensure_ascii=False, default=str)}
+        {plan_json}
         ```
 
-        # 作成指示
-        上記の「患者データ」と「これまでの生成結果」を統合的に解釈し、**以下のJSONスキーマで定義されている項目のみ**を日本語で生成してください。
-        - **最重要**: 生成する文章は、患者様やそのご家族が直接読んでも理解できるよう、**専門用語を避け、できるだけ平易な言葉で記述してください**。
-        - ただし、**病名や疾患名はそのまま使用してください**。
-        - 患者データから判断して該当しない、または情報が不足している場合は、必ず「特記なし」とだけ記述してください。
-        - スキーマの`description`をよく読み、具体的で分かりやすい内容を記述してください。
-        - 各項目は、他の項目との関連性や一貫性を保つように記述してください。
-
+        # 生成するJSONスキーマ
         ```json
-        {json.dumps(group_schema.model_json_schema(), indent=2, ensure_ascii=False)}
+        {schema_json}
         ```
         ---
-        生成するJSON ({group_schema.__name__} の項目のみ):
-    """)
+        生成するJSON ({group_name} の項目のみ):
+    """).strip().format(
+        plan_json=dumps_compact(generated_plan_so_far),
+        schema_json=get_schema_json(group_schema),
+        group_name=group_schema.__name__,
+    )
+
+
+def _build_ollama_group_messages(group_schema: type[BaseModel], patient_facts_str: str, generated_plan_so_far: dict) -> list[dict]:
+    """Ollama用のグループ生成メッセージ (共通部分 + グループ固有部分) を構築する"""
+    return _build_ollama_shared_messages(patient_facts_str) + [
+        {'role': 'user', 'content': _build_ollama_group_suffix(group_schema, generated_plan_so_far)},
+    ]
+
+
+class PartialJsonFieldParser:
+    """
+    ストリームで少しずつ届くJSON文字列を逐次解析し、文字列フィールドの途中経過を取り出すパーサー。
+    JSON全体が揃う前に、生成中の項目の内容を画面へ先行表示するために使用する。
+
+    - オブジェクト内の「キー: "文字列"」の値を、閉じ引用符が届く前から取り出す。
+    - {"properties": {...}} のようにネストされた応答でも、キー名が一致すれば取り出す。
+    - チャンク境界で分断されたエスケープシーケンス (\\n, \\uXXXX など) は、続きが届くまで保留する。
+    """
+
+    def __init__(self, field_names=None):
+        """
+        Args:
+            field_names: 取り出し対象のキー名。None の場合は全ての文字列フィールドを対象とする。
+        """
+        self.field_names = set(field_names) if field_names is not None else None
+        self.values = {}
+        # 各要素は [コンテナ種別('object'/'array'), 直近に読んだキー名, キー待ちかどうか]
+        self._stack = []
+        self._in_string = False
+        self._string_is_key = False
+        self._string_key = None
+        self._escaped = False
+        self._raw = []
+
+    def _is_target(self, key) -> bool:
+        return key is not None and (self.field_names is None or key in self.field_names)
+
+    @staticmethod
+    def _decode(raw: str, complete: bool) -> str:
+        """JSON文字列の中身(エスケープ込み)をデコードする。未完了の場合は末尾の不完全なエスケープを除く"""
+        while not complete:
+            # 末尾の「\ のみ」「\u の途中」「サロゲートペアの前半」は、続きが届くまで保留する
+            match = re.search(r"(\\+)(u[0-9a-fA-F]{0,4})?$", raw)
+            if not match or len(match.group(1)) % 2 == 0:
+                break
+            escape = match.group(2) or ""
+            if len(escape) == 5 and not 0xD800 <= int(escape[1:], 16) <= 0xDBFF:
+                break
+            raw = raw[: match.end(1) - 1]
+        try:
+            return json.loads(f'"{raw}"')
+        except json.JSONDecodeError:
+            return ""
+
+    def feed(self, chunk: str) -> dict:
+        """
+        チャンクを読み込み、このチャンクで内容が変化した対象フィールドを {キー: 現在の値} で返す。
+        """
+        changed_keys = set()
+        for ch in chunk:
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                    self._raw.append(ch)
+                elif ch == "\\":
+                    self._escaped = True
+                    self._raw.append(ch)
+                elif ch == '"':
+                    self._close_string(changed_keys)
+                else:
+                    self._raw.append(ch)
+                continue
+
+            top = self._stack[-1] if self._stack else None
+            if ch == "{":
+                self._stack.append(["object", None, True])
+            elif ch == "[":
+                self._stack.append(["array", None, False])
+            elif ch in "}]":
+                if self._stack:
+                    self._stack.pop()
+            elif ch == ":":
+                if top and top[0] == "object":
+                    top[2] = False
+            elif ch == ",":
+                if top and top[0] == "object":
+                    top[2] = True
+            elif ch == '"':
+                self._in_string = True
+                self._escaped = False
+                self._raw = []
+                self._string_is_key = bool(top and top[0] == "object" and top[2])
+                self._string_key = top[1] if top and top[0] == "object" and not top[2] else None
+
+        # 文字列の途中でチャンクが終わった場合は、そこまでの内容を途中経過として返す
+        if self._in_string and not self._string_is_key and self._is_target(self._string_key):
+            value = self._decode("".join(self._raw), complete=False)
+            if self.values.get(self._string_key) != value:
+                self.values[self._string_key] = value
+                changed_keys.add(self._string_key)
+
+        return {key: self.values[key] for key in changed_keys}
+
+    def _close_string(self, changed_keys: set):
+        self._in_string = False
+        text = self._decode("".join(self._raw), complete=True)
+        top = self._stack[-1] if self._stack else None
+        if self._string_is_key:
+            if top:
+                top[1] = text
+        elif self._is_target(self._string_key):
+            if self.values.get(self._string_key) != text:
+                self.values[self._string_key] = text
+                changed_keys.add(self._string_key)
+
+
+def _generate_ollama_group(group_schema: type[BaseModel], patient_facts_str: str, generated_plan_so_far: dict):
+    """
+    1グループ分の計画案をOllamaで生成し、SSEイベントを順に返すジェネレータ。
+    生成中は各項目の途中経過を partial な update イベントとして返し、
+    生成完了後にスキーマ検証済みの値を update イベント、続けて group_completed イベントとして返す。
+    Ollamaとの通信エラーは呼び出し元に送出し、応答の解析・検証エラーは error イベントとして通知する。
+
+    Returns:
+        dict | None: 検証に成功した場合はグループの生成結果、失敗した場合は None。
+                     (yield from で呼び出した側が受け取る)
+    """
+    print(f"\n--- Ollama Generating Group: {group_schema.__name__} ---")
+    messages = _build_ollama_group_messages(group_schema, patient_facts_str, generated_plan_so_far)
+    logging.info(f"--- Ollama Generating Group: {group_schema.__name__} ---")
+    logging.info("Prompt:\n" + "\n\n".join(m['content'] for m in messages))
+    estimated_tokens = sum(estimate_prompt_tokens(m['content']) for m in messages)
+    prefix_key = prefill_baselines.make_key(OLLAMA_MODEL_NAME, messages[:-1])
+    actual_tokens = None
+    final_chunk = None
+
+    start_time = time.perf_counter()
+    stream = ollama.chat(
+        model=OLLAMA_MODEL_NAME,
+        messages=messages,
+        format='json',
+        stream=True,
+        keep_alive=OLLAMA_KEEP_ALIVE
+    )
+
+    accumulated_json_string = ""
+    # 生成途中の項目を先行表示するため、届いたチャンクから各項目の途中経過を取り出す
+    field_parser = PartialJsonFieldParser(group_schema.model_fields.keys())
+    for chunk in stream:
+        if chunk.get('done'):
+            # 最後のチャンクには、Ollamaが実際に処理したプロンプトのトークン数・時間が含まれる
+            final_chunk = chunk
+            actual_tokens = chunk.get('prompt_eval_count')
+        content = chunk['message']['content']
+        if content:
+            accumulated_json_string += content
+            for key, partial_value in field_parser.feed(content).items():
+                event_data = json.dumps({"key": key, "value": partial_value, "model_type": "ollama_general", "partial": True})
+                yield f"event: update\ndata: {event_data}\n\n"
+
+    elapsed = time.perf_counter() - start_time
+    # 同じ共通部分で最初に実測したプレフィルを基準に、キャッシュの再利用で省けた分を実測値どうしで比べる
+    prefill_seconds, saved_tokens, saved_seconds = prefill_baselines.measure(
+        prefix_key,
+        final_chunk.get('prompt_eval_count') if final_chunk is not None else None,
+        final_chunk.get('prompt_eval_duration') if final_chunk is not None else None,
+    )
+    prompt_token_stats.record(
+        "ollama_plan", group_schema.__name__, estimated_tokens, actual_tokens,
+        prefill_seconds=prefill_seconds, saved_tokens=saved_tokens, saved_prefill_seconds=saved_seconds,
+    )
+    if prefill_seconds is not None:
+        print(
+            f"   [情報] プレフィル {actual_tokens}トークン / {prefill_seconds:.2f}秒 "
+            f"(最初のグループとの比較で、共通部分のキャッシュ再利用により {saved_tokens}トークン / 約{saved_seconds:.2f}秒短縮)"
+        )
+    logging.info(f"--- Ollama Group {group_schema.__name__} finished in {elapsed:.2f}s ---")
+    print(f"--- Ollama Response (Group: {group_schema.__name__}, {elapsed:.2f}s) ---")
+    print(accumulated_json_string)
+    data_to_validate = {}
+    try:
+        # 1. まずJSONとしてパース
+        raw_response_dict = json.loads(accumulated_json_string)
+
+        # 2. ネストされた構造かチェックし、必要なら中身を取り出す
+        if isinstance(raw_response_dict, dict):
+            # よくあるネストキーのリスト (必要に応じて追加)
+            nested_keys = ['properties', 'attributes', 'data']
+            extracted = False
+            for key in nested_keys:
+                if key in raw_response_dict and isinstance(raw_response_dict[key], dict):
+                    data_to_validate = raw_response_dict[key]
+                    print(f"   [情報] ネストされたキー '{key}' からデータを取り出しました。")
+                    extracted = True
+                    break
+            # ネストキーが見つからなければ、トップレベルをそのまま使う
+            if not extracted:
+                # トップレベルに description キーがある場合も、その値が辞書なら取り出す
+                if 'description' in raw_response_dict and isinstance(raw_response_dict.get(group_schema.__name__.lower()), dict): # スキーマ名がキーの場合
+                    data_to_validate = raw_response_dict.get(group_schema.__name__.lower(), raw_response_dict)
+                # それ以外はトップレベルの辞書を検証対象とする
+                else:
+                    data_to_validate = {k: v for k, v in raw_response_dict.items() if k != 'description'} # descriptionを除外
+
+        else:
+            # 予期せず辞書でない場合 (エラー処理)
+            raise ValueError("Ollamaの応答が予期しない形式です（辞書ではありません）。")
+
+        # 3. 取り出したデータでPydantic検証
+        group_result_obj = group_schema.model_validate(data_to_validate) # 辞書を直接渡す
+        group_result_dict = group_result_obj.model_dump()
+
+        for key, value in group_result_dict.items():
+            if value is not None:
+                event_data = json.dumps({"key": key, "value": str(value), "model_type": "ollama_general"})
+                yield f"event: update\ndata: {event_data}\n\n"
+        completed_data = json.dumps({"group": group_schema.__name__, "model_type": "ollama_general"})
+        yield f"event: group_completed\ndata: {completed_data}\n\n"
+        print(f"--- Group {group_schema.__name__} processed successfully ---")
+        return group_result_dict
+
+    except ValidationError as val_err:
+        print(f"グループ {group_schema.__name__} のスキーマ検証に失敗しました。")
+        print(f"検証対象データ: {data_to_validate}")
+        print(val_err)
+        error_message = f"グループ {group_schema.__name__} の生成でスキーマエラー: {val_err}"
+    except json.JSONDecodeError as json_err:
+        print(f"グループ {group_schema.__name__} のJSONパースに失敗しました: {json_err}")
+        error_message = f"グループ {group_schema.__name__} の生成でJSON形式エラー: {json_err}"
+    except Exception as e:
+        print(f"グループ {group_schema.__name__} の処理中に予期せぬエラー: {e}")
+        error_message = f"グループ {group_schema.__name__} の生成中に予期せぬエラー: {e}"
+
+    yield f"event: error\ndata: {json.dumps({'error': error_message})}\n\n"
+    return None
+
 
 def generate_ollama_plan_stream(patient_data: dict):
     """
@@ -398,92 +668,17 @@ def generate_ollama_plan_stream(patient_data: dict):
 
     try:
         patient_facts = _prepare_patient_facts(patient_data)
-        patient_facts_str = json.dumps(patient_facts, indent=2, ensure_ascii=False, default=str)
+        patient_facts_str = dumps_compact(patient_facts)
         generated_plan_so_far = {}
 
         for group_schema in GENERATION_GROUPS:
-            print(f"\n--- Ollama Generating Group: {group_schema.__name__} ---")
-            prompt = _build_ollama_group_prompt(group_schema, patient_facts_str, generated_plan_so_far)
-            logging.info(f"--- Ollama Generating Group: {group_schema.__name__} ---")
-            logging.info("Prompt:\n" + prompt)
-
-            stream = ollama.chat(
-                model=OLLAMA_MODEL_NAME,
-                messages=[{'role': 'user', 'content': prompt}],
-                format='json',
-                stream=True
-            )
-
-            accumulated_json_string = ""
-            for chunk in stream:
-                if chunk['message']['content']:
-                    accumulated_json_string += chunk['message']['content']
-
-            print(f"--- Ollama Response (Group: {group_schema.__name__}) ---")
-            print(accumulated_json_string)
-            try:
-                # 1. まずJSONとしてパース
-                raw_response_dict = json.loads(accumulated_json_string)
-
-                # 2. ネストされた構造かチェックし、必要なら中身を取り出す ★★★修正点★★★
-                data_to_validate = {} # 型ヒントを Dict に変更
-                if isinstance(raw_response_dict, dict):
-                    # よくあるネストキーのリスト (必要に応じて追加)
-                    nested_keys = ['properties', 'attributes', 'data']
-                    extracted = False
-                    for key in nested_keys:
-                        if key in raw_response_dict and isinstance(raw_response_dict[key], dict):
-                            data_to_validate = raw_response_dict[key]
-                            print(f"   [情報] ネストされたキー '{key}' からデータを取り出しました。")
-                            extracted = True
-                            break
-                    # ネストキーが見つからなければ、トップレベルをそのまま使う
-                    if not extracted:
-                         # トップレベルに description キーがある場合も、その値が辞書なら取り出す
-                        if 'description' in raw_response_dict and isinstance(raw_response_dict.get(group_schema.__name__.lower()), dict): # スキーマ名がキーの場合
-                            data_to_validate = raw_response_dict.get(group_schema.__name__.lower(), raw_response_dict)
-                        # それ以外はトップレベルの辞書を検証対象とする
-                        else:
-                            data_to_validate = {k: v for k, v in raw_response_dict.items() if k != 'description'} # descriptionを除外
-
-                else:
-                     # 予期せず辞書でない場合 (エラー処理)
-                    raise ValueError("Ollamaの応答が予期しない形式です（辞書ではありません）。")
-
-
-                # 3. 取り出したデータでPydantic検証 ★★★修正点★★★
-                # group_result_obj = group_schema.model_validate_json(accumulated_json_string) # 元のコード
-                group_result_obj = group_schema.model_validate(data_to_validate) # 辞書を直接渡す
-                group_result_dict = group_result_obj.model_dump()
-
+            # 依存するグループの生成結果だけを渡し、プロンプトが不要に長くならないようにする
+            plan_snapshot = select_relevant_prior(generated_plan_so_far, group_schema, GENERATION_GROUP_DEPENDENCIES)
+            group_result_dict = yield from _generate_ollama_group(group_schema, patient_facts_str, plan_snapshot)
+            # 検証に失敗したグループは結果を持たないが、後続グループの生成は続行する
+            if group_result_dict:
                 generated_plan_so_far.update(group_result_dict)
 
-                for key, value in group_result_dict.items():
-                    if value is not None:
-                        event_data = json.dumps({"key": key, "value": str(value), "model_type": "ollama_general"})
-                        yield f"event: update\ndata: {event_data}\n\n"
-                print(f"--- Group {group_schema.__name__} processed successfully ---")
-
-            except ValidationError as val_err:
-                print(f"グループ {group_schema.__name__} のスキーマ検証に失敗しました。")
-                print(f"検証対象データ: {data_to_validate}") # ★★★デバッグ用★★★
-                print(val_err)
-                error_message = f"グループ {group_schema.__name__} の生成でスキーマエラー: {val_err}"
-                error_event = f"event: error\ndata: {json.dumps({'error': error_message})}\n\n"
-                yield error_event
-            except json.JSONDecodeError as json_err:
-                print(f"グループ {group_schema.__name__} のJSONパースに失敗しました: {json_err}")
-                error_message = f"グループ {group_schema.__name__} の生成でJSON形式エラー: {json_err}"
-                error_event = f"event: error\ndata: {json.dumps({'error': error_message})}\n\n"
-                yield error_event
-            except Exception as e:
-                print(f"グループ {group_schema.__name__} の処理中に予期せぬエラー: {e}")
-                error_message = f"グループ {group_schema.__name__} の生成中に予期せぬエラー: {e}"
-                error_event = f"event: error\ndata: {json.dumps({'error': error_message})}\n\n"
-                yield error_event
-
-            time.sleep(1)
-
         print("\n--- Ollamaによる全グループの生成完了 ---")
         yield "event: finished\ndata: {}\n\n"
 
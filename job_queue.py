@@ -0,0 +1,403 @@
+import os
+import json
+import time
+import uuid
+import hashlib
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# 生成ジョブとイベントを保存するSQLiteファイル
+GENERATION_JOB_DB_PATH = os.getenv("GENERATION_JOB_DB_PATH", os.path.join("cache", "generation_jobs.sqlite3"))
+# 同時に実行する生成ジョブの数 (Ollama・RAGのモデルはメモリを多く使うため、少なめにしている)
+GENERATION_JOB_WORKERS = int(os.getenv("GENERATION_JOB_WORKERS", "2"))
+# 完了したジョブとイベントを保持する時間 (秒)。これを過ぎたジョブは再接続できなくなる
+GENERATION_JOB_RETENTION_SECONDS = int(os.getenv("GENERATION_JOB_RETENTION_SECONDS", str(24 * 60 * 60)))
+# 新しいイベントがない間、接続を維持するためにコメント行を送る間隔 (秒)
+GENERATION_JOB_HEARTBEAT_SECONDS = float(os.getenv("GENERATION_JOB_HEARTBEAT_SECONDS", "15"))
+
+# ジョブの状態
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_SUCCEEDED = "succeeded"
+JOB_FAILED = "failed"
+JOB_INTERRUPTED = "interrupted"
+FINISHED_STATUSES = (JOB_SUCCEEDED, JOB_FAILED, JOB_INTERRUPTED)
+
+
+def format_event_id(job_id: str, seq: int) -> str:
+    """
+    SSEの id を「ジョブID:連番」の形式で作る。
+    ブラウザ (EventSource) は再接続時にこの値を Last-Event-ID ヘッダーで送り返すため、
+    URLにジョブIDを含めなくても、どのジョブのどこから再開すればよいかが分かる。
+    """
+    return f"{job_id}:{seq}"
+
+
+def make_coalesce_key(kind: str, payload) -> str:
+    """
+    同じ内容の生成をまとめるためのキーを作る。
+    辞書のキー順に依存しないよう、sort_keys で正規化してからハッシュ化する。
+    """
+    payload_json = json.dumps(payload, ensure_ascii=False, sort_keys=True, default=str)
+    return f"{kind}:{hashlib.sha256(payload_json.encode('utf-8')).hexdigest()}"
+
+
+def parse_event_id(last_event_id: str | None) -> tuple[str | None, int]:
+    """Last-Event-ID を (ジョブID, 連番) に分解する。形式が不正な場合は (None, 0) を返す"""
+    if not last_event_id or ":" not in last_event_id:
+        return None, 0
+    job_id, _, seq = last_event_id.rpartition(":")
+    try:
+        return job_id, int(seq)
+    except ValueError:
+        return None, 0
+
+
+class JobStore:
+    """
+    生成ジョブとそのイベント (SSEの文字列) を保存するSQLiteのテーブル。
+    イベントはジョブごとに連番を付けて保存し、再接続したクライアントには続きから送り直す。
+    連番はジョブごとにメモリ上で数える (プロセスの再起動後など、初めて追加する場合のみテーブルから続きの番号を読む)。
+    """
+
+    def __init__(self, db_path: str = GENERATION_JOB_DB_PATH):
+        if db_path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+        # 実行中のジョブの、最後に追加したイベントの連番 (ジョブID -> 連番)
+        self._last_seq: dict[str, int] = {}
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS generation_jobs (
+                    job_id TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    owner_id INTEGER,
+                    status TEXT NOT NULL,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+                """
+            )
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS generation_job_events (
+                    job_id TEXT NOT NULL,
+                    seq INTEGER NOT NULL,
+                    event TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    PRIMARY KEY (job_id, seq)
+                )
+                """
+            )
+            # 実行中のジョブに相乗りしたユーザー (作成したユーザー以外にも、イベントの受信を許可する)
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS generation_job_subscribers (
+                    job_id TEXT NOT NULL,
+                    user_id INTEGER NOT NULL,
+                    PRIMARY KEY (job_id, user_id)
+                )
+                """
+            )
+
+    def create_job(self, kind: str, owner_id) -> str:
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO generation_jobs (job_id, kind, owner_id, status, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, kind, owner_id, JOB_QUEUED, now, now),
+            )
+        return job_id
+
+    def get_job(self, job_id: str) -> dict | None:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT job_id, kind, owner_id, status, error, created_at, updated_at FROM generation_jobs WHERE job_id = ?",
+                (job_id,),
+            ).fetchone()
+            if row is None:
+                return None
+            event_count = self._conn.execute(
+                "SELECT COUNT(*) FROM generation_job_events WHERE job_id = ?", (job_id,)
+            ).fetchone()[0]
+        keys = ("job_id", "kind", "owner_id", "status", "error", "created_at", "updated_at")
+        return {**dict(zip(keys, row)), "event_count": event_count}
+
+    def add_subscriber(self, job_id: str, user_id):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO generation_job_subscribers (job_id, user_id) VALUES (?, ?)", (job_id, user_id)
+            )
+
+    def is_subscriber(self, job_id: str, user_id) -> bool:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM generation_job_subscribers WHERE job_id = ? AND user_id = ?", (job_id, user_id)
+            ).fetchone()
+        return row is not None
+
+    def set_status(self, job_id: str, status: str, error: str | None = None):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE generation_jobs SET status = ?, error = ?, updated_at = ? WHERE job_id = ?",
+                (status, error, time.time(), job_id),
+            )
+            if status in FINISHED_STATUSES:
+                self._last_seq.pop(job_id, None)
+
+    def append_event(self, job_id: str, event: str) -> int:
+        """イベントを追加し、その連番を返す"""
+        with self._lock:
+            last_seq = self._last_seq.get(job_id)
+            if last_seq is None:
+                last_seq = self._conn.execute(
+                    "SELECT COALESCE(MAX(seq), 0) FROM generation_job_events WHERE job_id = ?", (job_id,)
+                ).fetchone()[0]
+            seq = last_seq + 1
+            self._last_seq[job_id] = seq
+            self._conn.execute(
+                "INSERT INTO generation_job_events (job_id, seq, event, created_at) VALUES (?, ?, ?, ?)",
+                (job_id, seq, event, time.time()),
+            )
+        return seq
+
+    def get_events(self, job_id: str, after_seq: int = 0) -> list[tuple[int, str]]:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT seq, event FROM generation_job_events WHERE job_id = ? AND seq > ? ORDER BY seq",
+                (job_id, after_seq),
+            ).fetchall()
+
+    def mark_unfinished_as_interrupted(self) -> list[str]:
+        """
+        前回のプロセスで実行中のまま終了したジョブを interrupted にする。
+        再接続したクライアントが待ち続けないよう、エラーイベントも追加する。
+        """
+        with self._lock:
+            job_ids = [
+                row[0]
+                for row in self._conn.execute(
+                    "SELECT job_id FROM generation_jobs WHERE status IN (?, ?)", (JOB_QUEUED, JOB_RUNNING)
+                ).fetchall()
+            ]
+        for job_id in job_ids:
+            self.append_event(job_id, _error_event("サーバーの再起動により生成が中断されました。もう一度生成してください。"))
+            self.set_status(job_id, JOB_INTERRUPTED, "server restarted")
+        return job_ids
+
+    def delete_expired(self, retention_seconds: float = GENERATION_JOB_RETENTION_SECONDS) -> int:
+        """保持期間を過ぎた完了済みジョブとイベントを削除する"""
+        threshold = time.time() - retention_seconds
+        with self._lock:
+            job_ids = [
+                row[0]
+                for row in self._conn.execute(
+                    f"SELECT job_id FROM generation_jobs WHERE status IN ({','.join('?' * len(FINISHED_STATUSES))}) AND updated_at < ?",
+                    (*FINISHED_STATUSES, threshold),
+                ).fetchall()
+            ]
+            for job_id in job_ids:
+                self._conn.execute("DELETE FROM generation_job_events WHERE job_id = ?", (job_id,))
+                self._conn.execute("DELETE FROM generation_job_subscribers WHERE job_id = ?", (job_id,))
+                self._conn.execute("DELETE FROM generation_jobs WHERE job_id = ?", (job_id,))
+        return len(job_ids)
+
+    def count_by_status(self) -> dict:
+        with self._lock:
+            return dict(self._conn.execute("SELECT status, COUNT(*) FROM generation_jobs GROUP BY status").fetchall())
+
+
+def _error_event(message: str) -> str:
+    return f"event: error\ndata: {json.dumps({'error': message})}\n\n"
+
+
+def _update_event_key(event: str) -> tuple[tuple | None, bool]:
+    """
+    update イベントであれば ((model_type, 項目名), 途中経過かどうか) を返す。
+    それ以外のイベントは (None, False) を返す。
+    """
+    if not event.startswith("event: update\n"):
+        return None, False
+    for line in event.split("\n"):
+        if line.startswith("data: "):
+            try:
+                data = json.loads(line[len("data: "):])
+            except ValueError:
+                return None, False
+            if not isinstance(data, dict) or "key" not in data:
+                return None, False
+            return (data.get("model_type"), data["key"]), bool(data.get("partial"))
+    return None, False
+
+
+class JobManager:
+    """
+    生成処理 (SSEの文字列を yield するジェネレータ) を、リクエストのスレッドではなくワーカースレッドで実行する。
+
+    - submit() でジョブを登録すると、ワーカーがジェネレータを最後まで実行し、イベントを JobStore に保存する。
+    - stream() は保存済みのイベントを送り、ジョブが完了するまで新しいイベントを待って送り続ける。
+      クライアントが切断しても生成は続くため、再接続すれば Last-Event-ID の続きから受け取れる。
+    - coalesce_key を指定した場合、同じキーのジョブが実行中であれば新しく実行せず、そのジョブIDを返す (single-flight)。
+      後から来たリクエストは、実行中のジョブのイベントを最初から受け取る。
+    - 生成途中の値 ("partial": true の update イベント) は保存せず、項目ごとに最新の1件だけをメモリに保持して送る。
+      その項目の確定した update イベントが届いた時点で破棄するため、再接続時には確定値と生成中の項目の最新値だけが届く。
+    """
+
+    def __init__(self, store: JobStore, max_workers: int = GENERATION_JOB_WORKERS, heartbeat_seconds: float = GENERATION_JOB_HEARTBEAT_SECONDS):
+        self.store = store
+        self.heartbeat_seconds = heartbeat_seconds
+        self.executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="generation-job")
+        # 新しいイベントの追加・ジョブの完了を、待機中の stream() に知らせる
+        self._condition = threading.Condition()
+        self._version = 0
+        # 実行中のジョブ (coalesce_key -> ジョブID)
+        self._inflight: dict[str, str] = {}
+        self._inflight_lock = threading.Lock()
+        self.coalesced = 0
+        # 実行中のジョブの、項目ごとの最新の途中経過 (ジョブID -> {(model_type, 項目名): イベント})
+        self._partials: dict[str, dict[tuple, str]] = {}
+        self._partials_lock = threading.Lock()
+        self.partial_events = 0
+        interrupted = store.mark_unfinished_as_interrupted()
+        if interrupted:
+            print(f"前回のプロセスで中断された生成ジョブ: {len(interrupted)}件")
+        store.delete_expired()
+
+    def submit(self, kind: str, owner_id, make_events, coalesce_key: str | None = None) -> str:
+        """
+        ジョブを登録し、ジョブIDを返す。
+
+        Args:
+            kind (str): ジョブの種類 (例: "general", "rag:hybrid_search_experiment")。
+            owner_id: ジョブを作成したユーザーのID。他のユーザーからの再接続を拒否するために使う。
+            make_events: 引数なしで呼び出すと、SSEの文字列を yield するジェネレータを返す関数。
+            coalesce_key (str | None): make_coalesce_key() で作成したキー。
+                同じキーのジョブが実行中の場合は、make_events を呼び出さずにそのジョブIDを返す。
+        """
+        with self._inflight_lock:
+            job_id = self._inflight.get(coalesce_key) if coalesce_key else None
+            if job_id is not None:
+                self.coalesced += 1
+                self.store.add_subscriber(job_id, owner_id)
+                print(f"同じ内容の生成ジョブ {job_id} が実行中のため、その結果を共有します")
+                return job_id
+            job_id = self.store.create_job(kind, owner_id)
+            self.store.add_subscriber(job_id, owner_id)
+            if coalesce_key:
+                self._inflight[coalesce_key] = job_id
+        self.executor.submit(self._run, job_id, make_events, coalesce_key)
+        return job_id
+
+    def can_access(self, job_id: str, user_id) -> bool:
+        """ジョブを作成した、または実行中のジョブに相乗りしたユーザーであれば True を返す"""
+        job = self.store.get_job(job_id)
+        if job is None:
+            return False
+        return job["owner_id"] == user_id or self.store.is_subscriber(job_id, user_id)
+
+    def _run(self, job_id: str, make_events, coalesce_key: str | None = None):
+        self.store.set_status(job_id, JOB_RUNNING)
+        try:
+            for event in make_events():
+                self._append(job_id, event)
+        except Exception as e:
+            print(f"生成ジョブ {job_id} でエラーが発生しました: {e}")
+            self._append(job_id, _error_event(f"サーバーエラーが発生しました: {e}"))
+            self._finish(job_id, JOB_FAILED, str(e), coalesce_key)
+            return
+        self._finish(job_id, JOB_SUCCEEDED, coalesce_key=coalesce_key)
+
+    def _append(self, job_id: str, event: str):
+        update_key, partial = _update_event_key(event)
+        if partial:
+            with self._partials_lock:
+                self._partials.setdefault(job_id, {})[update_key] = event
+                self.partial_events += 1
+        else:
+            if update_key is not None:
+                # 確定値を保存する前に途中経過を破棄し、確定値の後に古い途中経過が送られないようにする
+                with self._partials_lock:
+                    self._partials.get(job_id, {}).pop(update_key, None)
+            self.store.append_event(job_id, event)
+        self._notify()
+
+    def _get_partials(self, job_id: str) -> dict[tuple, str]:
+        with self._partials_lock:
+            return dict(self._partials.get(job_id, {}))
+
+    def _finish(self, job_id: str, status: str, error: str | None = None, coalesce_key: str | None = None):
+        # 完了を通知する前に外しておき、完了後のリクエストが終わったジョブに相乗りしないようにする
+        if coalesce_key:
+            with self._inflight_lock:
+                if self._inflight.get(coalesce_key) == job_id:
+                    del self._inflight[coalesce_key]
+        with self._partials_lock:
+            self._partials.pop(job_id, None)
+        self.store.set_status(job_id, status, error)
+        self._notify()
+
+    def _notify(self):
+        with self._condition:
+            self._version += 1
+            self._condition.notify_all()
+
+    def get_job(self, job_id: str) -> dict | None:
+        return self.store.get_job(job_id)
+
+    def stream(self, job_id: str, after_seq: int = 0):
+        """
+        ジョブのイベントを、after_seq の次から順に yield する (各イベントには「ジョブID:連番」の id を付ける)。
+        保存していない途中経過は、保存済みのイベントの後に id なしで送る (再接続時の Last-Event-ID は変わらない)。
+        ジョブが完了し、全てのイベントを送り終えた時点で終了する。
+        """
+        yield f"event: job\nid: {format_event_id(job_id, after_seq)}\ndata: {json.dumps({'job_id': job_id})}\n\n"
+        last_seq = after_seq
+        sent_partials = {}
+        while True:
+            with self._condition:
+                seen_version = self._version
+            events = self.store.get_events(job_id, last_seq)
+            for seq, event in events:
+                last_seq = seq
+                yield f"id: {format_event_id(job_id, seq)}\n{event}"
+            if events:
+                continue
+
+            # 前回送った後に更新された項目の途中経過だけを送る
+            partials = self._get_partials(job_id)
+            changed = [event for key, event in partials.items() if sent_partials.get(key) is not event]
+            sent_partials = partials
+            if changed:
+                yield from changed
+                continue
+
+            job = self.store.get_job(job_id)
+            if job is None or job["status"] in FINISHED_STATUSES:
+                # 完了直前に追加されたイベントを取りこぼさないよう、最後にもう一度確認する
+                for seq, event in self.store.get_events(job_id, last_seq):
+                    yield f"id: {format_event_id(job_id, seq)}\n{event}"
+                return
+
+            with self._condition:
+                # 確認している間に通知があった場合は待たずに読み直す
+                notified = self._version != seen_version or self._condition.wait(timeout=self.heartbeat_seconds)
+            if not notified:
+                # プロキシなどに接続を切られないよう、SSEのコメント行を送る
+                yield ": keep-alive\n\n"
+
+    def stats(self) -> dict:
+        with self._inflight_lock:
+            inflight = len(self._inflight)
+        return {
+            "jobs": self.store.count_by_status(),
+            "inflight_coalescable": inflight,
+            "coalesced": self.coalesced,
+            "partial_events_not_stored": self.partial_events,
+        }
@@ -1,6 +1,8 @@
 import os
-import json
+import sys
 import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from dotenv import load_dotenv
 from google import genai
 from pydantic import BaseModel
@@ -8,7 +10,15 @@ from google.genai import types
 from google.api_core.exceptions import ResourceExhausted, ServiceUnavailable
 from schemas import (
     PATIENT_INFO_EXTRACTION_GROUPS,
+    PATIENT_INFO_EXTRACTION_GROUP_DEPENDENCIES,
 )  # 分割したスキーマのリストをインポート
+from prompt_assembly import (
+    dumps_compact,
+    estimate_prompt_tokens,
+    get_schema_dict,
+    prompt_token_stats,
+    select_relevant_prior,
+)
 import logging
 
 load_dotenv()
@@ -29,6 +39,84 @@ if not logger.hasHandlers():  # ハンドラが未設定の場合のみ設定
     file_handler.setFormatter(formatter)
     logger.addHandler(file_handler)
 
+# 依存関係のないグループを同時にAPIへ問い合わせるかどうか
+PATIENT_INFO_PARALLEL_EXTRACTION = True
+# 並列モードで同時に抽出するグループ数の上限
+PATIENT_INFO_MAX_PARALLEL_GROUPS = 4
+# APIの呼び出し回数の上限 (1分あたり)。gemini-2.5-flash-lite の無料枠は 15 RPM
+PATIENT_INFO_REQUESTS_PER_MINUTE = 15
+# 待ち時間なしで連続して呼び出せる回数 (トークンバケットの容量)
+PATIENT_INFO_RATE_LIMIT_BURST = 4
+# 抽出に使うLLMのバックエンド。"gemini" (Gemini API) または "ollama" (ローカルLLM)
+PATIENT_INFO_PARSER_BACKEND = os.getenv("PATIENT_INFO_PARSER_BACKEND", "gemini").lower()
+PATIENT_INFO_OLLAMA_MODEL = os.getenv("PATIENT_INFO_OLLAMA_MODEL", "qwen3:8b")
+# Ollamaのモデルをメモリに保持しておく時間 (グループごとの呼び出しの間にモデルがアンロードされないようにする)
+PATIENT_INFO_OLLAMA_KEEP_ALIVE = os.getenv("PATIENT_INFO_OLLAMA_KEEP_ALIVE", "30m")
+
+
+class TokenBucketRateLimiter:
+    """
+    トークンバケット方式のレート制限。
+    一定の速度でトークンが補充され、API呼び出し1回ごとに1トークンを消費する。
+    トークンがない場合は補充されるまで待機するため、固定のsleepより無駄な待ち時間が少ない。
+    """
+
+    def __init__(self, requests_per_minute: float, burst: int = 1):
+        self.rate_per_second = requests_per_minute / 60.0
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """トークンを1つ取得する。取得できるまでブロックする"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated_at) * self.rate_per_second
+                )
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_time = (1 - self.tokens) / self.rate_per_second
+            time.sleep(wait_time)
+
+
+def create_llm_backend(backend: str):
+    """
+    Rehab_RAG の rag_components.llms から、抽出に使うLLMラッパーを作成する。
+    返り値は generate(prompt, response_schema=...) を持つインスタンス。
+    """
+    rehab_rag_path = os.path.abspath(os.path.join(os.path.dirname(__file__), "Rehab_RAG"))
+    if rehab_rag_path not in sys.path:
+        sys.path.append(rehab_rag_path)
+
+    if backend == "ollama":
+        from rag_components.llms.ollama_llm import OllamaLLM
+
+        return OllamaLLM(model_name=PATIENT_INFO_OLLAMA_MODEL, keep_alive=PATIENT_INFO_OLLAMA_KEEP_ALIVE)
+    raise ValueError(f"未対応のバックエンドです: {backend}")
+
+
+def reconcile_group_results(group_results: list[dict]) -> dict:
+    """
+    複数グループの抽出結果をマージする。
+    - 後のグループの値で上書きするが、null では上書きしない。
+    - 一度 True になった項目は、後の結果が False/null でも True のまま保持する
+      (プロンプトの「Trueの値の保持」と同じ規則を、並列抽出した結果にも適用する)。
+    """
+    merged = {}
+    for group_result in group_results:
+        for key, value in group_result.items():
+            if value is None and key in merged:
+                continue
+            if merged.get(key) is True and value is not True:
+                continue
+            merged[key] = value
+    return merged
+
 
 class PatientInfoParser:
     """
@@ -36,33 +124,63 @@ class PatientInfoParser:
     スキーマが大きすぎることによるAPIエラーを回避するため、情報を複数のグループに分けて段階的に抽出する。
     """
 
-    def __init__(self, api_key: str = None):
-        # gemini_client.py と同様に、環境変数から自動でキーを読み込む方式に変更
-        if not os.getenv("GOOGLE_API_KEY") and not os.getenv("GEMINI_API_KEY"):
-            raise ValueError(
-                "APIキーが設定されていません。環境変数 'GOOGLE_API_KEY' または 'GEMINI_API_KEY' を設定してください。"
-            )
+    def __init__(
+        self,
+        api_key: str = None,
+        client=None,
+        llm=None,
+        rate_limiter: TokenBucketRateLimiter = None,
+        parallel: bool = PATIENT_INFO_PARALLEL_EXTRACTION,
+        max_parallel_groups: int = PATIENT_INFO_MAX_PARALLEL_GROUPS,
+    ):
+        """
+        Args:
+            api_key: 未使用 (環境変数から読み込む)。
+            client: generate_content を持つクライアント。省略時は genai.Client() を作成する (テストではスタブを渡す)。
+            llm: rag_components.llms と同じ generate(prompt, response_schema=...) を持つLLMラッパー (OllamaLLMなど)。
+                指定した場合は Gemini API の代わりにこちらで抽出する。
+                省略時は PATIENT_INFO_PARSER_BACKEND が "gemini" 以外であれば、そのバックエンドを作成する。
+            rate_limiter: API呼び出しのレート制限。省略時は Gemini API の場合のみ PATIENT_INFO_REQUESTS_PER_MINUTE に従う。
+            parallel: 依存関係のないグループを並列に抽出するかどうか。
+            max_parallel_groups: 並列モードで同時に抽出するグループ数の上限。
+        """
+        if llm is None and client is None and PATIENT_INFO_PARSER_BACKEND != "gemini":
+            llm = create_llm_backend(PATIENT_INFO_PARSER_BACKEND)
+
+        self.llm = llm
+        if llm is not None:
+            # ローカルLLMはAPIの利用制限がないため、明示的に渡された場合のみレート制限をかける
+            self.client = None
+            self.model_name = getattr(llm, "model_name", type(llm).__name__)
+            self.rate_limiter = rate_limiter
+        else:
+            if client is None:
+                # gemini_client.py と同様に、環境変数から自動でキーを読み込む方式に変更
+                if not os.getenv("GOOGLE_API_KEY") and not os.getenv("GEMINI_API_KEY"):
+                    raise ValueError(
+                        "APIキーが設定されていません。環境変数 'GOOGLE_API_KEY' または 'GEMINI_API_KEY' を設定してください。"
+                    )
+                client = genai.Client()
 
-        self.client = genai.Client()
-        # 構造化出力をサポートするモデルを選択
-        self.model_name = "gemini-2.5-flash-lite"
+            self.client = client
+            # 構造化出力をサポートするモデルを選択
+            self.model_name = "gemini-2.5-flash-lite"
+            self.rate_limiter = rate_limiter or TokenBucketRateLimiter(
+                PATIENT_INFO_REQUESTS_PER_MINUTE, burst=PATIENT_INFO_RATE_LIMIT_BURST
+            )
+        self.parallel = parallel
+        self.max_parallel_groups = max_parallel_groups
 
     def _build_prompt(
         self, text: str, group_schema: type[BaseModel], extracted_data_so_far: dict
     ) -> str:
         """段階的抽出のためのプロンプトを構築する"""
 
-        # これまでに抽出されたデータを簡潔なサマリーにする
-        summary = (
-            json.dumps(extracted_data_so_far, indent=2, ensure_ascii=False)
-            if extracted_data_so_far
-            else "まだありません。"
-        )
-
-        # 今回の抽出対象スキーマをJSON形式の文字列としてプロンプトに含める
-        schema_json = json.dumps(
-            group_schema.model_json_schema(), indent=2, ensure_ascii=False
+        # これまでに抽出されたデータのうち、今回のグループに関係する項目だけを簡潔なサマリーにする
+        relevant_prior = select_relevant_prior(
+            extracted_data_so_far, group_schema, PATIENT_INFO_EXTRACTION_GROUP_DEPENDENCIES
         )
+        summary = dumps_compact(relevant_prior) if relevant_prior else "まだありません。"
 
         return f"""あなたは医療情報抽出の専門家です。以下の「カルテテキスト」から患者の最新の状態を抽出し、後述する「JSONスキーマ」に従って構造化データを作成してください。
 
@@ -93,91 +211,191 @@ class PatientInfoParser:
 ---
 """
 
-    def parse_text(self, text: str) -> dict:
+    def parse_text(self, text: str, parallel: bool = None) -> dict:
         """
         与えられたテキストを解析し、複数のスキーマグループに基づいて段階的に情報を抽出し、結果をマージして返す。
 
         Args:
             text: 解析対象のカルテなどのテキスト。
+            parallel: 依存関係のないグループを並列に抽出するかどうか。None の場合はコンストラクタの設定に従う。
 
         Returns:
             抽出された患者情報の辞書。エラー時はエラー情報を格納した辞書を返す。
         """
-        final_result = {}
+        group_results = dict(self.iter_group_results(text, parallel=parallel))
 
-        for group_schema in PATIENT_INFO_EXTRACTION_GROUPS:
-            print(f"--- Processing group: {group_schema.__name__} ---")
-            prompt = self._build_prompt(text, group_schema, final_result)
+        # 最終的な突き合わせ (グループの定義順にマージし、True は保持する)
+        final_result = reconcile_group_results(
+            [group_results[g] for g in PATIENT_INFO_EXTRACTION_GROUPS if group_results.get(g)]
+        )
 
-            logger.info(
-                f"--- Parsing Group: {group_schema.__name__} ---"
-            )  # loggerを使用
-            logger.info("Parsing Prompt:\n" + prompt)  # loggerを使用
+        if not final_result:
+            return {
+                "error": "患者情報の解析に失敗しました。",
+                "details": "どのグループからも有効な情報を抽出できませんでした。",
+            }
 
-            try:
-                generation_config = types.GenerateContentConfig(
-                    response_mime_type="application/json",
-                    response_schema=group_schema,
-                )
+        return final_result
 
-                # リトライ処理を追加
-                max_retries = 3
-                backoff_factor = 2  # 初回待機時間（秒）
-                response = None
-
-                for attempt in range(max_retries):
-                    try:
-                        response = self.client.models.generate_content(
-                            model=self.model_name,
-                            contents=prompt,
-                            config=generation_config,
+    def iter_group_results(self, text: str, parallel: bool = None):
+        """
+        グループの抽出が終わるたびに (グループのスキーマ, 抽出結果) を返すジェネレータ。
+        抽出に失敗したグループの結果は None になる。
+        画面に抽出結果を順次反映するストリーミングAPIから使用する。
+        """
+        if parallel is None:
+            parallel = self.parallel
+
+        if parallel:
+            yield from self._extract_groups_parallel(text)
+        else:
+            yield from self._extract_groups_serial(text)
+
+    def _extract_groups_serial(self, text: str):
+        """従来通り、全グループを順番に抽出する (各グループはそれまでの全ての抽出結果を参照する)"""
+        extracted_data_so_far = {}
+        for group_schema in PATIENT_INFO_EXTRACTION_GROUPS:
+            group_result = self._extract_group(text, group_schema, extracted_data_so_far)
+            if group_result:
+                extracted_data_so_far = reconcile_group_results([extracted_data_so_far, group_result])
+            yield group_schema, group_result
+
+    def _extract_groups_parallel(self, text: str):
+        """
+        依存関係 (PATIENT_INFO_EXTRACTION_GROUP_DEPENDENCIES) が満たされたグループから順に、並列で抽出する。
+        各グループは、依存するグループの抽出結果のみを「これまでに抽出された情報」として参照する。
+        """
+        groups = list(PATIENT_INFO_EXTRACTION_GROUPS)
+        pending = list(groups)
+        group_results = {}
+        futures = {}
+
+        executor = ThreadPoolExecutor(max_workers=self.max_parallel_groups)
+        try:
+            while pending or futures:
+                for group_schema in list(pending):
+                    dependencies = PATIENT_INFO_EXTRACTION_GROUP_DEPENDENCIES.get(group_schema, [])
+                    # 抽出対象に含まれない依存先は無視する
+                    if all(d in group_results or d not in groups for d in dependencies):
+                        context = reconcile_group_results(
+                            [group_results[d] for d in dependencies if group_results.get(d)]
                         )
-                        break  # 成功した場合はループを抜ける
-                    except (ResourceExhausted, ServiceUnavailable) as e:
-                        if attempt < max_retries - 1:
-                            wait_time = backoff_factor * (2**attempt)
-                            print(
-                                f"   [警告] APIレート制限またはサーバーエラー。{wait_time}秒後に再試行します... ({attempt + 1}/{max_retries})"
-                            )
-                            time.sleep(wait_time)
-                        else:
-                            print(
-                                f"   [エラー] API呼び出しが{max_retries}回失敗しました。"
-                            )
-                            raise e  # 最終的に失敗した場合はエラーを再送出
-                # リトライ処理ここまで
-
-                if response and response.parsed:
-                    group_result = response.parsed.model_dump(mode="json")
-
-                    # データ正規化処理を追加
-                    if "gender" in group_result and group_result["gender"]:
-                        if "男性" in group_result["gender"]:
-                            group_result["gender"] = "男"
-                        elif "女性" in group_result["gender"]:
-                            group_result["gender"] = "女"
-                    # データ正規化処理ここまで
-
-                    final_result.update(group_result)  # マージして次のステップへ
-                else:
-                    print(
-                        f"   [警告] グループ {group_schema.__name__} の解析で有効な結果が得られませんでした。"
+                        future = executor.submit(self._extract_group, text, group_schema, context)
+                        futures[future] = group_schema
+                        pending.remove(group_schema)
+
+                if not futures:
+                    raise RuntimeError(
+                        f"抽出グループの依存関係を解決できません: {[g.__name__ for g in pending]}"
                     )
 
-            except Exception as e:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    group_schema = futures.pop(future)
+                    group_results[group_schema] = future.result()
+                    yield group_schema, group_results[group_schema]
+        finally:
+            # 呼び出し元が途中で読み込みをやめた場合 (クライアントの切断など) は、未着手のグループを取り消す
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _extract_group(
+        self, text: str, group_schema: type[BaseModel], extracted_data_so_far: dict
+    ) -> dict | None:
+        """1つのグループを抽出する。失敗した場合は None を返す (他のグループの処理は続行する)"""
+        print(f"--- Processing group: {group_schema.__name__} ---")
+        prompt = self._build_prompt(text, group_schema, extracted_data_so_far)
+
+        logger.info(
+            f"--- Parsing Group: {group_schema.__name__} ---"
+        )  # loggerを使用
+        logger.info("Parsing Prompt:\n" + prompt)  # loggerを使用
+        estimated_tokens = estimate_prompt_tokens(prompt)
+
+        try:
+            if self.llm is not None:
+                parsed = self._generate_with_llm(prompt, group_schema)
+                prompt_token_stats.record("patient_info", group_schema.__name__, estimated_tokens)
+            else:
+                parsed, actual_tokens = self._generate_with_gemini(prompt, group_schema)
+                prompt_token_stats.record("patient_info", group_schema.__name__, estimated_tokens, actual_tokens)
+
+            if parsed:
+                group_result = parsed.model_dump(mode="json")
+
+                # データ正規化処理を追加
+                if "gender" in group_result and group_result["gender"]:
+                    if "男性" in group_result["gender"]:
+                        group_result["gender"] = "男"
+                    elif "女性" in group_result["gender"]:
+                        group_result["gender"] = "女"
+                # データ正規化処理ここまで
+
+                return group_result
+            else:
                 print(
-                    f"グループ {group_schema.__name__} の解析中にエラーが発生しました: {e}"
+                    f"   [警告] グループ {group_schema.__name__} の解析で有効な結果が得られませんでした。"
                 )
-                # 一つのグループで失敗しても処理を続行する
-                continue
+                return None
 
-            # APIのレート制限を避けるため、各グループの処理の間に短い待機時間を設ける
-            time.sleep(5)
+        except Exception as e:
+            print(
+                f"グループ {group_schema.__name__} の解析中にエラーが発生しました: {e}"
+            )
+            # 一つのグループで失敗しても処理を続行する
+            return None
 
-        if not final_result:
-            return {
-                "error": "患者情報の解析に失敗しました。",
-                "details": "どのグループからも有効な情報を抽出できませんでした。",
-            }
+    def _generate_with_gemini(self, prompt: str, group_schema: type[BaseModel]) -> tuple[BaseModel | None, int | None]:
+        """Gemini APIの構造化出力でグループを抽出する。(結果, APIが返したプロンプトのトークン数) を返す"""
+        generation_config = types.GenerateContentConfig(
+            response_mime_type="application/json",
+            response_schema=group_schema,
+        )
 
-        return final_result
+        # リトライ処理を追加
+        max_retries = 3
+        backoff_factor = 2  # 初回待機時間（秒）
+        response = None
+
+        for attempt in range(max_retries):
+            try:
+                # APIのレート制限を超えないよう、トークンバケットから1回分の枠を取得してから呼び出す
+                if self.rate_limiter:
+                    self.rate_limiter.acquire()
+                response = self.client.models.generate_content(
+                    model=self.model_name,
+                    contents=prompt,
+                    config=generation_config,
+                )
+                break  # 成功した場合はループを抜ける
+            except (ResourceExhausted, ServiceUnavailable) as e:
+                if attempt < max_retries - 1:
+                    wait_time = backoff_factor * (2**attempt)
+                    print(
+                        f"   [警告] APIレート制限またはサーバーエラー。{wait_time}秒後に再試行します... ({attempt + 1}/{max_retries})"
+                    )
+                    time.sleep(wait_time)
+                else:
+                    print(
+                        f"   [エラー] API呼び出しが{max_retries}回失敗しました。"
+                    )
+                    raise e  # 最終的に失敗した場合はエラーを再送出
+        # リトライ処理ここまで
+
+        if not response:
+            return None, None
+        usage = getattr(response, "usage_metadata", None)
+        return response.parsed, getattr(usage, "prompt_token_count", None)
+
+    def _generate_with_llm(self, prompt: str, group_schema: type[BaseModel]) -> BaseModel | None:
+        """
+        ローカルLLM (OllamaLLMなど) の構造化出力でグループを抽出する。
+        rag_components.llms のラッパーは失敗時に {"error": ...} を返すため、その場合は None とする。
+        """
+        if self.rate_limiter:
+            self.rate_limiter.acquire()
+        # スキーマ辞書は prompt_assembly で計算済みのものを渡し、呼び出しごとに生成し直さないようにする
+        result = self.llm.generate(prompt, response_schema=group_schema, schema_dict=get_schema_dict(group_schema))
+        if isinstance(result, dict):
+            print(f"   [エラー] ローカルLLMでの抽出に失敗しました: {result.get('error')}")
+            return None
+        return result
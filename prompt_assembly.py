@@ -0,0 +1,204 @@
+import json
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+from pydantic import BaseModel
+
+from schemas import GENERATION_GROUPS, PATIENT_INFO_EXTRACTION_GROUPS
+
+logger = logging.getLogger(__name__)
+
+# グループごとのJSONスキーマ (辞書・改行や空白を除いた文字列) のキャッシュ
+# model_json_schema() はグループの生成・抽出のたびに呼ぶと重いため、スキーマクラスごとに1回だけ計算する
+_schema_dict_cache: dict[type[BaseModel], dict] = {}
+_schema_json_cache: dict[type[BaseModel], str] = {}
+_schema_cache_lock = threading.Lock()
+
+
+def dumps_compact(obj) -> str:
+    """インデントや区切りの空白を省いたJSON文字列を返す (プロンプトのトークン数を減らすため)"""
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), default=str)
+
+
+def get_schema_dict(group_schema: type[BaseModel]) -> dict:
+    """グループのJSONスキーマ (辞書) を返す。呼び出し側で変更しないこと"""
+    schema = _schema_dict_cache.get(group_schema)
+    if schema is None:
+        with _schema_cache_lock:
+            schema = _schema_dict_cache.get(group_schema)
+            if schema is None:
+                schema = group_schema.model_json_schema()
+                _schema_json_cache[group_schema] = dumps_compact(schema)
+                _schema_dict_cache[group_schema] = schema
+    return schema
+
+
+def get_schema_json(group_schema: type[BaseModel]) -> str:
+    """グループのJSONスキーマを、空白を除いた文字列として返す"""
+    get_schema_dict(group_schema)
+    return _schema_json_cache[group_schema]
+
+
+def select_relevant_prior(
+    prior_results: dict,
+    group_schema: type[BaseModel],
+    dependencies: dict[type[BaseModel], list[type[BaseModel]]],
+) -> dict:
+    """
+    これまでの結果のうち、今回のグループに関係する項目だけを取り出す。
+
+    関係する項目は「依存するグループ (dependencies で指定) の項目」と「今回のグループ自身の項目」で、
+    値が null の項目は情報を持たないため除外する。
+    全ての結果をそのまま渡すと、後のグループほどプロンプトが長くなるため、その増加を抑える。
+    """
+    if not prior_results:
+        return {}
+    relevant_fields = set(group_schema.model_fields)
+    for dependency in dependencies.get(group_schema, []):
+        relevant_fields.update(dependency.model_fields)
+    return {key: value for key, value in prior_results.items() if key in relevant_fields and value is not None}
+
+
+def estimate_prompt_tokens(text: str) -> int:
+    """
+    プロンプトのトークン数を概算する。
+    モデルごとのトークナイザーを読み込まずに済むよう、日本語などの非ASCII文字は1文字1トークン、
+    ASCII文字は4文字1トークンとして数える。
+    """
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    return (len(text) - ascii_chars) + (ascii_chars + 3) // 4
+
+
+class PromptTokenStats:
+    """
+    グループごとのプロンプトのトークン数 (プレフィル量) を集計する。
+    estimated は estimate_prompt_tokens による概算、actual はAPI・Ollamaが返した実際の値 (取得できた場合のみ)。
+    Ollamaの場合は、実測のプレフィル秒数 (prompt_eval_duration) と、
+    PrefillBaselines で実測値どうしを比べて求めた、KVキャッシュの再利用で省けたトークン数・秒数も記録する。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats: dict[str, dict] = {}
+
+    def record(
+        self,
+        source: str,
+        group_name: str,
+        estimated: int,
+        actual: int | None = None,
+        prefill_seconds: float | None = None,
+        saved_tokens: int | None = None,
+        saved_prefill_seconds: float | None = None,
+    ):
+        """1回分のプロンプトのトークン数を記録する"""
+        key = f"{source}:{group_name}"
+        with self._lock:
+            entry = self._stats.setdefault(
+                key,
+                {
+                    "calls": 0,
+                    "estimated_total": 0,
+                    "actual_total": 0,
+                    "actual_calls": 0,
+                    "last_estimated": 0,
+                    "prefill_seconds_total": 0.0,
+                    "saved_tokens_total": 0,
+                    "saved_prefill_seconds_total": 0.0,
+                },
+            )
+            entry["calls"] += 1
+            entry["estimated_total"] += estimated
+            entry["last_estimated"] = estimated
+            if actual is not None:
+                entry["actual_total"] += actual
+                entry["actual_calls"] += 1
+            if prefill_seconds is not None:
+                entry["prefill_seconds_total"] += prefill_seconds
+            if saved_tokens is not None:
+                entry["saved_tokens_total"] += saved_tokens
+            if saved_prefill_seconds is not None:
+                entry["saved_prefill_seconds_total"] += saved_prefill_seconds
+        message = f"Prompt tokens [{key}]: estimated={estimated}"
+        if actual is not None:
+            message += f", actual={actual}"
+        if prefill_seconds is not None:
+            message += f", prefill={prefill_seconds:.2f}s"
+        if saved_tokens is not None and saved_prefill_seconds is not None:
+            message += f", saved_by_cache={saved_tokens} tokens/{saved_prefill_seconds:.2f}s"
+        logger.info(message)
+
+    def snapshot(self) -> dict:
+        """グループごとの集計値 (平均を含む) を返す"""
+        with self._lock:
+            result = {}
+            for key, entry in self._stats.items():
+                result[key] = dict(entry)
+                result[key]["estimated_avg"] = entry["estimated_total"] / entry["calls"]
+                if entry["actual_calls"]:
+                    result[key]["actual_avg"] = entry["actual_total"] / entry["actual_calls"]
+            return result
+
+    def clear(self):
+        with self._lock:
+            self._stats.clear()
+
+
+class PrefillBaselines:
+    """
+    共通部分 (システムプロンプト・患者データ) ごとに、最初に実測したプレフィル (キャッシュなし) を基準として保持し、
+    以降のグループで KVキャッシュの再利用により省けたトークン数・秒数を、実測値どうしの差から求める。
+
+    - 基準: その共通部分で最初に完了したグループの prompt_eval_count / prompt_eval_duration。
+    - 省けたトークン数: 基準の prompt_eval_count - 今回の prompt_eval_count (0未満は0)。
+    - 省けた秒数: 省けたトークン数 x 基準の1トークンあたりのプレフィル秒数。
+    グループ固有部分の長さの違いも差に含まれるため、固有部分が基準より長いグループでは少なめに出る。
+    """
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._baselines: OrderedDict[str, tuple[int, int]] = OrderedDict()
+
+    @staticmethod
+    def make_key(model_name: str, shared_messages: list[dict]) -> str:
+        """モデル名と共通部分のメッセージから基準のキーを作る"""
+        payload = json.dumps([model_name, shared_messages], ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def measure(self, key: str, evaluated: int | None, duration_ns: int | None) -> tuple[float | None, int | None, float | None]:
+        """
+        Returns:
+            tuple: (実測のプレフィル秒数, 省けたトークン数, 省けた秒数)。
+                実測値がない場合は全て None、基準になった (最初の) 呼び出しでは省けた分は 0。
+        """
+        if not evaluated or not duration_ns:
+            return None, None, None
+        prefill_seconds = duration_ns / 1e9
+        with self._lock:
+            baseline = self._baselines.get(key)
+            if baseline is None:
+                self._baselines[key] = (evaluated, duration_ns)
+                while len(self._baselines) > self.max_entries:
+                    self._baselines.popitem(last=False)
+                return prefill_seconds, 0, 0.0
+            self._baselines.move_to_end(key)
+        baseline_evaluated, baseline_duration_ns = baseline
+        saved_tokens = max(0, baseline_evaluated - evaluated)
+        return prefill_seconds, saved_tokens, saved_tokens * (baseline_duration_ns / 1e9) / baseline_evaluated
+
+
+prompt_token_stats = PromptTokenStats()
+prefill_baselines = PrefillBaselines()
+
+
+def get_prompt_token_stats() -> dict:
+    """プロセス全体で集計した、グループごとのプロンプトのトークン数を返す"""
+    return prompt_token_stats.snapshot()
+
+
+# 既知のグループのスキーマは、インポート時にまとめて計算しておく
+for _group_schema in (*PATIENT_INFO_EXTRACTION_GROUPS, *GENERATION_GROUPS):
+    get_schema_dict(_group_schema)
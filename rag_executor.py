@@ -2,11 +2,13 @@ import yaml
 import sys
 import os
 import json
+import time
 import importlib
 
 # gemini_client.pyで定義されている、アプリケーション本体のデータ構造スキーマをインポート
 # from gemini_client import RehabPlanSchema # 循環参照が発生してしまいます。
 from schemas import RehabPlanSchema
+from rag_result_cache import get_default_result_cache, hash_file, fingerprint_paths
 import logging
 
 # Rehab_RAGライブラリへのパスを追加
@@ -14,6 +16,9 @@ REHAB_RAG_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), "Rehab_
 if REHAB_RAG_PATH not in sys.path:
     sys.path.append(REHAB_RAG_PATH)
 
+from rag_components.caches.stage_cache import get_stage_cache_stats
+from rag_components.caches.model_registry import get_model_registry_stats
+
 log_directory = "logs"
 if not os.path.exists(log_directory):
     os.makedirs(log_directory)
@@ -30,6 +35,10 @@ if not logger.hasHandlers():  # ハンドラが未設定の場合のみ設定
     logger.addHandler(file_handler)
 
 
+# ウォームアップ (モデルの初回推論・キャッシュの準備) に使うダミーの検索クエリ
+WARM_UP_QUERY = "脳梗塞後の右片麻痺に対する歩行訓練とADL指導"
+
+
 def get_instance(module_name, class_name, params={}):
     """モジュール名とクラス名からインスタンスを動的に生成するヘルパー関数"""
     try:
@@ -46,12 +55,14 @@ class RAGExecutor:
     rag_config.yamlに基づいてRAGパイプラインを動的に構築し、実行するクラス。
     """
 
-    def __init__(self, pipeline_name: str):
+    def __init__(self, pipeline_name: str, result_cache=None):
         """
         コンストラクタ。実行するパイプライン名を直接引数で受け取るように変更。
 
         Args:
             pipeline_name (str): 実行対象の実験フォルダ名 (例: "raptor_experiment")
+            result_cache (RAGResultCache | None): 実行結果のキャッシュ。
+                省略した場合はプロセス共有のキャッシュを使用する (RAG_RESULT_CACHE_ENABLED=false で無効)。
         """
         # 1. & 2. パイプライン設定の読み込み
         if not pipeline_name:
@@ -70,6 +81,14 @@ class RAGExecutor:
         # 実行中のパイプラインのディレクトリを基準パスとして保持
         self.experiment_dir = os.path.dirname(pipeline_config_path)
 
+        # 結果キャッシュのキーに使用する情報
+        self.pipeline_name = pipeline_name
+        self.config_hash = hash_file(pipeline_config_path)
+        self.index_paths = []  # 検索インデックスのパス (インデックスのバージョン判定に使用)
+        self.result_cache = (
+            result_cache if result_cache is not None else get_default_result_cache()
+        )
+
         # 3. RAGパイプラインのコンポーネントを初期化
         self.components = {}
         if "common_components" in self.pipeline_config:
@@ -184,6 +203,10 @@ class RAGExecutor:
                             "database", {}
                         ).get("collection_name")
 
+                for path_key in ["path", "db_path", "bm25_path"]:
+                    if isinstance(params.get(path_key), str):
+                        self.index_paths.append(params[path_key])
+
                 for key, value in params.items():
                     if isinstance(value, str) and value.startswith(
                         "@common_components."
@@ -220,7 +243,104 @@ class RAGExecutor:
 計画書:
 """
 
-    def execute(self, patient_facts: dict):
+    def index_version(self) -> str:
+        """
+        検索インデックスのバージョンを返す。
+        config.yamlに 'index_version' が明示されていればそれを使い、なければインデックスファイルの指紋を使う。
+        """
+        explicit_version = self.pipeline_config.get("index_version")
+        if explicit_version:
+            return str(explicit_version)
+        return fingerprint_paths(self.index_paths)
+
+    def get_cache_stats(self) -> dict:
+        """
+        結果キャッシュと、各ステージ (HyDE, クエリのベクトル化, リランキング) のキャッシュのヒット・ミス件数、
+        共有しているモデルのメモリ使用量を返す。
+        """
+        return {
+            "result_cache": self.result_cache.stats() if self.result_cache is not None else None,
+            "stages": get_stage_cache_stats(),
+            "models": get_model_registry_stats(),
+        }
+
+    def close(self):
+        """
+        各コンポーネントが共有しているモデルへの参照を解放する。
+        他のパイプラインが使っていないモデルは、モデルレジストリによって解放される。
+        """
+        for component in [*self.components.values(), *self.filters]:
+            if hasattr(component, "close"):
+                component.close()
+
+    def warm_up(self, query: str = WARM_UP_QUERY) -> dict:
+        """
+        ダミーのクエリで検索・リランキング・フィルタリングを1回実行し、
+        埋め込みモデル・CrossEncoder・NLIモデルの初回推論にかかる時間を、最初の利用者が待たなくて済むようにする。
+        LLM (APIや生成モデル) を呼び出すステージ (HyDE, 自己評価フィルタなど) は実行しない。
+
+        Returns:
+            dict: ステージ名をキー、かかった秒数を値とする辞書。
+        """
+        timings = {}
+        docs, metadatas = [], []
+        if self.retriever:
+            start_time = time.perf_counter()
+            results = self.retriever.retrieve(query, n_results=5)
+            timings["retriever"] = time.perf_counter() - start_time
+            if results and results.get("documents") and results["documents"][0]:
+                docs = results["documents"][0]
+                metadatas = results["metadatas"][0]
+
+        if self.reranker and docs:
+            start_time = time.perf_counter()
+            docs, metadatas = self.reranker.rerank(query, docs, metadatas)
+            timings["reranker"] = time.perf_counter() - start_time
+
+        for f in self.filters:
+            if getattr(f, "llm", None) is not None or not docs:
+                continue
+            start_time = time.perf_counter()
+            f.filter(query, docs[:2], metadatas[:2])
+            timings[type(f).__name__] = time.perf_counter() - start_time
+
+        print(f"'{self.pipeline_name}' のウォームアップが完了しました: " + ", ".join(f"{k}={v:.2f}s" for k, v in timings.items()))
+        return timings
+
+    def execute(self, patient_facts: dict, use_cache: bool = True):
+        """
+        RAGパイプラインを実行する。
+        同じ患者情報・設定・インデックスでの実行結果がキャッシュにあれば、パイプラインを実行せずにそれを返す。
+
+        Args:
+            patient_facts (dict): 整形済みの患者情報。
+            use_cache (bool): Falseの場合はキャッシュを参照せずに再実行する (結果は上書き保存される)。
+        """
+        cache_key = None
+        if self.result_cache is not None:
+            cache_key = self.result_cache.make_key(
+                patient_facts, self.pipeline_name, self.config_hash, self.index_version()
+            )
+            if use_cache:
+                cached_result = self.result_cache.get(cache_key)
+                if cached_result is not None:
+                    print(f"'{self.pipeline_name}' の実行結果をキャッシュから返します。")
+                    logger.info(f"RAG result cache hit: {self.pipeline_name} ({cache_key[:12]})")
+                    return cached_result
+
+        result = self._execute_pipeline(patient_facts)
+
+        # エラーでない完全な結果のみをキャッシュする
+        if (
+            cache_key is not None
+            and isinstance(result, dict)
+            and isinstance(result.get("answer"), dict)
+            and "error" not in result["answer"]
+        ):
+            self.result_cache.set(cache_key, result)
+        return result
+
+    def _execute_pipeline(self, patient_facts: dict):
         print(
             f"DEBUG [rag_executor.py]: '担当者からの所見' received = {patient_facts.get('担当者からの所見')}"
         )
@@ -263,24 +383,38 @@ class RAGExecutor:
         # 検索
         print("関連文書検索中")
         all_docs = {}
-        if self.retriever:
+        if self.retriever and hasattr(self.retriever, "retrieve_many"):
+            # 全クエリをまとめてベクトル化・検索し、重複はリトリーバー側で除外する
+            if len(search_queries) > 1:
+                print(f"  - {len(search_queries)}件のクエリでまとめて検索")
+            results_list = [self.retriever.retrieve_many(search_queries, n_results=20)]
+        elif self.retriever:
+            results_list = []
             for q in search_queries:
                 if len(search_queries) > 1:
                     print(f"  - クエリ '{q}' で検索")
-                results = self.retriever.retrieve(q, n_results=20)
-                if results and results.get("documents") and results["documents"][0]:
-                    for i, doc_text in enumerate(results["documents"][0]):
-                        if doc_text not in all_docs:
-                            all_docs[doc_text] = results["metadatas"][0][i]
+                results_list.append(self.retriever.retrieve(q, n_results=20))
+        else:
+            results_list = []
+
+        for results in results_list:
+            if results and results.get("documents") and results["documents"][0]:
+                for i, doc_text in enumerate(results["documents"][0]):
+                    if doc_text not in all_docs:
+                        all_docs[doc_text] = results["metadatas"][0][i]
 
         docs = list(all_docs.keys())
         metadatas = list(all_docs.values())
         print(f"  - 合計で {len(docs)}件のユニークな文書を取得しました。")
 
         # リランキング(関連度を判断させ並び替える)
+        rerank_scores = {}  # 文書 -> リランキングスコア (フィルタ後も対応が取れるよう文書をキーにする)
         if self.reranker and docs:
             print("検索結果をリランキング開始")
-            docs, metadatas = self.reranker.rerank(query_for_retrieval, docs, metadatas)
+            docs, metadatas, scores = self.reranker.rerank(
+                query_for_retrieval, docs, metadatas, return_scores=True
+            )
+            rerank_scores = dict(zip(docs, scores))
             print("リランキング終了")
         else:
             print("リランキングはしません。")
@@ -326,6 +460,7 @@ class RAGExecutor:
                 {
                     "content": final_docs[i],
                     "metadata": final_metadatas[i] if i < len(final_metadatas) else {},
+                    "rerank_score": rerank_scores.get(final_docs[i]),
                 }
             )
 
@@ -0,0 +1,273 @@
+import os
+import gc
+import time
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# 同時にメモリへ保持するRAGパイプライン (RAGExecutor) の上限
+RAG_EXECUTOR_POOL_SIZE = int(os.getenv("RAG_EXECUTOR_POOL_SIZE", "2"))
+# この秒数使われなかったパイプラインは解放する (0以下の場合は解放しない)
+RAG_EXECUTOR_IDLE_TIMEOUT_SECONDS = int(os.getenv("RAG_EXECUTOR_IDLE_TIMEOUT_SECONDS", "3600"))
+# 利用を許可するパイプライン (カンマ区切り)。未設定の場合は experiments 以下の config.yaml を持つフォルダすべて
+RAG_ALLOWED_PIPELINES = os.getenv("RAG_ALLOWED_PIPELINES", "")
+RAG_EXPERIMENTS_DIR = os.path.join("Rehab_RAG", "experiments")
+
+
+class PipelineNotAllowedError(ValueError):
+    """許可リストにないパイプラインが要求された場合のエラー"""
+
+
+def discover_pipelines(experiments_dir: str = RAG_EXPERIMENTS_DIR) -> list[str]:
+    """config.yaml を持つ実験フォルダの一覧を返す"""
+    if not os.path.isdir(experiments_dir):
+        return []
+    return sorted(
+        name
+        for name in os.listdir(experiments_dir)
+        if os.path.isfile(os.path.join(experiments_dir, name, "config.yaml"))
+    )
+
+
+def get_allowed_pipelines() -> list[str]:
+    """環境変数 RAG_ALLOWED_PIPELINES、未設定の場合は実験フォルダから、利用を許可するパイプラインを返す"""
+    names = [name.strip() for name in RAG_ALLOWED_PIPELINES.split(",") if name.strip()]
+    return names or discover_pipelines()
+
+
+class _PoolEntry:
+    def __init__(self, executor, load_seconds: float):
+        self.executor = executor
+        self.load_seconds = load_seconds
+        self.last_used = time.monotonic()
+        self.in_use = 0
+        self.evicted = False
+
+
+class RAGExecutorPool:
+    """
+    RAGExecutor をパイプライン名ごとに保持するプール。
+
+    - 保持数が max_size を超えた場合は、最も長く使われていないパイプラインを解放する (LRU)。
+    - idle_timeout_seconds の間使われなかったパイプラインも解放する (pinned に指定したものを除く)。
+    - 解放時は executor.close() でモデル・ChromaDBクライアントへの参照を返し、メモリを回収する。
+      利用中 (lease中) のパイプラインは、利用が終わった時点で解放する。
+    - allowed_pipelines にないパイプラインは読み込まない。
+    """
+
+    def __init__(
+        self,
+        factory,
+        max_size: int = RAG_EXECUTOR_POOL_SIZE,
+        idle_timeout_seconds: float = RAG_EXECUTOR_IDLE_TIMEOUT_SECONDS,
+        allowed_pipelines=None,
+        pinned=(),
+        on_load=None,
+    ):
+        """
+        Args:
+            factory: パイプライン名を受け取り、RAGExecutor を作成する関数。
+            max_size (int): 同時に保持するパイプラインの上限。
+            idle_timeout_seconds (float): この秒数使われなかったパイプラインを解放する。0以下の場合は解放しない。
+            allowed_pipelines (list[str] | None): 利用を許可するパイプライン。None の場合は制限しない。
+            pinned (list[str]): アイドル時間で解放しないパイプライン (起動時に事前読み込みするものなど)。
+            on_load: 新しく読み込んだ時に (パイプライン名, 読み込み秒数) で呼び出される関数。
+        """
+        self.factory = factory
+        self.max_size = max(1, max_size)
+        self.idle_timeout_seconds = idle_timeout_seconds if idle_timeout_seconds and idle_timeout_seconds > 0 else None
+        self.allowed_pipelines = set(allowed_pipelines) if allowed_pipelines is not None else None
+        self.pinned = set(pinned)
+        self.on_load = on_load
+        self._entries: OrderedDict[str, _PoolEntry] = OrderedDict()
+        self._lock = threading.Lock()
+        # 読み込みには数分かかることがあるため、同じパイプラインの読み込みだけを直列化する
+        self._loading_locks: dict[str, threading.Lock] = {}
+        self._janitor = None
+        self.hits = 0
+        self.loads = 0
+        self.rejected = 0
+        self.evictions = {"lru": 0, "idle": 0, "cleared": 0}
+
+    def is_allowed(self, pipeline_name: str) -> bool:
+        return self.allowed_pipelines is None or pipeline_name in self.allowed_pipelines
+
+    def get(self, pipeline_name: str):
+        """パイプラインの RAGExecutor を返す。保持していなければ読み込む"""
+        with self.lease(pipeline_name) as executor:
+            return executor
+
+    @contextmanager
+    def lease(self, pipeline_name: str):
+        """
+        パイプラインの RAGExecutor を、利用中として取得する。
+        with ブロックを抜けるまでは、LRU・アイドル時間による解放の対象になっても close() されない。
+        """
+        entry = self._acquire(pipeline_name)
+        try:
+            yield entry.executor
+        finally:
+            self._release(entry)
+
+    def _acquire(self, pipeline_name: str) -> _PoolEntry:
+        if not self.is_allowed(pipeline_name):
+            with self._lock:
+                self.rejected += 1
+            raise PipelineNotAllowedError(f"パイプライン '{pipeline_name}' は利用が許可されていません。")
+
+        self._start_janitor()
+        with self._lock:
+            entry = self._take(pipeline_name)
+            if entry is not None:
+                return entry
+            loading_lock = self._loading_locks.setdefault(pipeline_name, threading.Lock())
+
+        with loading_lock:
+            with self._lock:
+                entry = self._take(pipeline_name)
+                if entry is not None:
+                    return entry
+
+            print(f"'{pipeline_name}' のExecutorを新規に初期化します...")
+            start_time = time.perf_counter()
+            executor = self.factory(pipeline_name)
+            load_seconds = time.perf_counter() - start_time
+
+            with self._lock:
+                entry = _PoolEntry(executor, load_seconds)
+                entry.in_use = 1
+                self._entries[pipeline_name] = entry
+                self.loads += 1
+                self._loading_locks.pop(pipeline_name, None)
+                to_close = self._evict_lru()
+            print(f"'{pipeline_name}' の初期化が完了しました ({load_seconds:.1f}秒)。")
+
+        self._close_all(to_close)
+        if self.on_load is not None:
+            self.on_load(pipeline_name, load_seconds)
+        return entry
+
+    def _take(self, pipeline_name: str):
+        """ロック取得済みの状態で呼び出す。保持していれば利用中にして返す"""
+        entry = self._entries.get(pipeline_name)
+        if entry is None:
+            return None
+        self._entries.move_to_end(pipeline_name)
+        entry.in_use += 1
+        entry.last_used = time.monotonic()
+        self.hits += 1
+        return entry
+
+    def _release(self, entry: _PoolEntry):
+        with self._lock:
+            entry.in_use -= 1
+            entry.last_used = time.monotonic()
+            close_now = entry.evicted and entry.in_use == 0
+        if close_now:
+            self._close_all([entry])
+
+    def _evict_lru(self) -> list[_PoolEntry]:
+        """ロック取得済みの状態で呼び出す。上限を超えた分を古い順に取り除き、close() すべきものを返す"""
+        to_close = []
+        # 最後 (読み込んだばかり) のパイプラインは取り除かない
+        for name in list(self._entries)[:-1]:
+            if len(self._entries) <= self.max_size:
+                break
+            to_close += self._remove(name, "lru")
+        return to_close
+
+    def _remove(self, name: str, reason: str) -> list[_PoolEntry]:
+        entry = self._entries.pop(name)
+        entry.evicted = True
+        self.evictions[reason] += 1
+        print(f"RAGパイプライン '{name}' を解放します (理由: {reason})")
+        # 利用中の場合は、利用が終わった時点で close() する
+        return [entry] if entry.in_use == 0 else []
+
+    def evict_idle(self) -> int:
+        """アイドル時間を超えたパイプラインを解放し、その数を返す"""
+        if self.idle_timeout_seconds is None:
+            return 0
+        now = time.monotonic()
+        with self._lock:
+            expired = [
+                name
+                for name, entry in self._entries.items()
+                if name not in self.pinned
+                and entry.in_use == 0
+                and now - entry.last_used >= self.idle_timeout_seconds
+            ]
+            to_close = []
+            for name in expired:
+                to_close += self._remove(name, "idle")
+        self._close_all(to_close)
+        return len(expired)
+
+    def clear(self):
+        """全てのパイプラインを解放する"""
+        with self._lock:
+            to_close = []
+            for name in list(self._entries):
+                to_close += self._remove(name, "cleared")
+        self._close_all(to_close)
+
+    def _close_all(self, entries: list[_PoolEntry]):
+        for entry in entries:
+            try:
+                if hasattr(entry.executor, "close"):
+                    entry.executor.close()
+            except Exception as e:
+                print(f"   [警告] RAGパイプラインの解放中にエラーが発生しました: {e}")
+            entry.executor = None
+        if entries:
+            # モデルの参照が切れた時点でメモリを回収する
+            gc.collect()
+
+    def _start_janitor(self):
+        """アイドル時間による解放を定期的に行うスレッドを開始する"""
+        if self.idle_timeout_seconds is None or self._janitor is not None:
+            return
+        with self._lock:
+            if self._janitor is not None:
+                return
+            self._janitor = threading.Thread(target=self._janitor_loop, name="rag-executor-pool-janitor", daemon=True)
+            self._janitor.start()
+
+    def _janitor_loop(self):
+        interval = min(60.0, self.idle_timeout_seconds / 2)
+        while True:
+            time.sleep(interval)
+            self.evict_idle()
+
+    def cache_stats(self) -> dict:
+        """保持している各パイプラインの、結果キャッシュ・ステージキャッシュのヒット率などを返す"""
+        with self._lock:
+            executors = {name: entry.executor for name, entry in self._entries.items()}
+        return {
+            name: executor.get_cache_stats()
+            for name, executor in executors.items()
+            if hasattr(executor, "get_cache_stats")
+        }
+
+    def stats(self) -> dict:
+        """プールの使用状況を返す"""
+        now = time.monotonic()
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "idle_timeout_seconds": self.idle_timeout_seconds,
+                "hits": self.hits,
+                "loads": self.loads,
+                "rejected": self.rejected,
+                "evictions": dict(self.evictions),
+                "pipelines": {
+                    name: {
+                        "in_use": entry.in_use,
+                        "idle_seconds": now - entry.last_used,
+                        "load_seconds": entry.load_seconds,
+                        "pinned": name in self.pinned,
+                    }
+                    for name, entry in self._entries.items()
+                },
+            }
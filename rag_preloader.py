@@ -0,0 +1,86 @@
+import os
+import threading
+import time
+
+# 起動時に読み込んでおくRAGパイプライン (カンマ区切り)。空にすると事前読み込みを行わない
+# 既定値は、確認画面 (confirm.html) から呼び出されるパイプライン
+RAG_PRELOAD_PIPELINES = [
+    name.strip()
+    for name in os.getenv("RAG_PRELOAD_PIPELINES", "hybrid_search_experiment").split(",")
+    if name.strip()
+]
+# 読み込み後にダミーのクエリで各モデルを1回実行しておくかどうか
+RAG_PRELOAD_WARM_UP = os.getenv("RAG_PRELOAD_WARM_UP", "true").lower() == "true"
+
+
+class RAGPreloader:
+    """
+    RAGExecutor の初期化 (埋め込みモデル・CrossEncoder・NLIモデル・ChromaDBの読み込み) を、
+    最初のリクエストではなくプロセス起動時にバックグラウンドスレッドで行う。
+    パイプラインごとの状態と読み込み時間を保持し、/healthz/ready と /admin/metrics から参照できるようにする。
+    """
+
+    def __init__(self, get_executor, pipeline_names=None, warm_up: bool = RAG_PRELOAD_WARM_UP):
+        """
+        Args:
+            get_executor: パイプライン名を受け取り、RAGExecutor を返す関数 (app.get_rag_executor)。
+            pipeline_names (list[str] | None): 事前に読み込むパイプライン。省略時は RAG_PRELOAD_PIPELINES。
+            warm_up (bool): 読み込み後に executor.warm_up() を実行するかどうか。
+        """
+        self.get_executor = get_executor
+        self.pipeline_names = list(RAG_PRELOAD_PIPELINES if pipeline_names is None else pipeline_names)
+        self.warm_up = warm_up
+        self.thread = None
+        self._lock = threading.Lock()
+        self._status = {name: {"state": "pending"} for name in self.pipeline_names}
+
+    def start(self) -> threading.Thread | None:
+        """バックグラウンドで事前読み込みを開始する。対象がない場合は何もしない"""
+        if not self.pipeline_names or self.thread is not None:
+            return self.thread
+        self.thread = threading.Thread(target=self.run, name="rag-preloader", daemon=True)
+        self.thread.start()
+        return self.thread
+
+    def run(self):
+        """対象のパイプラインを順番に読み込む (モデルの読み込みでメモリを奪い合わないよう、並列にはしない)"""
+        for name in self.pipeline_names:
+            print(f"--- RAGパイプライン '{name}' を事前に読み込みます ---")
+            self._update(name, state="loading")
+            start_time = time.perf_counter()
+            try:
+                executor = self.get_executor(name)
+            except Exception as e:
+                print(f"   [エラー] RAGパイプライン '{name}' の事前読み込みに失敗しました: {e}")
+                self._update(name, state="failed", error=str(e), load_seconds=time.perf_counter() - start_time)
+                continue
+            self._update(name, load_seconds=time.perf_counter() - start_time)
+
+            if self.warm_up and hasattr(executor, "warm_up"):
+                self._update(name, state="warming_up")
+                start_time = time.perf_counter()
+                try:
+                    executor.warm_up()
+                except Exception as e:
+                    # ウォームアップに失敗しても、パイプライン自体は利用できるため ready とする
+                    print(f"   [警告] RAGパイプライン '{name}' のウォームアップに失敗しました: {e}")
+                    self._update(name, warm_up_error=str(e))
+                self._update(name, warm_up_seconds=time.perf_counter() - start_time)
+            self._update(name, state="ready")
+
+    def record_loaded(self, name: str, load_seconds: float):
+        """事前読み込みの対象外のパイプラインが、リクエスト時に読み込まれたことを記録する"""
+        with self._lock:
+            if name not in self._status:
+                self._status[name] = {"state": "ready", "load_seconds": load_seconds, "preloaded": False}
+
+    def _update(self, name: str, **values):
+        with self._lock:
+            self._status.setdefault(name, {}).update(values)
+
+    def status(self) -> dict:
+        """パイプラインごとの状態と、事前読み込みの対象がすべて ready かどうかを返す"""
+        with self._lock:
+            pipelines = {name: dict(values) for name, values in self._status.items()}
+        ready = all(pipelines[name].get("state") == "ready" for name in self.pipeline_names)
+        return {"ready": ready, "pipelines": pipelines}
@@ -0,0 +1,150 @@
+import os
+import json
+import hashlib
+import logging
+import threading
+
+import diskcache
+
+logger = logging.getLogger(__name__)
+
+# 環境変数でキャッシュの挙動を調整できるようにする
+RAG_RESULT_CACHE_ENABLED = os.getenv("RAG_RESULT_CACHE_ENABLED", "true").lower() == "true"
+RAG_RESULT_CACHE_DIR = os.getenv("RAG_RESULT_CACHE_DIR", os.path.join("cache", "rag_results"))
+# 結果の有効期限 (秒)。ガイドラインやプロンプトの更新はキーに含まれるため、長めに設定している
+RAG_RESULT_CACHE_TTL_SECONDS = int(os.getenv("RAG_RESULT_CACHE_TTL_SECONDS", str(7 * 24 * 60 * 60)))
+# ディスク使用量の上限 (MB)。超過した場合は最も長く使われていない結果から削除される
+RAG_RESULT_CACHE_SIZE_LIMIT_MB = int(os.getenv("RAG_RESULT_CACHE_SIZE_LIMIT_MB", "256"))
+
+
+def hash_file(path: str) -> str:
+    """ファイル内容のSHA-256ハッシュを返す"""
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def fingerprint_paths(paths) -> str:
+    """
+    インデックス (ChromaDB, BM25など) のディレクトリ・ファイルから、内容が変わったことを検知するための指紋を作る。
+    ファイル全体を読むと重いため、相対パス・サイズ・更新時刻から計算する。
+    """
+    sha = hashlib.sha256()
+    for path in sorted(set(p for p in paths if p)):
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    file_path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(file_path)
+                    except OSError:
+                        continue
+                    rel_path = os.path.relpath(file_path, path)
+                    sha.update(f"{path}|{rel_path}|{stat.st_size}|{stat.st_mtime_ns}\n".encode("utf-8"))
+        elif os.path.exists(path):
+            stat = os.stat(path)
+            sha.update(f"{path}|{stat.st_size}|{stat.st_mtime_ns}\n".encode("utf-8"))
+        else:
+            sha.update(f"{path}|missing\n".encode("utf-8"))
+    return sha.hexdigest()
+
+
+class RAGResultCache:
+    """
+    RAGExecutor.execute の結果を、入力内容から計算したキーでディスクに保存するキャッシュ。
+
+    キーは「患者情報(JSON)・パイプライン名・設定ファイルのハッシュ・インデックスのバージョン」から作るため、
+    同じ患者・同じ所見で再度生成した場合は、パイプライン全体を再実行せずに結果を返せる。
+    設定ファイルやインデックスが更新された場合はキーが変わるため、古い結果が使われることはない。
+    """
+
+    def __init__(
+        self,
+        directory: str = RAG_RESULT_CACHE_DIR,
+        ttl_seconds: int = RAG_RESULT_CACHE_TTL_SECONDS,
+        size_limit_mb: int = RAG_RESULT_CACHE_SIZE_LIMIT_MB,
+    ):
+        """
+        Args:
+            directory (str): キャッシュを保存するディレクトリ。
+            ttl_seconds (int): 結果の有効期限 (秒)。0以下の場合は期限なし。
+            size_limit_mb (int): ディスク使用量の上限 (MB)。超過時はLRUで削除される。
+        """
+        self.ttl_seconds = ttl_seconds if ttl_seconds and ttl_seconds > 0 else None
+        self.cache = diskcache.Cache(
+            directory,
+            size_limit=size_limit_mb * 1024 * 1024,
+            eviction_policy="least-recently-used",
+        )
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(patient_facts: dict, pipeline_name: str, config_hash: str, index_version: str) -> str:
+        """キャッシュキーを作成する。辞書のキー順に依存しないよう、sort_keys で正規化してからハッシュ化する"""
+        facts_json = json.dumps(patient_facts, ensure_ascii=False, sort_keys=True, default=str)
+        payload = json.dumps(
+            {
+                "facts_sha256": hashlib.sha256(facts_json.encode("utf-8")).hexdigest(),
+                "pipeline": pipeline_name,
+                "config": config_hash,
+                "index": index_version,
+            },
+            sort_keys=True,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str):
+        """キャッシュから結果を取得する。存在しない場合は None を返す"""
+        try:
+            result = self.cache.get(key)
+        except Exception as e:
+            # キャッシュの破損などで生成自体が止まらないよう、エラーはミス扱いにする
+            logger.warning(f"RAG結果キャッシュの読み込みに失敗しました: {e}")
+            result = None
+        if result is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return result
+
+    def set(self, key: str, result: dict):
+        """結果をキャッシュに保存する"""
+        try:
+            self.cache.set(key, result, expire=self.ttl_seconds)
+        except Exception as e:
+            logger.warning(f"RAG結果キャッシュへの保存に失敗しました: {e}")
+
+    def clear(self):
+        """キャッシュを全て削除する"""
+        self.cache.clear()
+
+    def stats(self) -> dict:
+        """ヒット・ミス件数と現在の件数・使用量を返す"""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self.cache),
+            "size_bytes": self.cache.volume(),
+        }
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_default_result_cache():
+    """
+    プロセス全体で共有するキャッシュを返す。
+    RAG_RESULT_CACHE_ENABLED が false の場合は None を返す。
+    """
+    global _default_cache
+    if not RAG_RESULT_CACHE_ENABLED:
+        return None
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = RAGResultCache()
+    return _default_cache
@@ -186,6 +186,15 @@ GENERATION_GROUPS = [
     ComprehensiveTreatmentPlan,  # ステップ3: 包括的な治療計画
 ]
 
+# 各グループが生成時に参照する必要のある先行グループ (依存関係)
+# プロンプトには、ここに挙げたグループの生成結果だけを含める。
+# 目標は現状評価 (リスク・機能障害) を踏まえて設定し、治療計画は両方の結果を踏まえて作成する。
+GENERATION_GROUP_DEPENDENCIES = {
+    CurrentAssessment: [],
+    Goals: [CurrentAssessment],
+    ComprehensiveTreatmentPlan: [CurrentAssessment, Goals],
+}
+
 
 class PatientMasterSchema(BaseModel):
     """カルテの自由記述テキストから抽出した患者マスタ情報。可能な限り全ての項目を埋めてください。不明な項目はnullにしてください。"""
@@ -2452,3 +2461,22 @@ PATIENT_INFO_EXTRACTION_GROUPS = [
     PatientInfo_Goal_HumanFactors,
     # 今後の拡張のために他のグループもここに追加可能
 ]
+
+# 各抽出グループが参照する必要のある先行グループ (依存関係)
+# 依存関係のないグループ同士は並列に抽出できる。
+# 目標系のグループは、対応する現状評価 (基本動作・ADL・認知・社会保障) の抽出結果を参考にする。
+PATIENT_INFO_EXTRACTION_GROUP_DEPENDENCIES = {
+    PatientInfo_Basic: [],
+    PatientInfo_Function_General: [],
+    PatientInfo_Function_Motor: [],
+    PatientInfo_Function_Cognitive: [],
+    PatientInfo_BasicMovements: [],
+    PatientInfo_ADL: [],
+    PatientInfo_Social: [],
+    PatientInfo_Nutrition: [],
+    PatientInfo_Goals: [PatientInfo_Basic],
+    PatientInfo_Goal_Activity: [PatientInfo_BasicMovements, PatientInfo_ADL],
+    PatientInfo_Goal_Psychological: [PatientInfo_Function_Cognitive],
+    PatientInfo_Goal_Environment: [PatientInfo_Social],
+    PatientInfo_Goal_HumanFactors: [PatientInfo_Social],
+}
@@ -0,0 +1,53 @@
+# test_batch_results.py
+
+import os
+import sys
+import unittest
+
+# Rehab_RAGライブラリへのパスを追加
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "Rehab_RAG"))
+from rag_components.retrievers.batch_results import (
+    merge_query_results,
+    select_query_results,
+    stack_query_results,
+)
+
+# ChromaDBの query(query_embeddings=[q1, q2]) と同じ形式の結果
+MULTI_QUERY_RESULTS = {
+    "ids": [["a", "b", "c"], ["b", "d", "a"]],
+    "documents": [["文書A", "文書B", "文書C"], ["文書B", "文書D", "文書A"]],
+    "metadatas": [[{"n": "a"}, {"n": "b"}, {"n": "c"}], [{"n": "b"}, {"n": "d"}, {"n": "a"}]],
+    "distances": [[0.1, 0.2, 0.3], [0.15, 0.25, 0.35]],
+    "embeddings": None,
+}
+
+
+class TestBatchResults(unittest.TestCase):
+
+    def test_merge_keeps_first_occurrence_in_query_order(self):
+        """クエリ順・順位順に並び、重複した文書は最初の出現だけが残ることを確認 (従来のクエリごとのループと同じ順序)"""
+        merged = merge_query_results(MULTI_QUERY_RESULTS)
+        self.assertEqual(merged["documents"], [["文書A", "文書B", "文書C", "文書D"]])
+        self.assertEqual(merged["ids"], [["a", "b", "c", "d"]])
+        self.assertEqual(merged["distances"], [[0.1, 0.2, 0.3, 0.25]])
+        self.assertNotIn("embeddings", merged)
+
+    def test_select_and_stack_round_trip(self):
+        """クエリごとの結果を取り出して再びまとめると元に戻ることを確認"""
+        per_query = [select_query_results(MULTI_QUERY_RESULTS, i) for i in range(2)]
+        self.assertEqual(per_query[1]["documents"], [["文書B", "文書D", "文書A"]])
+        stacked = stack_query_results(per_query)
+        for key in ("ids", "documents", "metadatas", "distances"):
+            self.assertEqual(stacked[key], MULTI_QUERY_RESULTS[key])
+
+    def test_stack_drops_keys_missing_in_any_query(self):
+        """一部の結果にしかないキー (GraphRetrieverのidsなど) は含めないことを確認"""
+        stacked = stack_query_results([
+            {"ids": [["a"]], "documents": [["文書A"]], "metadatas": [[{}]]},
+            {"documents": [["文書B"]], "metadatas": [[{}]]},
+        ])
+        self.assertEqual(set(stacked), {"documents", "metadatas"})
+
+
+if __name__ == "__main__":
+    unittest.main()
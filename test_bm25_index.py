@@ -0,0 +1,115 @@
+# test_bm25_index.py
+
+import os
+import sys
+import pickle
+import random
+import tempfile
+import unittest
+
+import numpy as np
+from rank_bm25 import BM25Okapi
+
+# Rehab_RAGライブラリへのパスを追加
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "Rehab_RAG"))
+from rag_components.retrievers.bm25_index import BM25SparseIndex
+from rag_components.retrievers.bm25_retriever import BM25Retriever
+from rag_executor import RAGExecutor
+
+
+def make_corpus(seed=0, n_docs=200, vocab_size=120):
+    """頻出語と希少語が混ざったランダムなコーパスを作る"""
+    rng = random.Random(seed)
+    words = [f"w{i}" for i in range(vocab_size)]
+    corpus = []
+    for _ in range(n_docs):
+        length = rng.randint(0, 40)
+        corpus.append([rng.choice(words[: rng.randint(3, vocab_size)]) for _ in range(length)])
+    return corpus, words
+
+
+class TestBM25SparseIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.corpus, self.words = make_corpus()
+        self.okapi = BM25Okapi(self.corpus)
+        self.index = BM25SparseIndex.build(self.corpus)
+        self.rng = random.Random(1)
+
+    def random_query(self):
+        return [self.rng.choice(self.words + ["未知語"]) for _ in range(self.rng.randint(1, 6))]
+
+    def test_scores_match_bm25okapi(self):
+        """BM25Okapi.get_scores と同じスコアになることを確認 (重複語・未知語を含む)"""
+        for _ in range(30):
+            query = self.random_query()
+            np.testing.assert_allclose(self.index.get_scores(query), self.okapi.get_scores(query), rtol=1e-9, atol=1e-12)
+
+    def test_top_n_matches_sorted_order(self):
+        """上位n件の順序が、従来の sorted(..., reverse=True) と一致することを確認"""
+        for _ in range(30):
+            query = self.random_query()
+            scores = self.okapi.get_scores(query)
+            expected = sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)[:20]
+            top_indices, top_scores = self.index.top_n(query, 20)
+            self.assertEqual(list(top_indices), expected)
+            np.testing.assert_allclose(top_scores, scores[expected])
+
+    def test_save_and_load_with_mmap(self):
+        """保存・メモリマップでの読み込み後も同じスコアになることを確認"""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            self.index.save(tmp_dir)
+            loaded = BM25SparseIndex.load(tmp_dir)
+            query = self.random_query()
+            np.testing.assert_allclose(loaded.get_scores(query), self.index.get_scores(query))
+
+    def test_convert_from_bm25okapi(self):
+        """旧形式のBM25Okapiから変換したインデックスが同じスコアになることを確認"""
+        converted = BM25SparseIndex.from_bm25okapi(self.okapi)
+        query = self.random_query()
+        np.testing.assert_allclose(converted.get_scores(query), self.okapi.get_scores(query))
+
+
+class TestBM25RetrieverLegacyIndex(unittest.TestCase):
+
+    def test_legacy_pickle_is_converted(self):
+        """旧形式のpickleしかない場合、新形式に変換して検索できることを確認"""
+        chunks = [
+            {"id": "c1", "text": "脳卒中のリハビリテーション", "metadata": {"source": "a"}},
+            {"id": "c2", "text": "大腿骨頸部骨折の術後リハビリ", "metadata": {"source": "b"}},
+            {"id": "c3", "text": "嚥下障害への対応", "metadata": {"source": "c"}},
+        ]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            retriever = BM25Retriever(tmp_dir, "test")
+            tokenized = [retriever._tokenize(chunk["text"]) for chunk in chunks]
+            with open(retriever.legacy_index_path, "wb") as f:
+                pickle.dump((BM25Okapi(tokenized), chunks), f)
+
+            results = BM25Retriever(tmp_dir, "test").retrieve("骨折 リハビリ", n_results=2)
+            self.assertEqual(results["ids"][0][0], "c2")
+            self.assertTrue(BM25SparseIndex.exists(retriever.index_dir))
+
+    def test_index_version_is_stable_across_rebuilds(self):
+        """分かち書きのキャッシュはインデックスの外に保存され、再構築・検索でインデックスの指紋が変わらないことを確認"""
+        chunks = [
+            {"id": "c1", "text": "脳卒中のリハビリテーション", "metadata": {"source": "a"}},
+            {"id": "c2", "text": "大腿骨頸部骨折の術後リハビリ", "metadata": {"source": "b"}},
+        ]
+        with tempfile.TemporaryDirectory() as index_dir, tempfile.TemporaryDirectory() as token_dir:
+            executor = RAGExecutor.__new__(RAGExecutor)
+            executor.pipeline_config = {}
+            executor.index_paths = [index_dir]
+
+            BM25Retriever(index_dir, "test", tokenize_workers=1, token_cache_dir=token_dir).add_documents(chunks)
+            version = executor.index_version()
+
+            # 2回目の構築はキャッシュ済みの分かち書きを使い、同じインデックスを読み込んで検索する
+            retriever = BM25Retriever(index_dir, "test", tokenize_workers=1, token_cache_dir=token_dir)
+            retriever.load_index()
+            retriever.retrieve("骨折", n_results=1)
+            self.assertEqual(executor.index_version(), version)
+            self.assertEqual(os.listdir(index_dir), ["test_bm25"])
+
+
+if __name__ == "__main__":
+    unittest.main()
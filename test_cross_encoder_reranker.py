@@ -0,0 +1,96 @@
+# test_cross_encoder_reranker.py
+
+import importlib.util
+import os
+import sys
+import unittest
+
+# Rehab_RAGライブラリへのパスを追加
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "Rehab_RAG"))
+
+HAS_CROSS_ENCODER = importlib.util.find_spec("torch") is not None and importlib.util.find_spec("sentence_transformers") is not None
+
+if HAS_CROSS_ENCODER:
+    from rag_components.rerankers.cross_encoder_reranker import CrossEncoderReranker
+
+
+class StubCrossEncoder:
+    """文書ごとに決めたスコアを返し、推論した (クエリ, 文書) ペアを記録する"""
+
+    def __init__(self, scores):
+        self.scores = scores
+        self.predicted = []
+
+    def predict(self, sentence_pairs, batch_size=32, show_progress_bar=False):
+        self.predicted.extend(doc for _, doc in sentence_pairs)
+        return [self.scores[doc] for _, doc in sentence_pairs]
+
+
+def make_reranker(scores, max_candidates=None, prefilter="lexical", score_threshold=None):
+    reranker = CrossEncoderReranker.__new__(CrossEncoderReranker)
+    reranker.model = StubCrossEncoder(scores)
+    reranker.model_name = "stub"
+    reranker.max_length = 512
+    reranker.batch_size = 32
+    reranker.max_candidates = max_candidates
+    reranker.prefilter = prefilter
+    reranker.score_threshold = score_threshold
+    reranker.score_cache = None
+    return reranker
+
+
+@unittest.skipUnless(HAS_CROSS_ENCODER, "torch / sentence-transformers がインストールされていません")
+class TestCrossEncoderReranker(unittest.TestCase):
+
+    def setUp(self):
+        self.query = "脳卒中 歩行訓練"
+        self.documents = [
+            "嚥下障害の評価",
+            "脳卒中患者の歩行訓練の効果について、長期の追跡調査を行った。" * 5,
+            "歩行訓練",
+            "上肢機能訓練",
+        ]
+        self.metadatas = [{"id": i} for i in range(len(self.documents))]
+        self.scores = {doc: score for doc, score in zip(self.documents, [0.1, 0.9, 0.7, 0.3])}
+
+    def test_rerank_sorts_by_score_and_keeps_metadata(self):
+        docs, metas = make_reranker(self.scores).rerank(self.query, self.documents, self.metadatas)
+        self.assertEqual([m["id"] for m in metas], [1, 2, 3, 0])
+        self.assertEqual(docs[0], self.documents[1])
+
+    def test_return_scores(self):
+        docs, metas, scores = make_reranker(self.scores).rerank(
+            self.query, self.documents, self.metadatas, return_scores=True
+        )
+        self.assertEqual(scores, sorted(scores, reverse=True))
+        self.assertAlmostEqual(scores[0], 0.9)
+        self.assertEqual(len(docs), len(metas))
+        self.assertEqual(len(scores), len(docs))
+
+    def test_score_threshold_drops_low_scores(self):
+        _, metas, scores = make_reranker(self.scores, score_threshold=0.5).rerank(
+            self.query, self.documents, self.metadatas, return_scores=True
+        )
+        self.assertEqual([m["id"] for m in metas], [1, 2])
+        self.assertTrue(all(score >= 0.5 for score in scores))
+
+    def test_max_candidates_lexical_prefilter_does_not_penalize_long_documents(self):
+        reranker = make_reranker(self.scores, max_candidates=2)
+        _, metas = reranker.rerank(self.query, self.documents, self.metadatas)
+        # クエリとの重なりが大きい長文 (id=1) と短文 (id=2) だけがCross-Encoderにかけられる
+        self.assertEqual(sorted(reranker.model.predicted), sorted([self.documents[1], self.documents[2]]))
+        self.assertEqual([m["id"] for m in metas], [1, 2])
+
+    def test_max_candidates_order_prefilter_keeps_search_rank(self):
+        reranker = make_reranker(self.scores, max_candidates=2, prefilter="order")
+        _, metas = reranker.rerank(self.query, self.documents, self.metadatas)
+        self.assertEqual(reranker.model.predicted, self.documents[:2])
+        self.assertEqual([m["id"] for m in metas], [1, 0])
+
+    def test_no_limit_scores_every_document(self):
+        reranker = make_reranker(self.scores, max_candidates=10)
+        self.assertEqual(reranker._select_candidates(self.query, self.documents), [0, 1, 2, 3])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,99 @@
+# test_db_pool.py
+
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+from sqlalchemy import text
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+
+from db_pool import build_database_url, create_db_engine, get_pool_stats
+
+
+class TestDbPool(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.url = f"sqlite:///{os.path.join(self.tmp.name, 'test.sqlite3')}"
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_checkout_and_churn_are_recorded(self):
+        engine = create_db_engine(self.url, pool_size=2, max_overflow=0)
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+            stats = get_pool_stats(engine)
+            self.assertEqual(stats["checked_out"], 1)
+            self.assertEqual(stats["saturation"], 0.5)
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+
+        stats = get_pool_stats(engine)
+        self.assertEqual(stats["pool_class"], "InstrumentedQueuePool")
+        self.assertEqual(stats["checkouts"], 2)
+        self.assertEqual(stats["checkins"], 2)
+        # 2回目は1回目の接続を再利用する
+        self.assertEqual(stats["connects"], 1)
+        self.assertGreaterEqual(stats["checkout_wait_ms"]["max"], 0.0)
+
+        engine.dispose()
+        self.assertEqual(get_pool_stats(engine)["closes"], 1)
+
+    def test_pool_exhaustion_is_counted(self):
+        engine = create_db_engine(self.url, pool_size=1, max_overflow=0, pool_timeout=0.05)
+        conn = engine.connect()
+        try:
+            with self.assertRaises(PoolTimeoutError):
+                engine.connect()
+            stats = get_pool_stats(engine)
+            self.assertEqual(stats["timeouts"], 1)
+            self.assertEqual(stats["saturation"], 1.0)
+        finally:
+            conn.close()
+
+    def test_checkout_wait_is_measured_when_pool_is_busy(self):
+        engine = create_db_engine(self.url, pool_size=1, max_overflow=0, pool_timeout=5)
+        conn = engine.connect()
+        # 別スレッドで少し待ってから返却し、その間の待ち時間を記録させる
+        threading.Timer(0.1, conn.close).start()
+        start_time = time.perf_counter()
+        with engine.connect():
+            pass
+        self.assertGreaterEqual(time.perf_counter() - start_time, 0.09)
+        self.assertGreaterEqual(get_pool_stats(engine)["checkout_wait_ms"]["max"], 90)
+
+    def test_memory_sqlite_shares_one_connection(self):
+        engine = create_db_engine("sqlite://")
+        with engine.begin() as conn:
+            conn.execute(text("CREATE TABLE t (x INTEGER)"))
+            conn.execute(text("INSERT INTO t VALUES (1)"))
+        with engine.connect() as conn:
+            self.assertEqual(conn.execute(text("SELECT x FROM t")).scalar(), 1)
+        self.assertEqual(get_pool_stats(engine)["dialect"], "sqlite")
+
+    def test_build_database_url(self):
+        saved = {key: os.environ.pop(key, None) for key in ("DATABASE_URL", "DB_HOST", "DB_USER", "DB_PASSWORD", "DB_NAME")}
+        try:
+            # MySQLの設定もSQLiteの指定もない場合は、SQLiteに切り替えずにエラーにする
+            with patch("db_pool.DB_USE_SQLITE", False):
+                with self.assertRaises(RuntimeError):
+                    build_database_url()
+            with patch("db_pool.DB_USE_SQLITE", True), patch("db_pool.DB_SQLITE_PATH", os.path.join(self.tmp.name, "local.sqlite3")):
+                self.assertEqual(build_database_url(), f"sqlite:///{os.path.join(self.tmp.name, 'local.sqlite3')}")
+            os.environ.update({"DB_HOST": "db", "DB_USER": "u", "DB_PASSWORD": "p", "DB_NAME": "rehab"})
+            self.assertEqual(build_database_url(), "mysql+pymysql://u:p@db/rehab?charset=utf8mb4")
+            os.environ["DATABASE_URL"] = "sqlite://"
+            self.assertEqual(build_database_url(), "sqlite://")
+        finally:
+            for key, value in saved.items():
+                os.environ.pop(key, None)
+                if value is not None:
+                    os.environ[key] = value
+
+
+if __name__ == "__main__":
+    unittest.main()
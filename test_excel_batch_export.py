@@ -0,0 +1,147 @@
+# test_excel_batch_export.py
+
+import contextlib
+import io
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+import zipfile
+
+from openpyxl import load_workbook
+
+from excel_batch_export import EXPORT_FAILED, EXPORT_RUNNING, EXPORT_SUCCEEDED, BatchExportManager, stream_plans_zip, write_progress
+
+# テスト用のSQLiteに患者1名・計画書2件を登録するスクリプト
+SEED_DATABASE_SCRIPT = """
+import database
+db = database.SessionLocal()
+patient = database.Patient(name="一括出力テスト")
+db.add(patient)
+db.flush()
+db.add_all([database.RehabilitationPlan(patient_id=patient.patient_id) for _ in range(2)])
+db.commit()
+"""
+
+
+def make_plans(n):
+    return [{"plan_id": i, "name": f"患者{i}", "age": 70 + i} for i in range(1, n + 1)]
+
+
+def build_zip(plans, **kwargs):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return zipfile.ZipFile(io.BytesIO(b"".join(stream_plans_zip(plans, **kwargs))))
+
+
+class TestExcelBatchExport(unittest.TestCase):
+
+    def test_single_worker_zip_contains_every_plan(self):
+        progress = []
+        zf = build_zip(make_plans(3), max_workers=1, progress=lambda *args: progress.append(args[:3]))
+
+        names = sorted(zf.namelist())
+        self.assertEqual(len(names), 3)
+        self.assertTrue(names[0].startswith("1_RehabPlan_患者1_"))
+        wb = load_workbook(io.BytesIO(zf.read(names[1])))
+        self.assertEqual(wb["様式23_1"]["F3"].value, "患者2")
+        self.assertEqual(progress, [(1, 3, 1), (2, 3, 2), (3, 3, 3)])
+
+    def test_process_pool_produces_same_entries(self):
+        zf = build_zip(make_plans(4), max_workers=2)
+        self.assertEqual(sorted(name.split("_")[0] for name in zf.namelist()), ["1", "2", "3", "4"])
+        self.assertIsNone(zf.testzip())
+
+    def test_failed_plan_is_listed_in_errors_file(self):
+        plans = make_plans(2)
+        plans[1]["name"] = None  # ファイル名を作れないため失敗する
+        zf = build_zip(plans, max_workers=1)
+
+        self.assertIn("errors.txt", zf.namelist())
+        self.assertIn("plan_id=2", zf.read("errors.txt").decode("utf-8"))
+        self.assertEqual(len(zf.namelist()), 2)
+
+
+
+class TestBatchExportManager(unittest.TestCase):
+    """Webアプリと同じく、excel_batch_export.py を別プロセスとして起動して出力する"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.saved_url = os.environ.get("DATABASE_URL")
+        os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(self.tmp.name, 'plans.sqlite3')}"
+        subprocess.run([sys.executable, "-c", SEED_DATABASE_SCRIPT], check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        self.manager = BatchExportManager(output_dir=os.path.join(self.tmp.name, "exports"), max_workers=1)
+
+    def tearDown(self):
+        if self.saved_url is None:
+            os.environ.pop("DATABASE_URL", None)
+        else:
+            os.environ["DATABASE_URL"] = self.saved_url
+        self.tmp.cleanup()
+
+    def wait_for(self, export_id, timeout=60):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            status = self.manager.status(export_id)
+            if status["status"] != EXPORT_RUNNING:
+                return status
+            time.sleep(0.2)
+        self.fail("一括出力が時間内に終わりませんでした")
+
+    def test_export_runs_in_subprocess_and_reports_progress(self):
+        export_id = self.manager.start(1, plan_ids=[1, 2])
+        status = self.wait_for(export_id)
+
+        self.assertEqual(status["status"], EXPORT_SUCCEEDED)
+        self.assertEqual((status["done"], status["total"], status["failed"]), (2, 2, 0))
+        zf = zipfile.ZipFile(self.manager.output_path(export_id))
+        self.assertEqual(sorted(name.split("_")[0] for name in zf.namelist()), ["1", "2"])
+        self.assertEqual(self.manager.stats()["running"], 0)
+
+    def test_no_matching_plans_is_reported_as_failure(self):
+        export_id = self.manager.start(1, plan_ids=[99])
+        status = self.wait_for(export_id)
+
+        self.assertEqual(status["status"], EXPORT_FAILED)
+        self.assertIn("見つかりません", status["error"])
+        self.assertIsNone(self.manager.output_path(export_id))
+        self.assertIsNone(self.manager.status("unknown"))
+
+    def test_other_web_process_can_read_status_and_download(self):
+        """別のWebプロセス (別の BatchExportManager) からも、出力先のファイルから状態とZIPファイルを取得できる"""
+        export_id = self.manager.start(1, plan_ids=[1, 2])
+        self.wait_for(export_id)
+
+        other = BatchExportManager(output_dir=self.manager.output_dir, max_workers=1)
+        status = other.status(export_id)
+        self.assertEqual(status["status"], EXPORT_SUCCEEDED)
+        self.assertEqual(status["owner_id"], 1)
+        self.assertIsNotNone(other.output_path(export_id))
+        self.assertEqual(other.stats()["kept"], 1)
+
+        # 保持期間を過ぎたものは、開始したプロセス以外からも削除できる
+        other.retention_seconds = -1
+        self.assertEqual(other.delete_expired(), 1)
+        self.assertIsNone(self.manager.status(export_id))
+
+    @unittest.skipUnless(os.name == "posix", "pid でプロセスの生存を確認できる環境のみ")
+    def test_process_exited_without_final_status_is_failed(self):
+        """完了の状態を書き出さないまま子プロセスが終了した場合は、失敗として扱う"""
+        export_id = "0" * 32
+        export_dir = os.path.join(self.manager.output_dir, export_id)
+        os.makedirs(export_dir)
+        finished = subprocess.Popen([sys.executable, "-c", "pass"])
+        finished.wait()
+        write_progress(os.path.join(export_dir, "export.json"), owner_id=1, created_at=time.time(), pid=finished.pid)
+        write_progress(os.path.join(export_dir, "progress.json"), status=EXPORT_RUNNING, done=1, total=2, failed=0)
+
+        status = self.manager.status(export_id)
+        self.assertEqual(status["status"], EXPORT_FAILED)
+        self.assertIn("完了前に終了", status["error"])
+        self.assertEqual(self.manager.stats()["running"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
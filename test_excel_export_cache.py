@@ -0,0 +1,88 @@
+# test_excel_export_cache.py
+
+import contextlib
+import io
+import os
+import tempfile
+import time
+import unittest
+
+from openpyxl import load_workbook
+
+import excel_writer
+from excel_export_cache import ExcelExportCache, OutputDirJanitor
+
+
+class TestExcelExportCache(unittest.TestCase):
+
+    def test_put_and_get(self):
+        cache = ExcelExportCache(ttl_seconds=60, max_bytes=100)
+        cache.put(1, "a.xlsx", b"x" * 10)
+        self.assertEqual(cache.get(1), ("a.xlsx", b"x" * 10))
+        self.assertIsNone(cache.get(2))
+        self.assertEqual(cache.stats()["hits"], 1)
+        self.assertEqual(cache.stats()["misses"], 1)
+
+    def test_size_limit_evicts_least_recently_used(self):
+        cache = ExcelExportCache(ttl_seconds=60, max_bytes=25)
+        cache.put(1, "a.xlsx", b"a" * 10)
+        cache.put(2, "b.xlsx", b"b" * 10)
+        cache.get(1)  # 2 が最も長く使われていない状態にする
+        cache.put(3, "c.xlsx", b"c" * 10)
+
+        self.assertIsNone(cache.get(2))
+        self.assertIsNotNone(cache.get(1))
+        self.assertEqual(cache.stats()["total_bytes"], 20)
+        # 上限を超える大きさのものは保持しない
+        cache.put(4, "d.xlsx", b"d" * 30)
+        self.assertIsNone(cache.get(4))
+
+    def test_expired_entries_are_not_returned(self):
+        cache = ExcelExportCache(ttl_seconds=0.05, max_bytes=100)
+        cache.put(1, "a.xlsx", b"a")
+        time.sleep(0.1)
+        self.assertIsNone(cache.get(1))
+        self.assertEqual(cache.stats()["entries"], 0)
+
+
+class TestOutputDirJanitor(unittest.TestCase):
+
+    def test_old_xlsx_files_are_deleted(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            old_path = os.path.join(tmp, "old.xlsx")
+            new_path = os.path.join(tmp, "new.xlsx")
+            other_path = os.path.join(tmp, "old.txt")
+            for path in (old_path, new_path, other_path):
+                open(path, "wb").close()
+            two_days_ago = time.time() - 2 * 24 * 60 * 60
+            os.utime(old_path, (two_days_ago, two_days_ago))
+            os.utime(other_path, (two_days_ago, two_days_ago))
+
+            janitor = OutputDirJanitor(tmp, retention_seconds=24 * 60 * 60)
+            self.assertEqual(janitor.sweep(), 1)
+            self.assertFalse(os.path.exists(old_path))
+            self.assertTrue(os.path.exists(new_path))
+            self.assertTrue(os.path.exists(other_path))
+
+
+class TestCreatePlanSheetBytes(unittest.TestCase):
+
+    def test_workbook_is_created_in_memory(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            original_output_dir = excel_writer.OUTPUT_DIR
+            excel_writer.OUTPUT_DIR = tmp
+            try:
+                with contextlib.redirect_stdout(io.StringIO()):
+                    filename, data = excel_writer.create_plan_sheet_bytes({"name": "テスト 患者", "age": 80})
+            finally:
+                excel_writer.OUTPUT_DIR = original_output_dir
+            # OUTPUT_DIR にはファイルを作らない
+            self.assertEqual(os.listdir(tmp), [])
+
+        self.assertTrue(filename.startswith("RehabPlan_テスト患者_"))
+        wb = load_workbook(io.BytesIO(data))
+        self.assertEqual(wb["様式23_1"]["F3"].value, "テスト 患者")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,96 @@
+# test_excel_template_cache.py
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from openpyxl import Workbook
+
+import excel_writer
+from excel_template_cache import ExcelTemplateCache, TemplateCellIndex, get_cell_index
+
+TEMPLATE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "template.xlsx")
+
+
+class TestExcelTemplateCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.template_path = os.path.join(self.tmp, "template.xlsx")
+        shutil.copy(TEMPLATE_PATH, self.template_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def test_workbooks_are_independent_copies(self):
+        cache = ExcelTemplateCache(self.template_path)
+        first = cache.get_workbook()
+        first["様式23_1"]["F3"].value = "テスト患者"
+
+        second = cache.get_workbook()
+        self.assertIsNot(first, second)
+        self.assertIsNone(second["様式23_1"]["F3"].value)
+        # 結合セル・名前付き範囲も複製に含まれる
+        self.assertEqual(
+            len(second["様式23_1"].merged_cells.ranges), len(first["様式23_1"].merged_cells.ranges)
+        )
+        self.assertIn("header_therapy_pt_chk", second.defined_names)
+        self.assertEqual(cache.stats()["loads"], 1)
+        self.assertEqual(cache.stats()["hits"], 1)
+
+    def test_template_is_reloaded_when_file_changes(self):
+        cache = ExcelTemplateCache(self.template_path)
+        cache.get_workbook()
+
+        wb = Workbook()
+        wb.active.title = "新しいテンプレート"
+        wb.save(self.template_path)
+        stat = os.stat(self.template_path)
+        # 更新時刻の精度に依存しないよう、明示的に進める
+        os.utime(self.template_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+        self.assertEqual(cache.get_workbook().sheetnames, ["新しいテンプレート"])
+        self.assertEqual(cache.stats()["loads"], 2)
+
+    def test_missing_template_raises_file_not_found(self):
+        cache = ExcelTemplateCache(os.path.join(self.tmp, "missing.xlsx"))
+        with self.assertRaises(FileNotFoundError):
+            cache.get_workbook()
+
+
+class TestTemplateCellIndex(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.cache = ExcelTemplateCache(TEMPLATE_PATH)
+
+    def test_merged_cells_resolve_to_anchor(self):
+        wb = self.cache.get_workbook()
+        index = get_cell_index(wb)
+        # 結合範囲 AN3:AO3 の右側のセルは、左上の AN3 に解決される
+        self.assertEqual(index.merged_anchors[("様式23_1", "AO3")], "AN3")
+        cell = excel_writer._get_cell_by_address(wb, "様式23_1", "AO3")
+        self.assertIs(cell, wb["様式23_1"]["AN3"])
+        # 結合されていないセルはそのまま返る
+        self.assertIs(excel_writer._get_cell_by_address(wb, "様式23_1", "F3"), wb["様式23_1"]["F3"])
+
+    def test_index_is_shared_between_cached_copies(self):
+        self.assertIs(get_cell_index(self.cache.get_workbook()), get_cell_index(self.cache.get_workbook()))
+
+    def test_defined_names_resolve_to_top_left_cell(self):
+        wb = self.cache.get_workbook()
+        self.assertEqual(excel_writer.get_cell_by_name(wb, "header_therapy_pt_chk").coordinate, "S5")
+        self.assertIsNone(excel_writer.get_cell_by_name(wb, "存在しない名前"))
+
+    def test_index_is_built_for_uncached_workbook(self):
+        wb = Workbook()
+        ws = wb.active
+        ws.merge_cells("B2:C3")
+        index = TemplateCellIndex.build(wb)
+        self.assertEqual(index.merged_anchors[(ws.title, "C3")], "B2")
+        self.assertIs(excel_writer._get_cell_by_address(wb, ws.title, "C3"), ws["B2"])
+
+
+if __name__ == "__main__":
+    unittest.main()
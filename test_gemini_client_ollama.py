@@ -10,6 +10,7 @@ from pydantic import ValidationError # テスト対象がインポートして
 try:
     from gemini_client import (
         generate_ollama_plan_stream,
+        PartialJsonFieldParser,
         _prepare_patient_facts, # プロンプト生成に使われるヘルパーもテストで使う場合がある
         USE_DUMMY_DATA,
         # get_dummy_plan # ダミーデータ関数も必要ならインポート
@@ -65,9 +66,10 @@ MOCK_OLLAMA_RESPONSES = {
 }
 
 # ollama.chat のストリーム応答を模倣するジェネレータ関数
-def mock_ollama_stream(model, messages, format, stream):
+def mock_ollama_stream(model, messages, format, stream, **kwargs):
     # プロンプトの内容から、どのグループの応答を返すか判定（簡易的）
-    prompt_content = messages[0]['content']
+    # グループ固有の指示は最後のメッセージに含まれる
+    prompt_content = messages[-1]['content']
     response_json = ""
     for group_name, mock_json in MOCK_OLLAMA_RESPONSES.items():
         if group_name in prompt_content:
@@ -193,7 +195,7 @@ class TestOllamaPlanGeneration(unittest.TestCase):
         # Goalsグループのときだけ不正なJSONを返すように side_effect を設定
         def side_effect_for_validation_error(*args, **kwargs):
             messages = kwargs.get('messages', [])
-            prompt_content = messages[0]['content'] if messages else ''
+            prompt_content = messages[-1]['content'] if messages else ''
             if "Goals" in prompt_content:
                 # 不正なJSON (goals_at_discharge_txt が欠落)
                 invalid_json = json.dumps({"goals_1_month_txt": "不正な目標"})
@@ -219,5 +221,120 @@ class TestOllamaPlanGeneration(unittest.TestCase):
         print("--- test_generate_ollama_plan_stream_validation_error 成功 ---")
 
 
+    @patch('gemini_client.ollama.chat')
+    def test_generate_ollama_plan_stream_passes_prior_results(self, mock_chat):
+        """治療計画のプロンプトには、依存する先行グループの生成結果が含まれることのテスト"""
+        prompts = {}
+
+        def side_effect_record(*args, **kwargs):
+            prompt_content = kwargs['messages'][-1]['content']
+            if "(ComprehensiveTreatmentPlan の項目のみ)" in prompt_content:
+                prompts["ComprehensiveTreatmentPlan"] = prompt_content
+            yield from mock_ollama_stream(*args, **kwargs)
+
+        mock_chat.side_effect = side_effect_record
+
+        received_events = list(generate_ollama_plan_stream(self.sample_patient_data))
+
+        self.assertFalse(any(e.startswith("event: error") for e in received_events), received_events)
+        self.assertTrue(received_events[-1].startswith("event: finished"))
+        self.assertEqual(mock_chat.call_count, 3)
+        self.assertIn("モック: 転倒リスクあり", prompts["ComprehensiveTreatmentPlan"])
+        self.assertIn("モック: 1ヶ月目標テキスト", prompts["ComprehensiveTreatmentPlan"])
+
+    @patch('gemini_client.ollama.chat')
+    def test_generate_ollama_plan_stream_goals_wait_for_assessment(self, mock_chat):
+        """目標は現状評価の生成結果を受け取ってから生成されることのテスト"""
+        prompts = {}
+
+        def side_effect_record(*args, **kwargs):
+            prompt_content = kwargs['messages'][-1]['content']
+            if "(Goals の項目のみ)" in prompt_content:
+                prompts["Goals"] = prompt_content
+            yield from mock_ollama_stream(*args, **kwargs)
+
+        mock_chat.side_effect = side_effect_record
+
+        list(generate_ollama_plan_stream(self.sample_patient_data))
+
+        self.assertIn("モック: 転倒リスクあり", prompts["Goals"])
+
+    @patch('gemini_client.ollama.chat', side_effect=mock_ollama_stream)
+    def test_generate_ollama_plan_stream_serial_order(self, mock_chat):
+        """GENERATION_GROUPS の順にグループが生成されることのテスト"""
+        list(generate_ollama_plan_stream(self.sample_patient_data))
+
+        called_groups = []
+        for call in mock_chat.call_args_list:
+            prompt_content = call.kwargs['messages'][-1]['content']
+            called_groups.append(next(g.__name__ for g in GENERATION_GROUPS if f"({g.__name__} の項目のみ)" in prompt_content))
+        self.assertEqual(called_groups, [g.__name__ for g in GENERATION_GROUPS])
+
+
+    @patch('gemini_client.ollama.chat', side_effect=mock_ollama_stream)
+    def test_generate_ollama_plan_stream_shared_prefix(self, mock_chat):
+        """全グループで先頭のメッセージ (役割・患者データ) が同一で、keep_alive が指定されることのテスト"""
+        list(generate_ollama_plan_stream(self.sample_patient_data))
+
+        prefixes = [call.kwargs['messages'][:-1] for call in mock_chat.call_args_list]
+        self.assertEqual(len(prefixes), len(GENERATION_GROUPS))
+        self.assertTrue(all(prefix == prefixes[0] for prefix in prefixes))
+        self.assertIn("テスト用の所見。", prefixes[0][-1]['content'])
+        for call in mock_chat.call_args_list:
+            self.assertIsNotNone(call.kwargs.get('keep_alive'))
+            # グループ固有の内容は共通部分に含まれない
+            self.assertNotIn("これまでの生成結果 (参考にしてください)", prefixes[0][-1]['content'])
+
+
+    @patch('gemini_client.ollama.chat')
+    def test_generate_ollama_plan_stream_partial_updates(self, mock_chat):
+        """チャンク到着ごとに partial な update イベントが送られ、最後に検証済みの値が送られることのテスト"""
+        def side_effect_chunked(*args, **kwargs):
+            for chunk in mock_ollama_stream(*args, **kwargs):
+                content = chunk['message']['content']
+                # 5文字ずつに分割して、トークン単位のストリームを模倣する
+                for i in range(0, len(content), 5):
+                    yield {'message': {'content': content[i:i + 5]}, 'done': False}
+
+        mock_chat.side_effect = side_effect_chunked
+
+        updates = []
+        group_completed = []
+        for event_str in generate_ollama_plan_stream(self.sample_patient_data):
+            data = json.loads(event_str.split("data: ", 1)[1].strip())
+            if event_str.startswith("event: update"):
+                updates.append(data)
+            elif event_str.startswith("event: group_completed"):
+                group_completed.append(data["group"])
+
+        goals_updates = [u for u in updates if u["key"] == "goals_1_month_txt"]
+        partial_values = [u["value"] for u in goals_updates if u.get("partial")]
+        final_values = [u["value"] for u in goals_updates if not u.get("partial")]
+
+        self.assertGreater(len(partial_values), 1)
+        self.assertEqual(final_values, ["モック: 1ヶ月目標テキスト"])
+        # 途中経過は最終的な値の先頭部分であり、最終値より前に届く
+        self.assertTrue(all("モック: 1ヶ月目標テキスト".startswith(v) for v in partial_values))
+        self.assertTrue(goals_updates[-1].get("partial") is None)
+        self.assertEqual(sorted(group_completed), sorted(g.__name__ for g in GENERATION_GROUPS))
+
+
+class TestPartialJsonFieldParser(unittest.TestCase):
+
+    def test_feed_extracts_partial_string_values(self):
+        """分割されたJSONから、エスケープやネストを含めて途中経過と最終値を取り出せることのテスト"""
+        expected = {"main_risks_txt": "転倒に注意\n\"見守り\"が必要", "goals_1_month_txt": "自立"}
+        response = json.dumps({"properties": {**expected, "other": 1}})  # ensure_ascii=True で \uXXXX を含む
+        parser = PartialJsonFieldParser(["main_risks_txt", "goals_1_month_txt"])
+
+        seen = []
+        for i in range(0, len(response), 3):
+            seen.extend(parser.feed(response[i:i + 3]).items())
+
+        self.assertEqual(parser.values, expected)
+        for key, value in seen:
+            self.assertTrue(expected[key].startswith(value), f"{key}: {value!r}")
+
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,48 @@
+# test_gemini_embedder.py
+
+import os
+import sys
+import unittest
+from types import SimpleNamespace
+from unittest.mock import patch
+
+# Rehab_RAGライブラリへのパスを追加
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "Rehab_RAG"))
+from rag_components.embedders.gemini_embedder import GeminiEmbedder
+
+
+class StubModels:
+    """テキストの長さを1次元のベクトルとして返し、APIコールの回数を記録する"""
+
+    def __init__(self):
+        self.calls = []
+
+    def embed_content(self, model, contents, config):
+        self.calls.append(list(contents))
+        return SimpleNamespace(embeddings=[SimpleNamespace(values=[float(len(text))]) for text in contents])
+
+
+def make_embedder(use_cache):
+    with patch.dict(os.environ, {"GEMINI_API_KEY": "test"}):
+        embedder = GeminiEmbedder(batch_size=2, use_cache=use_cache)
+    embedder.client = SimpleNamespace(models=StubModels())
+    return embedder
+
+
+class TestGeminiEmbedder(unittest.TestCase):
+
+    def test_embed_query_without_cache(self):
+        embedder = make_embedder(use_cache=False)
+        self.assertEqual(embedder.embed_query("歩行訓練"), [4.0])
+        self.assertEqual(embedder.embed_query("歩行訓練"), [4.0])
+        # キャッシュを使わないため、毎回APIを呼び出す
+        self.assertEqual(embedder.client.models.calls, [["歩行訓練"], ["歩行訓練"]])
+
+    def test_embed_queries_without_cache_are_batched(self):
+        embedder = make_embedder(use_cache=False)
+        self.assertEqual(embedder.embed_queries(["a", "bb", "ccc"]), [[1.0], [2.0], [3.0]])
+        self.assertEqual(embedder.client.models.calls, [["a", "bb"], ["ccc"]])
+
+
+if __name__ == "__main__":
+    unittest.main()
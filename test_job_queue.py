@@ -0,0 +1,204 @@
+# test_job_queue.py
+
+import json
+import os
+import tempfile
+import threading
+import unittest
+
+from job_queue import (
+    JOB_FAILED,
+    JOB_INTERRUPTED,
+    JOB_RUNNING,
+    JOB_SUCCEEDED,
+    JobManager,
+    JobStore,
+    format_event_id,
+    make_coalesce_key,
+    parse_event_id,
+)
+
+
+def update_event(key):
+    return f"event: update\ndata: {json.dumps({'key': key})}\n\n"
+
+
+def partial_event(key, value):
+    return f"event: update\ndata: {json.dumps({'key': key, 'value': value, 'partial': True})}\n\n"
+
+
+def wait_until_finished(manager, job_id):
+    # stream() はジョブが完了するまで返らないため、最後まで読み切ることで完了を待つ
+    return list(manager.stream(job_id))
+
+
+class TestJobQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.manager = JobManager(JobStore(":memory:"), max_workers=1, heartbeat_seconds=0.05)
+
+    def test_events_are_streamed_with_resumable_ids(self):
+        job_id = self.manager.submit("general", 1, lambda: iter([update_event("a"), update_event("b")]))
+        events = wait_until_finished(self.manager, job_id)
+
+        self.assertTrue(events[0].startswith("event: job\n"))
+        self.assertEqual(events[1], f"id: {format_event_id(job_id, 1)}\n{update_event('a')}")
+        self.assertEqual(events[2], f"id: {format_event_id(job_id, 2)}\n{update_event('b')}")
+        job = self.manager.get_job(job_id)
+        self.assertEqual(job["status"], JOB_SUCCEEDED)
+        self.assertEqual(job["event_count"], 2)
+
+    def test_resume_from_last_event_id(self):
+        job_id = self.manager.submit("general", 1, lambda: iter([update_event(k) for k in "abc"]))
+        wait_until_finished(self.manager, job_id)
+
+        resumed_job_id, after_seq = parse_event_id(format_event_id(job_id, 2))
+        self.assertEqual(resumed_job_id, job_id)
+        events = [e for e in self.manager.stream(resumed_job_id, after_seq) if not e.startswith("event: job")]
+        self.assertEqual(events, [f"id: {format_event_id(job_id, 3)}\n{update_event('c')}"])
+
+    def test_stream_waits_for_running_job(self):
+        release = threading.Event()
+
+        def slow_events():
+            yield update_event("a")
+            release.wait(timeout=5)
+            yield update_event("b")
+
+        job_id = self.manager.submit("rag:test", 1, slow_events)
+        stream = self.manager.stream(job_id)
+        next(stream)  # event: job
+        self.assertIn('"a"', next(stream))
+        self.assertEqual(self.manager.get_job(job_id)["status"], JOB_RUNNING)
+
+        # 新しいイベントがない間は keep-alive のコメント行が送られる
+        self.assertEqual(next(stream), ": keep-alive\n\n")
+        release.set()
+        rest = [e for e in stream if not e.startswith(":")]
+        self.assertEqual(len(rest), 1)
+        self.assertIn('"b"', rest[0])
+
+    def test_failed_generator_records_error_event(self):
+        def failing_events():
+            yield update_event("a")
+            raise RuntimeError("boom")
+
+        job_id = self.manager.submit("general", 1, failing_events)
+        events = wait_until_finished(self.manager, job_id)
+
+        self.assertIn("event: error", events[-1])
+        self.assertIn("boom", events[-1])
+        job = self.manager.get_job(job_id)
+        self.assertEqual(job["status"], JOB_FAILED)
+        self.assertEqual(job["error"], "boom")
+
+    def test_unfinished_jobs_are_interrupted_on_restart(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            db_path = os.path.join(tmp, "jobs.sqlite3")
+            store = JobStore(db_path)
+            job_id = store.create_job("general", 1)
+            store.set_status(job_id, JOB_RUNNING)
+
+            # プロセスの再起動を想定し、同じファイルで作り直す
+            manager = JobManager(JobStore(db_path), max_workers=1)
+            self.assertEqual(manager.get_job(job_id)["status"], JOB_INTERRUPTED)
+            events = list(manager.stream(job_id))
+            self.assertIn("event: error", events[-1])
+
+    def test_event_seq_continues_after_restart(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            db_path = os.path.join(tmp, "jobs.sqlite3")
+            store = JobStore(db_path)
+            job_id = store.create_job("general", 1)
+            self.assertEqual([store.append_event(job_id, update_event(k)) for k in "ab"], [1, 2])
+
+            # 別のプロセスでは、保存済みのイベントの続きから番号を付ける
+            self.assertEqual(JobStore(db_path).append_event(job_id, update_event("c")), 3)
+
+    def test_partial_events_are_not_stored(self):
+        job_id = self.manager.submit(
+            "general",
+            1,
+            lambda: iter([partial_event("a", "途"), partial_event("a", "途中"), update_event("a"), update_event("b")]),
+        )
+        wait_until_finished(self.manager, job_id)
+
+        self.assertEqual(self.manager.get_job(job_id)["event_count"], 2)
+        events = [e for e in self.manager.stream(job_id) if not e.startswith("event: job")]
+        self.assertEqual(events, [f"id: {format_event_id(job_id, 1)}\n{update_event('a')}", f"id: {format_event_id(job_id, 2)}\n{update_event('b')}"])
+        self.assertEqual(self.manager.stats()["partial_events_not_stored"], 2)
+
+    def test_reconnect_receives_latest_partial_only(self):
+        partials_sent = threading.Event()
+        release = threading.Event()
+
+        def slow_events():
+            yield update_event("a")
+            yield partial_event("b", "途")
+            yield partial_event("b", "途中")
+            # ここに来た時点で、2件目の途中経過までが処理されている
+            partials_sent.set()
+            release.wait(timeout=5)
+            yield update_event("b")
+
+        job_id = self.manager.submit("general", 1, slow_events)
+        self.assertTrue(partials_sent.wait(timeout=5))
+
+        # 途中経過が2件届いた後に再接続したクライアントには、最新の1件だけが id なしで届く
+        stream = self.manager.stream(job_id, 1)
+        next(stream)  # event: job
+        self.assertEqual(next(stream), partial_event("b", "途中"))
+
+        release.set()
+        rest = [e for e in stream if not e.startswith(":")]
+        self.assertEqual(rest, [f"id: {format_event_id(job_id, 2)}\n{update_event('b')}"])
+        self.assertEqual(self.manager._get_partials(job_id), {})
+
+    def test_identical_inflight_jobs_are_coalesced(self):
+        release = threading.Event()
+        runs = []
+
+        def slow_events():
+            runs.append(1)
+            release.wait(timeout=5)
+            yield update_event("a")
+
+        key = make_coalesce_key("rag:test", {"patient_facts": {"年齢": 80, "所見": "x"}, "use_cache": True})
+        first = self.manager.submit("rag:test", 1, slow_events, coalesce_key=key)
+        # キーの順序が異なっても同じ内容であれば同じキーになる
+        same_key = make_coalesce_key("rag:test", {"use_cache": True, "patient_facts": {"所見": "x", "年齢": 80}})
+        second = self.manager.submit("rag:test", 2, slow_events, coalesce_key=same_key)
+        self.assertEqual(first, second)
+        release.set()
+
+        # 相乗りしたユーザーも、全てのイベントを最初から受け取れる
+        events = wait_until_finished(self.manager, second)
+        self.assertEqual(len(runs), 1)
+        self.assertIn('"a"', events[1])
+        self.assertTrue(self.manager.can_access(first, 2))
+        self.assertFalse(self.manager.can_access(first, 3))
+        self.assertEqual(self.manager.stats()["coalesced"], 1)
+
+        # 完了後は、同じキーでも新しく実行する
+        third = self.manager.submit("rag:test", 1, slow_events, coalesce_key=key)
+        self.assertNotEqual(third, first)
+        wait_until_finished(self.manager, third)
+        self.assertEqual(len(runs), 2)
+
+    def test_different_keys_are_not_coalesced(self):
+        key_a = make_coalesce_key("general", {"所見": "a"})
+        key_b = make_coalesce_key("general", {"所見": "b"})
+        self.assertNotEqual(key_a, key_b)
+        self.assertNotEqual(make_coalesce_key("rag:x", {"所見": "a"}), make_coalesce_key("rag:y", {"所見": "a"}))
+        job_a = self.manager.submit("general", 1, lambda: iter([]), coalesce_key=key_a)
+        job_b = self.manager.submit("general", 1, lambda: iter([]), coalesce_key=key_b)
+        self.assertNotEqual(job_a, job_b)
+
+    def test_parse_event_id_rejects_invalid_values(self):
+        self.assertEqual(parse_event_id(None), (None, 0))
+        self.assertEqual(parse_event_id("123"), (None, 0))
+        self.assertEqual(parse_event_id("abc:x"), (None, 0))
+
+
+if __name__ == "__main__":
+    unittest.main()
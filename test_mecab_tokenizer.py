@@ -0,0 +1,60 @@
+# test_mecab_tokenizer.py
+
+import os
+import sys
+import tempfile
+import unittest
+from unittest.mock import patch
+
+# Rehab_RAGライブラリへのパスを追加
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "Rehab_RAG"))
+from rag_components.tokenizers import mecab_tokenizer
+from rag_components.tokenizers.mecab_tokenizer import MeCabTokenizer
+
+TEXTS = ["脳卒中のリハビリテーション", "大腿骨頸部骨折の術後リハビリ", "嚥下障害への対応", "転倒予防のための筋力訓練"]
+
+
+class TestMeCabTokenizer(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache_dir = os.path.join(self.tmp_dir.name, "tokens")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_rebuild_only_tokenizes_new_texts(self):
+        """2回目の構築では、追加されたチャンクだけが分かち書きされることを確認"""
+        tokenizer = MeCabTokenizer(cache_dir=self.cache_dir, n_workers=1)
+        first = tokenizer.tokenize_documents(TEXTS[:3])
+        tokenizer.token_cache.close()
+
+        tokenizer = MeCabTokenizer(cache_dir=self.cache_dir, n_workers=1)
+        with patch.object(tokenizer, "_parse", wraps=tokenizer._parse) as mock_parse:
+            second = tokenizer.tokenize_documents(TEXTS)
+        tokenizer.token_cache.close()
+
+        self.assertEqual(mock_parse.call_count, 1)
+        self.assertEqual(second[:3], first)
+        self.assertIn("転倒", second[3])
+
+    def test_parallel_matches_serial(self):
+        """マルチプロセスでの分かち書き結果が、逐次処理と同じになることを確認"""
+        texts = TEXTS * 5
+        serial = MeCabTokenizer(n_workers=1).tokenize_documents(texts)
+        with patch.object(mecab_tokenizer, "PARALLEL_TOKENIZE_MIN_TEXTS", 1):
+            parallel = MeCabTokenizer(n_workers=2).tokenize_documents(texts)
+        self.assertEqual(parallel, serial)
+
+    def test_query_tokens_are_cached(self):
+        """同じクエリの分かち書きはLRUから再利用されることを確認"""
+        tokenizer = MeCabTokenizer()
+        query = "膝関節の可動域訓練"
+        tokens = tokenizer.tokenize(query)
+        with patch.object(tokenizer, "_parse") as mock_parse:
+            self.assertEqual(tokenizer.tokenize(query), tokens)
+        mock_parse.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,135 @@
+# test_model_registry.py
+
+import gc
+import os
+import sys
+import threading
+import time
+import unittest
+
+import numpy as np
+
+# Rehab_RAGライブラリへのパスを追加
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "Rehab_RAG"))
+from rag_components.caches.model_registry import ModelRegistry, estimate_model_bytes
+
+
+class FakeTensor:
+    def __init__(self, n):
+        self.array = np.zeros(n, dtype=np.float32)
+
+    def numel(self):
+        return self.array.size
+
+    def element_size(self):
+        return self.array.itemsize
+
+
+class FakeModule:
+    """parameters()/buffers() を持つ、PyTorchのモジュールを模したオブジェクト"""
+
+    def __init__(self, n_params=100):
+        self._params = [FakeTensor(n_params)]
+
+    def parameters(self):
+        return iter(self._params)
+
+    def buffers(self):
+        return iter([])
+
+
+class Owner:
+    pass
+
+
+class TestModelRegistry(unittest.TestCase):
+
+    def test_same_key_is_loaded_once_and_refcounted(self):
+        registry = ModelRegistry(max_idle_models=0)
+        key = registry.make_key("SentenceTransformer", "intfloat/multilingual-e5-large", "cpu")
+        loads = []
+
+        def loader():
+            loads.append(1)
+            return FakeModule()
+
+        first = registry.acquire(key, loader)
+        second = registry.acquire(key, loader)
+        self.assertIs(first, second)
+        self.assertEqual(len(loads), 1)
+        self.assertEqual(registry.stats()["models"][0]["refcount"], 2)
+        self.assertEqual(registry.stats()["total_bytes"], 400)
+
+        registry.release(key)
+        self.assertEqual(len(registry.stats()["models"]), 1)
+        registry.release(key)
+        # 未使用のモデルを保持しない設定のため、参照数が0になった時点で解放される
+        self.assertEqual(registry.stats()["models"], [])
+        self.assertEqual(registry.stats()["evictions"], 1)
+
+    def test_different_load_settings_are_separate_models(self):
+        registry = ModelRegistry()
+        a = registry.acquire(registry.make_key("CrossEncoder", "m", "cpu", max_length=512), FakeModule)
+        b = registry.acquire(registry.make_key("CrossEncoder", "m", "cpu", max_length=256), FakeModule)
+        c = registry.acquire(registry.make_key("CrossEncoder", "m", "cuda", max_length=512), FakeModule)
+        self.assertEqual(len({id(a), id(b), id(c)}), 3)
+
+    def test_idle_models_are_kept_up_to_limit_and_reused(self):
+        registry = ModelRegistry(max_idle_models=1)
+        key_a = registry.make_key("X", "a", "cpu")
+        key_b = registry.make_key("X", "b", "cpu")
+        model_a = registry.acquire(key_a, FakeModule)
+        registry.acquire(key_b, FakeModule)
+
+        registry.release(key_a)
+        # 未使用になったモデルは、再度要求されるとロードせずに再利用される
+        self.assertIs(registry.acquire(key_a, lambda: self.fail("再ロードされました")), model_a)
+
+        registry.release(key_a)
+        registry.release(key_b)
+        # 上限1件を超えた分 (古い方の a) が解放される
+        self.assertEqual([m["model_name"] for m in registry.stats()["models"]], ["b"])
+        self.assertEqual(registry.evict_unused(), 1)
+        self.assertEqual(registry.stats()["models"], [])
+
+    def test_owner_garbage_collection_releases_model(self):
+        registry = ModelRegistry(max_idle_models=0)
+        key = registry.make_key("X", "a", "cpu")
+        owner = Owner()
+        registry.acquire(key, FakeModule)
+        release = registry.register_owner(owner, key)
+
+        del owner
+        gc.collect()
+        self.assertEqual(registry.stats()["models"], [])
+        # 既に解放済みのため、明示的に呼び出しても何もしない
+        release()
+
+    def test_concurrent_acquire_loads_once(self):
+        registry = ModelRegistry()
+        key = registry.make_key("X", "a", "cpu")
+        loads = []
+
+        def slow_loader():
+            loads.append(1)
+            time.sleep(0.05)
+            return FakeModule()
+
+        threads = [threading.Thread(target=registry.acquire, args=(key, slow_loader)) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(len(loads), 1)
+        self.assertEqual(registry.stats()["models"][0]["refcount"], 4)
+
+    def test_estimate_model_bytes_follows_inner_model(self):
+        class Wrapper:
+            def __init__(self):
+                self.model = FakeModule(10)
+
+        self.assertEqual(estimate_model_bytes((object(), Wrapper())), 40)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,100 @@
+# test_nli_filter.py
+
+import importlib.util
+import os
+import sys
+import unittest
+
+# Rehab_RAGライブラリへのパスを追加
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "Rehab_RAG"))
+
+HAS_TORCH = importlib.util.find_spec("torch") is not None and importlib.util.find_spec("transformers") is not None
+
+if HAS_TORCH:
+    import torch
+    from rag_components.filters.nli_filter import NLIFilter
+
+
+class StubEncoding(dict):
+    def to(self, device):
+        return self
+
+
+class StubTokenizer:
+    """文字コードをトークンIDとし、バッチ内の最長の入力に合わせて右側をパディングする"""
+
+    def __call__(self, premises, hypotheses, return_tensors=None, padding=True, truncation=True, max_length=512):
+        rows = [[ord(c) % 97 + 1 for c in (p + "|" + h)][:max_length] for p, h in zip(premises, hypotheses)]
+        width = max(len(row) for row in rows)
+        return StubEncoding(
+            input_ids=torch.tensor([row + [0] * (width - len(row)) for row in rows]),
+            attention_mask=torch.tensor([[1] * len(row) + [0] * (width - len(row)) for row in rows]),
+        )
+
+
+class StubModel(torch.nn.Module if HAS_TORCH else object):
+    """attention_mask でパディングを除いた平均埋め込みから3ラベルのロジットを出力する"""
+
+    def __init__(self):
+        super().__init__()
+        torch.manual_seed(0)
+        self.embedding = torch.nn.Embedding(100, 8)
+        self.head = torch.nn.Linear(8, 3)
+
+    def forward(self, input_ids, attention_mask):
+        mask = attention_mask.unsqueeze(-1).float()
+        pooled = (self.embedding(input_ids) * mask).sum(dim=1) / mask.sum(dim=1)
+
+        class Output:
+            pass
+
+        output = Output()
+        output.logits = self.head(pooled) * 4
+        return output
+
+
+def make_filter(batch_size, length_bucketing=False):
+    nli_filter = NLIFilter.__new__(NLIFilter)
+    nli_filter.device = "cpu"
+    nli_filter.tokenizer = StubTokenizer()
+    nli_filter.model = StubModel().eval()
+    nli_filter.batch_size = batch_size
+    nli_filter.length_bucketing = length_bucketing
+    return nli_filter
+
+
+@unittest.skipUnless(HAS_TORCH, "torch / transformers がインストールされていません")
+class TestNLIFilterBatching(unittest.TestCase):
+
+    def setUp(self):
+        self.query = "脳卒中後の歩行訓練"
+        self.documents = [
+            "短い文書",
+            "脳卒中後の片麻痺患者に対する歩行訓練の効果を検討した研究である。" * 3,
+            "転倒予防",
+            "バランス訓練と筋力増強訓練を組み合わせた介入。",
+            "嚥下障害の評価方法について述べる。" * 5,
+            "歩行",
+            "高齢者の大腿骨頸部骨折後のリハビリテーション。" * 2,
+        ]
+        self.metadatas = [{"id": i} for i in range(len(self.documents))]
+
+    def test_batched_probabilities_match_per_document_loop(self):
+        expected = make_filter(batch_size=1)._predict_probabilities(self.query, self.documents)
+        for batch_size, bucketing in [(3, False), (3, True), (16, False), (16, True)]:
+            with self.subTest(batch_size=batch_size, length_bucketing=bucketing):
+                actual = make_filter(batch_size, bucketing)._predict_probabilities(self.query, self.documents)
+                self.assertEqual(actual.shape, expected.shape)
+                self.assertTrue(torch.allclose(torch.from_numpy(actual), torch.from_numpy(expected), atol=1e-5))
+
+    def test_keep_drop_decisions_and_order_match(self):
+        expected_docs, expected_metas = make_filter(batch_size=1).filter(self.query, self.documents, self.metadatas)
+        for bucketing in (False, True):
+            with self.subTest(length_bucketing=bucketing):
+                docs, metas = make_filter(4, bucketing).filter(self.query, self.documents, self.metadatas)
+                self.assertEqual(docs, expected_docs)
+                self.assertEqual(metas, expected_metas)
+
+
+if __name__ == "__main__":
+    unittest.main()
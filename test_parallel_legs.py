@@ -0,0 +1,98 @@
+# test_parallel_legs.py
+
+import os
+import sys
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+# Rehab_RAGライブラリへのパスを追加
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "Rehab_RAG"))
+from rag_components.retrievers.parallel_legs import RetrievalLegRunner, run_retrieval_legs
+
+
+class TestRunRetrievalLegs(unittest.TestCase):
+
+    def setUp(self):
+        self.executor = ThreadPoolExecutor(max_workers=4)
+
+    def tearDown(self):
+        self.executor.shutdown(wait=True)
+
+    def test_legs_run_concurrently(self):
+        """2つの検索が同時に実行されることを確認 (Barrierで互いを待つ)"""
+        barrier = threading.Barrier(2, timeout=5)
+
+        def leg(name):
+            barrier.wait()
+            return name
+
+        results = run_retrieval_legs(self.executor, {"a": lambda: leg("a"), "b": lambda: leg("b")}, timeout=5)
+        self.assertEqual(results, {"a": "a", "b": "b"})
+
+    def test_timeout_degrades_to_one_leg(self):
+        """時間切れになった検索は None になり、もう一方の結果は返されることを確認"""
+        release = threading.Event()
+
+        def slow_leg():
+            release.wait(5)
+            return "slow"
+
+        try:
+            results = run_retrieval_legs(self.executor, {"fast": lambda: "fast", "slow": slow_leg}, timeout=0.2)
+        finally:
+            release.set()
+        self.assertEqual(results, {"fast": "fast", "slow": None})
+
+    def test_error_degrades_to_one_leg(self):
+        """例外が発生した検索は None になることを確認"""
+        def failing_leg():
+            raise RuntimeError("index missing")
+
+        results = run_retrieval_legs(self.executor, {"ok": lambda: "ok", "ng": failing_leg}, timeout=5)
+        self.assertEqual(results, {"ok": "ok", "ng": None})
+
+    def test_all_legs_failed_raises(self):
+        """全ての検索が失敗した場合は例外が送出されることを確認"""
+        def failing_leg():
+            raise RuntimeError("index missing")
+
+        with self.assertRaises(RuntimeError):
+            run_retrieval_legs(self.executor, {"a": failing_leg, "b": failing_leg}, timeout=5)
+
+        def stuck_leg():
+            time.sleep(0.5)
+
+        with self.assertRaises(TimeoutError):
+            run_retrieval_legs(self.executor, {"a": stuck_leg}, timeout=0.1)
+
+
+class TestRetrievalLegRunner(unittest.TestCase):
+
+    def test_executor_is_sized_per_leg(self):
+        runner = RetrievalLegRunner(n_legs=2, thread_name_prefix="test", concurrency=3)
+        try:
+            self.assertEqual(runner.max_workers, 6)
+            self.assertEqual(runner.run({"a": lambda: 1, "b": lambda: 2}, timeout=5), {"a": 1, "b": 2})
+            self.assertEqual(runner.recreated, 0)
+        finally:
+            runner.close()
+
+    def test_executor_is_recreated_after_timeout(self):
+        """時間切れのレッグがスレッドを占有していても、次の検索は新しいスレッドプールで実行されることを確認"""
+        runner = RetrievalLegRunner(n_legs=1, thread_name_prefix="test", concurrency=1)
+        release = threading.Event()
+        try:
+            results = runner.run({"fast": lambda: "fast", "stuck": lambda: release.wait(5)}, timeout=0.2)
+            self.assertEqual(results, {"fast": "fast", "stuck": None})
+            self.assertEqual(runner.recreated, 1)
+            # 古いスレッドプールの唯一のスレッドは占有されたままだが、新しいプールで実行できる
+            self.assertEqual(runner.run({"a": lambda: "a"}, timeout=1), {"a": "a"})
+        finally:
+            release.set()
+            runner.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
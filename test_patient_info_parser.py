@@ -0,0 +1,206 @@
+# test_patient_info_parser.py
+
+import threading
+import time
+import unittest
+from types import SimpleNamespace
+
+from patient_info_parser import (
+    PatientInfoParser,
+    TokenBucketRateLimiter,
+    reconcile_group_results,
+)
+from prompt_assembly import get_schema_dict
+from schemas import (
+    PATIENT_INFO_EXTRACTION_GROUPS,
+    PatientInfo_Basic,
+    PatientInfo_ADL,
+    PatientInfo_BasicMovements,
+    PatientInfo_Goal_Activity,
+)
+
+
+# --- オフラインで動作するスタブクライアント ---
+# 各グループについて、スキーマの最初の文字列型の項目だけを埋めた応答を返す
+class StubModels:
+    def __init__(self, delay: float = 0.0, fail_groups=()):
+        self.delay = delay
+        self.fail_groups = set(fail_groups)
+        self.prompts = {}
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+
+    def generate_content(self, model, contents, config):
+        schema = config.response_schema
+        with self.lock:
+            self.prompts[schema] = contents
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        try:
+            time.sleep(self.delay)
+            if schema in self.fail_groups:
+                raise RuntimeError(f"stub failure: {schema.__name__}")
+            text_fields = [
+                name for name, field in schema.model_fields.items() if field.annotation == (str | None)
+            ]
+            values = {text_fields[0]: f"{schema.__name__}の値"} if text_fields else {}
+            if schema is PatientInfo_Basic:
+                values = {"name": "テスト太郎", "gender": "男性"}
+            return SimpleNamespace(parsed=schema.model_validate(values))
+        finally:
+            with self.lock:
+                self.active -= 1
+
+
+class StubClient:
+    def __init__(self, **kwargs):
+        self.models = StubModels(**kwargs)
+
+
+class StubLLM:
+    """rag_components.llms と同じインターフェース (generate) を持つスタブ。失敗時は {"error": ...} を返す"""
+
+    model_name = "stub-local-llm"
+
+    def __init__(self, **kwargs):
+        self.models = StubModels(**kwargs)
+        self.schema_dicts = {}
+
+    def generate(self, prompt, response_schema=None, **kwargs):
+        self.schema_dicts[response_schema] = kwargs.get("schema_dict")
+        config = SimpleNamespace(response_schema=response_schema)
+        try:
+            return self.models.generate_content(self.model_name, prompt, config).parsed
+        except RuntimeError as e:
+            return {"error": str(e)}
+
+
+def make_parser(client, parallel):
+    # テストではレート制限で待たないよう、十分大きな値を設定する
+    return PatientInfoParser(
+        client=client,
+        rate_limiter=TokenBucketRateLimiter(requests_per_minute=60000, burst=100),
+        parallel=parallel,
+    )
+
+
+class TestPatientInfoParser(unittest.TestCase):
+
+    def test_parallel_extraction_runs_groups_concurrently(self):
+        """依存関係のないグループが同時に抽出され、全グループの結果がマージされることを確認"""
+        client = StubClient(delay=0.05)
+        result = make_parser(client, parallel=True).parse_text("カルテテキスト")
+
+        self.assertGreater(client.models.max_active, 1)
+        self.assertEqual(len(client.models.prompts), len(PATIENT_INFO_EXTRACTION_GROUPS))
+        self.assertEqual(result["gender"], "男")  # 正規化処理が適用されること
+        self.assertEqual(result["name"], "テスト太郎")
+
+    def test_parallel_prompt_contains_only_dependencies(self):
+        """並列モードでは、依存するグループの抽出結果だけがプロンプトに含まれることを確認"""
+        client = StubClient()
+        make_parser(client, parallel=True).parse_text("カルテテキスト")
+
+        goal_activity_prompt = client.models.prompts[PatientInfo_Goal_Activity]
+        # 値が null の項目はプロンプトに含めない
+        self.assertNotIn('"adl_eating_fim_start_val"', goal_activity_prompt)
+        self.assertIn("PatientInfo_BasicMovementsの値", goal_activity_prompt)
+        self.assertNotIn("テスト太郎", goal_activity_prompt)
+        self.assertIn("まだありません。", client.models.prompts[PatientInfo_ADL])
+
+    def test_serial_prompt_contains_only_dependencies(self):
+        """直列モードでも、依存関係のないグループの抽出結果はプロンプトに含まれないことを確認"""
+        client = StubClient()
+        make_parser(client, parallel=False).parse_text("カルテテキスト")
+
+        goal_activity_prompt = client.models.prompts[PatientInfo_Goal_Activity]
+        self.assertIn("PatientInfo_BasicMovementsの値", goal_activity_prompt)
+        self.assertNotIn("テスト太郎", goal_activity_prompt)
+
+    def test_serial_extraction_matches_parallel(self):
+        """逐次モードでも同じ結果が得られることを確認"""
+        serial = make_parser(StubClient(), parallel=False).parse_text("カルテテキスト")
+        parallel = make_parser(StubClient(), parallel=True).parse_text("カルテテキスト")
+        self.assertEqual(serial, parallel)
+
+    def test_failed_group_does_not_stop_others(self):
+        """1つのグループが失敗しても、他のグループの結果は返されることを確認"""
+        client = StubClient(fail_groups=[PatientInfo_BasicMovements])
+        result = make_parser(client, parallel=True).parse_text("カルテテキスト")
+        self.assertEqual(result["name"], "テスト太郎")
+        self.assertIn(PatientInfo_Goal_Activity, client.models.prompts)
+
+    def test_iter_group_results_yields_each_group_once(self):
+        """ストリーミング用のジェネレータが、全グループについて1回ずつ結果 (失敗時は None) を返すことを確認"""
+        client = StubClient(fail_groups=[PatientInfo_ADL])
+        parser = make_parser(client, parallel=True)
+        results = list(parser.iter_group_results("カルテテキスト"))
+
+        self.assertCountEqual([g for g, _ in results], PATIENT_INFO_EXTRACTION_GROUPS)
+        self.assertIsNone(dict(results)[PatientInfo_ADL])
+        # 依存先のグループは、依存元より先に返される
+        order = [g for g, _ in results]
+        self.assertLess(order.index(PatientInfo_ADL), order.index(PatientInfo_Goal_Activity))
+
+    def test_all_groups_failed_returns_error(self):
+        client = StubClient(fail_groups=PATIENT_INFO_EXTRACTION_GROUPS)
+        result = make_parser(client, parallel=True).parse_text("カルテテキスト")
+        self.assertIn("error", result)
+
+
+class TestPatientInfoParserLocalLLM(unittest.TestCase):
+
+    def test_llm_backend_is_used_without_api_key(self):
+        """LLMラッパーを渡した場合、Gemini APIのクライアントやレート制限なしで抽出できることを確認"""
+        llm = StubLLM(fail_groups=[PatientInfo_ADL])
+        parser = PatientInfoParser(llm=llm, parallel=True)
+        result = parser.parse_text("カルテテキスト")
+
+        self.assertIsNone(parser.client)
+        self.assertIsNone(parser.rate_limiter)
+        self.assertEqual(parser.model_name, "stub-local-llm")
+        self.assertEqual(len(llm.models.prompts), len(PATIENT_INFO_EXTRACTION_GROUPS))
+        self.assertEqual(result["gender"], "男")
+
+    def test_llm_receives_precomputed_schema_dict(self):
+        """ローカルLLMには、prompt_assembly で計算済みのスキーマ辞書が渡されることを確認"""
+        llm = StubLLM()
+        PatientInfoParser(llm=llm, parallel=False).parse_text("カルテテキスト")
+
+        for group_schema in PATIENT_INFO_EXTRACTION_GROUPS:
+            self.assertIs(llm.schema_dicts[group_schema], get_schema_dict(group_schema))
+
+    def test_llm_error_dict_is_treated_as_failed_group(self):
+        llm = StubLLM(fail_groups=[PatientInfo_ADL])
+        results = dict(PatientInfoParser(llm=llm, parallel=False).iter_group_results("カルテテキスト"))
+        self.assertIsNone(results[PatientInfo_ADL])
+        self.assertIsNotNone(results[PatientInfo_Basic])
+
+
+class TestReconcileGroupResults(unittest.TestCase):
+
+    def test_true_is_kept_and_null_does_not_overwrite(self):
+        merged = reconcile_group_results([
+            {"a_chk": True, "b_txt": "あり", "c_chk": False},
+            {"a_chk": None, "b_txt": None, "c_chk": True},
+            {"a_chk": False, "d_txt": None},
+        ])
+        self.assertEqual(merged, {"a_chk": True, "b_txt": "あり", "c_chk": True, "d_txt": None})
+
+
+class TestTokenBucketRateLimiter(unittest.TestCase):
+
+    def test_waits_after_burst(self):
+        """容量分はすぐに取得でき、それ以降は補充を待つことを確認"""
+        limiter = TokenBucketRateLimiter(requests_per_minute=600, burst=2)  # 0.1秒に1回
+        start = time.monotonic()
+        for _ in range(3):
+            limiter.acquire()
+        elapsed = time.monotonic() - start
+        self.assertGreaterEqual(elapsed, 0.08)
+        self.assertLess(elapsed, 1.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
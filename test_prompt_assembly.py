@@ -0,0 +1,98 @@
+# test_prompt_assembly.py
+
+import json
+import unittest
+
+from prompt_assembly import (
+    PrefillBaselines,
+    PromptTokenStats,
+    dumps_compact,
+    estimate_prompt_tokens,
+    get_schema_dict,
+    get_schema_json,
+    select_relevant_prior,
+)
+from schemas import (
+    PATIENT_INFO_EXTRACTION_GROUP_DEPENDENCIES,
+    PatientInfo_ADL,
+    PatientInfo_Basic,
+    PatientInfo_BasicMovements,
+    PatientInfo_Goal_Activity,
+)
+
+
+class TestSchemaCache(unittest.TestCase):
+
+    def test_schema_json_is_minified_and_cached(self):
+        schema_json = get_schema_json(PatientInfo_Basic)
+        self.assertNotIn("\n", schema_json)
+        self.assertNotIn(": ", schema_json)
+        self.assertEqual(json.loads(schema_json), PatientInfo_Basic.model_json_schema())
+        # 同じオブジェクトが返される (再計算されない)
+        self.assertIs(get_schema_dict(PatientInfo_Basic), get_schema_dict(PatientInfo_Basic))
+
+
+class TestSelectRelevantPrior(unittest.TestCase):
+
+    def test_only_dependency_fields_without_null_are_kept(self):
+        basic_field = next(iter(PatientInfo_Basic.model_fields))
+        adl_field, adl_null_field = list(PatientInfo_ADL.model_fields)[:2]
+        movement_field = next(iter(PatientInfo_BasicMovements.model_fields))
+        prior = {basic_field: "x", adl_field: 5, adl_null_field: None, movement_field: "y"}
+
+        result = select_relevant_prior(prior, PatientInfo_Goal_Activity, PATIENT_INFO_EXTRACTION_GROUP_DEPENDENCIES)
+
+        # Goal_Activity は BasicMovements と ADL に依存し、Basic には依存しない
+        self.assertEqual(result, {adl_field: 5, movement_field: "y"})
+
+    def test_empty_prior(self):
+        self.assertEqual(select_relevant_prior({}, PatientInfo_Basic, PATIENT_INFO_EXTRACTION_GROUP_DEPENDENCIES), {})
+
+
+class TestPromptTokens(unittest.TestCase):
+
+    def test_estimate_counts_japanese_per_character(self):
+        self.assertEqual(estimate_prompt_tokens("患者情報"), 4)
+        self.assertEqual(estimate_prompt_tokens("abcdefgh"), 2)
+        self.assertLess(estimate_prompt_tokens(dumps_compact({"a": [1, 2]})),
+                        estimate_prompt_tokens(json.dumps({"a": [1, 2]}, indent=2)) + 1)
+
+    def test_stats_are_aggregated_per_group(self):
+        stats = PromptTokenStats()
+        stats.record("patient_info", "PatientInfo_Basic", 100, actual=90)
+        stats.record("patient_info", "PatientInfo_Basic", 120)
+        snapshot = stats.snapshot()["patient_info:PatientInfo_Basic"]
+        self.assertEqual(snapshot["calls"], 2)
+        self.assertEqual(snapshot["estimated_avg"], 110)
+        self.assertEqual(snapshot["actual_avg"], 90)
+
+    def test_prefill_seconds_are_accumulated(self):
+        stats = PromptTokenStats()
+        stats.record("ollama_plan", "Goals", 100, actual=20, prefill_seconds=0.5, saved_tokens=80, saved_prefill_seconds=2.0)
+        stats.record("ollama_plan", "Goals", 100, actual=100, prefill_seconds=2.5, saved_tokens=0, saved_prefill_seconds=0.0)
+        snapshot = stats.snapshot()["ollama_plan:Goals"]
+        self.assertAlmostEqual(snapshot["prefill_seconds_total"], 3.0)
+        self.assertEqual(snapshot["saved_tokens_total"], 80)
+        self.assertAlmostEqual(snapshot["saved_prefill_seconds_total"], 2.0)
+
+    def test_prefill_savings_are_measured_against_cold_baseline(self):
+        baselines = PrefillBaselines()
+        key = PrefillBaselines.make_key("model", [{"role": "user", "content": "患者データ"}])
+        other_key = PrefillBaselines.make_key("model", [{"role": "user", "content": "別の患者データ"}])
+        self.assertNotEqual(key, other_key)
+
+        # 最初のグループ (キャッシュなし) が基準になる: 1000トークンを2秒
+        self.assertEqual(baselines.measure(key, 1000, 2_000_000_000), (2.0, 0, 0.0))
+        # 2つ目のグループは200トークンだけ処理した -> 800トークン (1.6秒) 省けた
+        prefill_seconds, saved_tokens, saved_seconds = baselines.measure(key, 200, 500_000_000)
+        self.assertEqual((prefill_seconds, saved_tokens), (0.5, 800))
+        self.assertAlmostEqual(saved_seconds, 1.6)
+        # 基準より多く処理した場合は 0、別の共通部分は独立した基準を持つ
+        self.assertEqual(baselines.measure(key, 1200, 2_400_000_000)[1], 0)
+        self.assertEqual(baselines.measure(other_key, 300, 600_000_000), (0.6, 0, 0.0))
+        # 実測値がなければ何も計算しない
+        self.assertEqual(baselines.measure(key, None, None), (None, None, None))
+
+
+if __name__ == "__main__":
+    unittest.main()
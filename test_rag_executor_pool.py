@@ -0,0 +1,104 @@
+# test_rag_executor_pool.py
+
+import os
+import tempfile
+import time
+import unittest
+
+from rag_executor_pool import PipelineNotAllowedError, RAGExecutorPool, discover_pipelines
+
+
+class StubExecutor:
+    def __init__(self, name):
+        self.name = name
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+    def get_cache_stats(self):
+        return {"result_cache": {"hits": 1, "misses": 1, "hit_rate": 0.5}}
+
+
+class RecordingFactory:
+    def __init__(self):
+        self.created = []
+
+    def __call__(self, name):
+        executor = StubExecutor(name)
+        self.created.append(executor)
+        return executor
+
+
+class TestRAGExecutorPool(unittest.TestCase):
+
+    def test_executor_is_reused(self):
+        factory = RecordingFactory()
+        loaded = []
+        pool = RAGExecutorPool(factory, max_size=2, idle_timeout_seconds=0, on_load=lambda n, s: loaded.append(n))
+        self.assertIs(pool.get("a"), pool.get("a"))
+        self.assertEqual(len(factory.created), 1)
+        self.assertEqual(loaded, ["a"])
+        self.assertEqual(pool.stats()["hits"], 1)
+
+    def test_cache_stats_per_pipeline(self):
+        pool = RAGExecutorPool(RecordingFactory(), max_size=2, idle_timeout_seconds=0)
+        pool.get("a")
+        pool.get("b")
+        stats = pool.cache_stats()
+        self.assertEqual(sorted(stats), ["a", "b"])
+        self.assertEqual(stats["a"]["result_cache"]["hit_rate"], 0.5)
+
+    def test_least_recently_used_executor_is_closed(self):
+        factory = RecordingFactory()
+        pool = RAGExecutorPool(factory, max_size=2, idle_timeout_seconds=0)
+        a = pool.get("a")
+        b = pool.get("b")
+        pool.get("a")  # b が最も長く使われていない状態にする
+        pool.get("c")
+
+        self.assertTrue(b.closed)
+        self.assertFalse(a.closed)
+        stats = pool.stats()
+        self.assertEqual(sorted(stats["pipelines"]), ["a", "c"])
+        self.assertEqual(stats["evictions"]["lru"], 1)
+
+    def test_leased_executor_is_closed_after_release(self):
+        pool = RAGExecutorPool(RecordingFactory(), max_size=1, idle_timeout_seconds=0)
+        with pool.lease("a") as a:
+            pool.get("b")
+            # 利用中のため、プールから外れても close() はまだ呼ばれない
+            self.assertFalse(a.closed)
+            self.assertNotIn("a", pool.stats()["pipelines"])
+        self.assertTrue(a.closed)
+
+    def test_idle_executor_is_evicted_unless_pinned(self):
+        pool = RAGExecutorPool(RecordingFactory(), max_size=3, idle_timeout_seconds=0.05, pinned=["keep"])
+        idle = pool.get("idle")
+        keep = pool.get("keep")
+        time.sleep(0.1)
+
+        # バックグラウンドのスレッドが先に解放している場合もあるため、結果の状態で確認する
+        pool.evict_idle()
+        self.assertTrue(idle.closed)
+        self.assertFalse(keep.closed)
+        self.assertEqual(pool.stats()["evictions"]["idle"], 1)
+
+    def test_pipeline_outside_allow_list_is_rejected(self):
+        factory = RecordingFactory()
+        pool = RAGExecutorPool(factory, idle_timeout_seconds=0, allowed_pipelines=["a"])
+        with self.assertRaises(PipelineNotAllowedError):
+            pool.get("../../other")
+        self.assertEqual(factory.created, [])
+        self.assertEqual(pool.stats()["rejected"], 1)
+
+    def test_discover_pipelines(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            os.makedirs(os.path.join(tmp, "with_config"))
+            open(os.path.join(tmp, "with_config", "config.yaml"), "w").close()
+            os.makedirs(os.path.join(tmp, "without_config"))
+            self.assertEqual(discover_pipelines(tmp), ["with_config"])
+
+
+if __name__ == "__main__":
+    unittest.main()
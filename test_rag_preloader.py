@@ -0,0 +1,73 @@
+# test_rag_preloader.py
+
+import unittest
+
+from rag_preloader import RAGPreloader
+
+
+class StubExecutor:
+    def __init__(self, fail_warm_up=False):
+        self.fail_warm_up = fail_warm_up
+        self.warm_up_calls = 0
+
+    def warm_up(self):
+        self.warm_up_calls += 1
+        if self.fail_warm_up:
+            raise RuntimeError("warm-up failure")
+        return {"retriever": 0.0}
+
+
+class TestRAGPreloader(unittest.TestCase):
+
+    def test_pipelines_are_loaded_in_background_and_warmed_up(self):
+        executors = {"a": StubExecutor(), "b": StubExecutor()}
+        preloader = RAGPreloader(executors.__getitem__, ["a", "b"])
+        self.assertFalse(preloader.status()["ready"])
+
+        preloader.start().join(timeout=5)
+
+        status = preloader.status()
+        self.assertTrue(status["ready"])
+        for name in ("a", "b"):
+            self.assertEqual(status["pipelines"][name]["state"], "ready")
+            self.assertIn("load_seconds", status["pipelines"][name])
+            self.assertIn("warm_up_seconds", status["pipelines"][name])
+            self.assertEqual(executors[name].warm_up_calls, 1)
+
+    def test_failed_pipeline_is_not_ready(self):
+        def get_executor(name):
+            if name == "broken":
+                raise FileNotFoundError("config.yaml がありません")
+            return StubExecutor()
+
+        preloader = RAGPreloader(get_executor, ["ok", "broken"])
+        preloader.run()
+
+        status = preloader.status()
+        self.assertFalse(status["ready"])
+        self.assertEqual(status["pipelines"]["ok"]["state"], "ready")
+        self.assertEqual(status["pipelines"]["broken"]["state"], "failed")
+        self.assertIn("config.yaml", status["pipelines"]["broken"]["error"])
+
+    def test_warm_up_failure_still_marks_ready(self):
+        preloader = RAGPreloader(lambda name: StubExecutor(fail_warm_up=True), ["a"])
+        preloader.run()
+        pipeline = preloader.status()["pipelines"]["a"]
+        self.assertEqual(pipeline["state"], "ready")
+        self.assertIn("warm_up_error", pipeline)
+
+    def test_empty_preload_list_is_ready_without_thread(self):
+        preloader = RAGPreloader(lambda name: StubExecutor(), [])
+        self.assertIsNone(preloader.start())
+        self.assertTrue(preloader.status()["ready"])
+
+    def test_lazily_loaded_pipeline_is_recorded(self):
+        preloader = RAGPreloader(lambda name: StubExecutor(), [])
+        preloader.record_loaded("lazy", 1.5)
+        pipeline = preloader.status()["pipelines"]["lazy"]
+        self.assertEqual(pipeline["state"], "ready")
+        self.assertFalse(pipeline["preloaded"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,61 @@
+# test_rag_result_cache.py
+
+import os
+import tempfile
+import time
+import unittest
+
+from rag_result_cache import RAGResultCache, fingerprint_paths
+
+
+class TestRAGResultCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache = RAGResultCache(directory=os.path.join(self.tmp_dir.name, "rag"), ttl_seconds=60)
+
+    def tearDown(self):
+        self.cache.cache.close()
+        self.tmp_dir.cleanup()
+
+    def test_key_ignores_dict_order(self):
+        """患者情報の辞書のキー順が違っても同じキーになることを確認"""
+        key1 = RAGResultCache.make_key({"a": 1, "b": {"x": 1, "y": 2}}, "p", "cfg", "idx")
+        key2 = RAGResultCache.make_key({"b": {"y": 2, "x": 1}, "a": 1}, "p", "cfg", "idx")
+        self.assertEqual(key1, key2)
+
+    def test_key_changes_with_config_and_index(self):
+        """パイプライン名・設定・インデックスのいずれかが変わるとキーが変わることを確認"""
+        base = RAGResultCache.make_key({"a": 1}, "p", "cfg", "idx")
+        self.assertNotEqual(base, RAGResultCache.make_key({"a": 1}, "p2", "cfg", "idx"))
+        self.assertNotEqual(base, RAGResultCache.make_key({"a": 1}, "p", "cfg2", "idx"))
+        self.assertNotEqual(base, RAGResultCache.make_key({"a": 1}, "p", "cfg", "idx2"))
+        self.assertNotEqual(base, RAGResultCache.make_key({"a": 2}, "p", "cfg", "idx"))
+
+    def test_get_set_and_stats(self):
+        """保存した結果が取得でき、ヒット・ミス件数が数えられることを確認"""
+        result = {"answer": {"main_risks_txt": "転倒リスク"}, "contexts": []}
+        self.assertIsNone(self.cache.get("k"))
+        self.cache.set("k", result)
+        self.assertEqual(self.cache.get("k"), result)
+        stats = self.cache.stats()
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["misses"], 1)
+        self.assertEqual(stats["entries"], 1)
+
+    def test_fingerprint_changes_when_index_updated(self):
+        """インデックスファイルが更新されると指紋が変わることを確認"""
+        index_dir = os.path.join(self.tmp_dir.name, "index")
+        os.makedirs(index_dir)
+        index_path = os.path.join(index_dir, "index.bin")
+        with open(index_path, "wb") as f:
+            f.write(b"v1")
+        before = fingerprint_paths([index_dir])
+        time.sleep(0.01)
+        with open(index_path, "wb") as f:
+            f.write(b"v2-updated")
+        self.assertNotEqual(before, fingerprint_paths([index_dir]))
+
+
+if __name__ == "__main__":
+    unittest.main()
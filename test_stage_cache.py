@@ -0,0 +1,74 @@
+# test_stage_cache.py
+
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+# Rehab_RAGライブラリへのパスを追加
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "Rehab_RAG"))
+from rag_components.caches.stage_cache import StageCache
+
+
+class TestStageCache(unittest.TestCase):
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = StageCache("test_lru", max_entries=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        self.assertEqual(cache.get("a"), 1)  # a を最近使ったものにする
+        cache.set("c", 3)
+
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(cache.get("c"), 3)
+        stats = cache.stats()
+        self.assertEqual(stats["entries"], 2)
+        self.assertEqual((stats["hits"], stats["misses"]), (3, 1))
+
+    def test_expired_entry_is_a_miss(self):
+        cache = StageCache("test_ttl", ttl_seconds=0.05)
+        cache.set("a", [0.1, 0.2])
+        self.assertEqual(cache.get("a"), [0.1, 0.2])
+        time.sleep(0.1)
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.stats()["entries"], 0)
+
+    def test_no_ttl_by_default(self):
+        cache = StageCache("test_no_ttl", ttl_seconds=0)
+        self.assertIsNone(cache.stats()["ttl_seconds"])
+
+    def test_make_key_is_stable(self):
+        key = StageCache.make_key("model", "所見テキスト", {"b": 1, "a": 2})
+        self.assertEqual(key, StageCache.make_key("model", "所見テキスト", {"a": 2, "b": 1}))
+        self.assertNotEqual(key, StageCache.make_key("model", "所見テキスト。", {"a": 2, "b": 1}))
+        self.assertNotEqual(key, StageCache.make_key("other-model", "所見テキスト", {"a": 2, "b": 1}))
+        self.assertEqual(len(key), 64)
+
+    def test_get_or_compute_calls_function_once(self):
+        cache = StageCache("test_compute")
+        calls = []
+        compute = lambda: calls.append(1) or "hyde"
+        self.assertEqual(cache.get_or_compute("k", compute), "hyde")
+        self.assertEqual(cache.get_or_compute("k", compute), "hyde")
+        self.assertEqual(len(calls), 1)
+
+    def test_disk_fallback_after_memory_eviction_and_restart(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = StageCache("test_disk", max_entries=1, disk_dir=tmp)
+            cache.set("a", {"scores": [1.0]})
+            cache.set("b", {"scores": [2.0]})  # a はメモリから追い出される
+            self.assertEqual(cache.get("a"), {"scores": [1.0]})
+            self.assertEqual(cache.stats()["disk_hits"], 1)
+            cache._disk.close()
+
+            # プロセス再起動に相当: 新しいインスタンスでもディスクから読み戻せる
+            restarted = StageCache("test_disk", max_entries=1, disk_dir=tmp)
+            self.assertEqual(restarted.get("b"), {"scores": [2.0]})
+            self.assertEqual(restarted.stats()["disk_hits"], 1)
+            restarted._disk.close()
+
+
+if __name__ == "__main__":
+    unittest.main()